@@ -0,0 +1,137 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime
+from typing import Any, Protocol
+
+from jose import JWTError
+from jose import jwt as jose_jwt
+
+try:
+    import jwt as pyjwt
+except ImportError:  # PyJWT is optional
+    pyjwt = None
+
+ALGORITHM = 'HS256'
+TIME_CLAIMS = ('exp', 'iat', 'nbf')
+
+
+class InvalidToken(Exception):
+    '''Token is malformed, badly signed or expired.'''
+
+
+class JWTBackend(Protocol):
+    '''HS256 encoding and verified decoding of JWT claims.'''
+
+    def encode(self, claims: dict, key: str) -> str: ...
+
+    def decode(self, token: str, key: str) -> dict: ...
+
+
+class JoseBackend:
+    '''python-jose, the reference implementation.'''
+
+    def encode(self, claims: dict, key: str) -> str:
+        return jose_jwt.encode(claims, key, algorithm=ALGORITHM)
+
+    def decode(self, token: str, key: str) -> dict:
+        try:
+            return jose_jwt.decode(token, key, algorithms=[ALGORITHM])
+        except JWTError as error:
+            raise InvalidToken(str(error)) from error
+
+
+class PyJWTBackend:
+    '''PyJWT, if installed.'''
+
+    def __init__(self) -> None:
+        if pyjwt is None:
+            raise RuntimeError('JWT_BACKEND=pyjwt requires PyJWT')
+
+    def encode(self, claims: dict, key: str) -> str:
+        return pyjwt.encode(claims, key, algorithm=ALGORITHM)
+
+    def decode(self, token: str, key: str) -> dict:
+        try:
+            return pyjwt.decode(token, key, algorithms=[ALGORITHM])
+        except pyjwt.PyJWTError as error:
+            raise InvalidToken(str(error)) from error
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+class HmacBackend:
+    '''
+    HS256 on the standard library only: hmac, json and base64.
+
+    Supports exactly what this service issues, compact HS256 tokens
+    with optional exp and nbf, without the generic JOSE machinery.
+    '''
+
+    header = _b64encode(
+        json.dumps(
+            {'alg': ALGORITHM, 'typ': 'JWT'}, separators=(',', ':')
+        ).encode('utf-8')
+    )
+
+    def encode(self, claims: dict, key: str) -> str:
+        claims = {
+            name: (
+                int(value.timestamp())
+                if name in TIME_CLAIMS and isinstance(value, datetime)
+                else value
+            )
+            for name, value in claims.items()
+        }
+        payload = _b64encode(
+            json.dumps(claims, separators=(',', ':')).encode('utf-8')
+        )
+        signing_input = self.header + b'.' + payload
+        signature = hmac.new(
+            key.encode('utf-8'), signing_input, hashlib.sha256
+        ).digest()
+        return (signing_input + b'.' + _b64encode(signature)).decode('ascii')
+
+    def decode(self, token: str, key: str) -> dict:
+        try:
+            signing_input, signature = token.encode('ascii').rsplit(b'.', 1)
+            header, payload = signing_input.split(b'.')
+            expected = hmac.new(
+                key.encode('utf-8'), signing_input, hashlib.sha256
+            ).digest()
+            if not hmac.compare_digest(_b64decode(signature), expected):
+                raise InvalidToken('signature verification failed')
+            if json.loads(_b64decode(header)).get('alg') != ALGORITHM:
+                raise InvalidToken('unexpected algorithm')
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, UnicodeError) as error:
+            raise InvalidToken(str(error)) from error
+        if not isinstance(claims, dict):
+            raise InvalidToken('claims are not an object')
+        now = time.time()
+        if 'exp' in claims and not now < _numeric(claims['exp']):
+            raise InvalidToken('signature has expired')
+        if 'nbf' in claims and now < _numeric(claims['nbf']):
+            raise InvalidToken('token is not yet valid')
+        return claims
+
+
+def _numeric(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise InvalidToken('time claims must be numbers')
+    return value
+
+
+BACKENDS = {
+    'jose': JoseBackend,
+    'pyjwt': PyJWTBackend,
+    'hmac': HmacBackend,
+}
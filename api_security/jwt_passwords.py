@@ -1,64 +1,206 @@
-import os
+import asyncio
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from http import HTTPStatus
 from typing import Annotated, Union
 
+import anyio
 import bcrypt
-from dotenv import load_dotenv
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
 
+import tracing
+from config import get_settings
 from sql_app import crud, schemas
 from sql_app.database import AsyncSession, get_session
 
-load_dotenv()
+from .jwt_backends import BACKENDS, InvalidToken, JWTBackend
 
-SECRET_KEY = os.getenv('SECRET_KEY')
-ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRES_MINS = 60
 DEFAULT_EXPIRE_TIME = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
 
 
+class VerifiedTokenCache:
+    '''
+    Claims of already verified tokens, least recently used evicted.
+
+    Entries are keyed by the secret key as well as the token, so a
+    rotated SECRET_KEY never matches tokens verified with the old one,
+    and are only returned until the token's exp.
+    '''
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[tuple[str, str], dict] = OrderedDict()
+
+    def get(self, token: str, key: str) -> Union[dict, None]:
+        entry = (key, token)
+        claims = self._entries.get(entry)
+        if claims is None:
+            return None
+        if not time.time() < claims['exp']:
+            del self._entries[entry]
+            return None
+        self._entries.move_to_end(entry)
+        return claims
+
+    def put(self, token: str, key: str, claims: dict, max_size: int) -> None:
+        # Tokens without a numeric exp would stay valid forever.
+        if max_size <= 0 or not isinstance(claims.get('exp'), (int, float)):
+            return
+        self._entries[(key, token)] = claims
+        self._entries.move_to_end((key, token))
+        while len(self._entries) > max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+token_cache = VerifiedTokenCache()
+
+
+@lru_cache
+def get_backend(name: str) -> JWTBackend:
+    '''Returns the JWT backend registered under the name.'''
+    return BACKENDS[name]()
+
+
+def decode_token(token: str) -> dict:
+    '''
+    Returns the verified claims of the token, from the cache if it was
+    verified before. Raises InvalidToken otherwise.
+    '''
+    settings = get_settings()
+    claims = token_cache.get(token, settings.secret_key)
+    if claims is None:
+        claims = get_backend(settings.jwt_backend).decode(
+            token, settings.secret_key
+        )
+        token_cache.put(
+            token, settings.secret_key, claims, settings.jwt_cache_size
+        )
+    return claims
+
+
 async def check_jwt_token(
     token: Annotated[str, Depends(oauth2_scheme)],
     session: AsyncSession = Depends(get_session),
 ):
-    '''Function checks whether or not the token is valid.'''
-    credentials_exception = HTTPException(
-        status_code=HTTPStatus.UNAUTHORIZED,
-        detail='could not validate credentials',
-        headers={'WWW-Authenticate': 'Bearer'},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    '''
+    Function checks whether or not the token is valid.
+
+    The admin is read from the primary: a lagging replica would still
+    accept an admin that was just removed.
+    '''
+    with tracing.span('check_jwt_token'):
+        credentials_exception = HTTPException(
+            status_code=HTTPStatus.UNAUTHORIZED,
+            detail='could not validate credentials',
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+        try:
+            payload = decode_token(token)
+        except InvalidToken:
+            raise credentials_exception
         username: str = payload.get('sub')
         if username is None:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    admin = await crud.get_user_admin(
-        session=session, type=crud.QueryTypes.ADMIN, login=username
-    )
-    if admin is None:
-        raise credentials_exception
-    return admin
+        admin = await crud.get_user_admin(
+            session=session, type=crud.QueryTypes.ADMIN, login=username
+        )
+        if admin is None:
+            raise credentials_exception
+        return admin
+
+
+class PasswordChecker:
+    '''
+    Runs bcrypt checks in worker threads, LOGIN_BCRYPT_CONCURRENCY at
+    once, so a flood of logins neither blocks the event loop nor takes
+    every core. Checks beyond LOGIN_MAX_PENDING waiting ones are
+    refused.
+    '''
+
+    def __init__(self) -> None:
+        self._limiter = None
+        self._loop = None
+
+    def _get_limiter(self) -> anyio.CapacityLimiter:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._limiter = anyio.CapacityLimiter(
+                get_settings().login_bcrypt_concurrency
+            )
+            self._loop = loop
+        return self._limiter
+
+    def busy(self) -> bool:
+        limiter = self._get_limiter()
+        return (
+            limiter.statistics().tasks_waiting
+            >= get_settings().login_max_pending
+        )
+
+    async def check(self, password: str, hashed_pass: bytes) -> bool:
+        with tracing.span('bcrypt.checkpw'):
+            return await anyio.to_thread.run_sync(
+                verify_password,
+                password,
+                hashed_pass,
+                limiter=self._get_limiter(),
+            )
+
+
+password_checker = PasswordChecker()
+
+
+class FirstAdmin:
+    '''
+    The first admin once it is known to exist, so POST /superuser
+    answers without querying the database or hashing.
+    '''
+
+    def __init__(self) -> None:
+        self.admin: Union[schemas.AdminUser, None] = None
+
+    def clear(self) -> None:
+        self.admin = None
+
+
+first_admin = FirstAdmin()
 
 
 async def auth_admin(
     session: AsyncSession, username: str, password: str
 ) -> schemas.AdminUser:
-    '''Function that checks whether or not a user is an admin based on presented login and password.'''
+    '''
+    Function that checks whether or not a user is an admin based on
+    presented login and password.
+
+    Raises a 503 HTTPException when too many password checks are
+    already waiting.
+    '''
+    if password_checker.busy():
+        raise HTTPException(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            detail='too many logins in progress, retry later',
+            headers={'Retry-After': str(get_settings().shed_retry_after)},
+        )
     admin = await crud.get_user_admin(
         session=session,
         type=crud.QueryTypes.ADMIN,
         login=username,
     )
+    # Gives the connection back to the pool while waiting for bcrypt;
+    # closing detaches the admin with its attributes loaded.
+    await session.close()
     if admin is None:
         return False
-    if not verify_password(password, admin.password):
+    if not await password_checker.check(password, admin.password):
         return False
     return admin
 
@@ -80,5 +222,8 @@ def create_access_token(
             minutes=DEFAULT_EXPIRE_TIME
         )
     to_encode.update({'exp': expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    settings = get_settings()
+    encoded_jwt = get_backend(settings.jwt_backend).encode(
+        to_encode, settings.secret_key
+    )
     return encoded_jwt
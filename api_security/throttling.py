@@ -0,0 +1,260 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from typing import Literal
+
+from fastapi import Depends, HTTPException
+
+from config import get_settings
+from sql_app import models
+from sql_app.database import on_pool_wait
+
+from . import jwt_passwords
+
+RouteClass = Literal['read', 'write', 'lock', 'login']
+# Route classes never shed under load.
+CRITICAL_ROUTE_CLASSES = {'lock'}
+# Weight of the newest sample in the moving averages.
+EWMA_ALPHA = 0.2
+LOOP_LAG_SAMPLE_INTERVAL = 0.1
+MAX_BUCKETS = 10_000
+
+
+class TokenBucket:
+    '''Classic token bucket refilled continuously at `rate` per second.'''
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        '''
+        Takes a token. Returns 0 on success, otherwise the number of
+        seconds until a token becomes available.
+        '''
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    '''
+    Token buckets per (admin login, route class), or per (client IP,
+    'login') for POST /token, least recent evicted.
+    '''
+
+    def __init__(self, max_buckets: int = MAX_BUCKETS) -> None:
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict[tuple[str, str], TokenBucket] = (
+            OrderedDict()
+        )
+
+    def take(self, login: str, route_class: RouteClass) -> float:
+        settings = get_settings()
+        rate = getattr(settings, f'rate_limit_{route_class}_per_second')
+        if rate <= 0:
+            return 0.0
+        key = (login, route_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            burst = getattr(settings, f'rate_limit_{route_class}_burst')
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket.take()
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+class LoadMonitor:
+    '''
+    Tracks event loop lag and database pool wait time as moving averages.
+
+    Loop lag is sampled by a background task started on first use on
+    the running loop; pool waits are reported by sql_app.database.
+    '''
+
+    def __init__(self) -> None:
+        self.loop_lag = 0.0
+        self.pool_wait = 0.0
+        self._sampler = None
+
+    def observe_pool_wait(self, seconds: float) -> None:
+        self.pool_wait += EWMA_ALPHA * (seconds - self.pool_wait)
+
+    async def _sample_loop_lag(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_SAMPLE_INTERVAL)
+            lag = time.perf_counter() - started - LOOP_LAG_SAMPLE_INTERVAL
+            self.loop_lag += EWMA_ALPHA * (max(lag, 0.0) - self.loop_lag)
+
+    def ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._sampler is None or self._sampler.get_loop() is not loop:
+            self._sampler = loop.create_task(self._sample_loop_lag())
+
+    async def stop(self) -> None:
+        '''Cancels the loop lag sampler; the next use starts it again.'''
+        if self._sampler is not None:
+            self._sampler.cancel()
+        self._sampler = None
+
+    def overloaded(self) -> bool:
+        settings = get_settings()
+        return (
+            self.loop_lag > settings.shed_loop_lag_seconds
+            or self.pool_wait > settings.shed_pool_wait_seconds
+        )
+
+
+class LoginThrottle:
+    '''
+    Failed login attempts per key (a login or a client IP) with
+    exponential backoff, least recently failed evicted.
+    '''
+
+    def __init__(self, max_entries: int = MAX_BUCKETS) -> None:
+        self.max_entries = max_entries
+        # key -> [failures, blocked until, last failure]
+        self._failures: OrderedDict[str, list[float]] = OrderedDict()
+
+    def retry_after(self, *keys: str) -> float:
+        '''Seconds until all the keys may try again, 0 if they may now.'''
+        now = time.monotonic()
+        ttl = get_settings().login_failures_ttl_seconds
+        wait = 0.0
+        for key in keys:
+            entry = self._failures.get(key)
+            if entry is None:
+                continue
+            if now - entry[2] > ttl:
+                del self._failures[key]
+                continue
+            wait = max(wait, entry[1] - now)
+        return wait
+
+    def failed(self, key: str, free_failures: int) -> None:
+        settings = get_settings()
+        now = time.monotonic()
+        entry = self._failures.get(key)
+        if entry is None or now - entry[2] > (
+            settings.login_failures_ttl_seconds
+        ):
+            entry = self._failures[key] = [0, now, now]
+        entry[0] += 1
+        entry[2] = now
+        extra = entry[0] - free_failures
+        if extra > 0:
+            entry[1] = now + min(
+                settings.login_backoff_max_seconds,
+                settings.login_backoff_base_seconds * 2 ** (extra - 1),
+            )
+        self._failures.move_to_end(key)
+        if len(self._failures) > self.max_entries:
+            self._failures.popitem(last=False)
+
+    def succeeded(self, key: str) -> None:
+        self._failures.pop(key, None)
+
+    def clear(self) -> None:
+        self._failures.clear()
+
+
+rate_limiter = RateLimiter()
+load_monitor = LoadMonitor()
+login_throttle = LoginThrottle()
+on_pool_wait(load_monitor.observe_pool_wait)
+
+
+def throttle(route_class: RouteClass):
+    '''
+    Builds a dependency applying load shedding, then authenticating the
+    admin (check_jwt_token) and applying the admin's rate limit for the
+    route class.
+
+    Non-critical route classes get 503 with Retry-After while the worker
+    is overloaded, before the token is checked, so shed requests never
+    take a database connection; an admin over its rate gets 429 with
+    Retry-After.
+    '''
+
+    async def shed() -> None:
+        load_monitor.ensure_started()
+        if route_class not in CRITICAL_ROUTE_CLASSES and (
+            load_monitor.overloaded()
+        ):
+            raise HTTPException(
+                status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+                detail='server is overloaded, retry later',
+                headers={'Retry-After': str(get_settings().shed_retry_after)},
+            )
+
+    # FastAPI solves sub-dependencies in the order of the parameters.
+    async def dependency(
+        _: None = Depends(shed),
+        admin: models.Admin = Depends(jwt_passwords.check_jwt_token),
+    ) -> models.Admin:
+        wait = rate_limiter.take(admin.login, route_class)
+        if wait:
+            raise HTTPException(
+                status_code=HTTPStatus.TOO_MANY_REQUESTS,
+                detail='rate limit exceeded',
+                headers={'Retry-After': str(math.ceil(wait))},
+            )
+        return admin
+
+    return dependency
+
+
+def _login_keys(client: str, login: str) -> tuple[str, str]:
+    return f'login:{login}', f'ip:{client}'
+
+
+def check_login_attempt(client: str, login: str) -> None:
+    '''
+    Decides whether a POST /token attempt may check a password: 503
+    while the worker is overloaded, 429 over the client's attempt rate
+    or while the login or the client is backing off after failures.
+    All come with Retry-After.
+    '''
+    load_monitor.ensure_started()
+    if load_monitor.overloaded():
+        raise HTTPException(
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+            detail='server is overloaded, retry later',
+            headers={'Retry-After': str(get_settings().shed_retry_after)},
+        )
+    wait = login_throttle.retry_after(*_login_keys(client, login))
+    if not wait:
+        wait = rate_limiter.take(client, 'login')
+    if wait:
+        raise HTTPException(
+            status_code=HTTPStatus.TOO_MANY_REQUESTS,
+            detail='too many login attempts',
+            headers={'Retry-After': str(math.ceil(wait))},
+        )
+
+
+def login_failed(client: str, login: str) -> None:
+    settings = get_settings()
+    login_key, client_key = _login_keys(client, login)
+    login_throttle.failed(login_key, settings.login_free_failures)
+    login_throttle.failed(client_key, settings.login_ip_free_failures)
+
+
+def login_succeeded(client: str, login: str) -> None:
+    '''Forgets the login's failures; the client's keep counting.'''
+    login_throttle.succeeded(_login_keys(client, login)[0])
@@ -0,0 +1,195 @@
+import os
+from functools import lru_cache
+from typing import Literal, Optional
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+
+class Settings(BaseModel):
+    '''
+    Typed application settings.
+
+    Every field is read from the environment variable of the same name
+    in upper case (a .env file is loaded first, if present).
+    '''
+
+    db_url: Optional[str] = None
+    test_db_url: Optional[str] = None
+    postgres_user: Optional[str] = None
+    postgres_password: Optional[str] = None
+    postgres_db: Optional[str] = None
+    postgres_host: Optional[str] = None
+    first_db_admin_login: Optional[str] = None
+    first_db_admin_password: Optional[str] = None
+    secret_key: Optional[str] = None
+    # JWT implementation (see api_security.jwt_backends) and the number
+    # of verified tokens cached per worker; 0 disables the cache.
+    jwt_backend: Literal['jose', 'pyjwt', 'hmac'] = 'jose'
+    jwt_cache_size: int = 10_000
+    # Seconds to wait for in-flight requests on shutdown.
+    shutdown_drain_seconds: float = 20
+    # Production server (see server.py).
+    server_host: str = '0.0.0.0'
+    server_port: int = 8080
+    web_concurrency: Optional[int] = None
+    # Directory the workers share GET /metrics through (see
+    # metrics.SharedMetrics), a temporary one set by server.py with
+    # several workers; None reports the serving worker only.
+    metrics_dir: Optional[str] = None
+    metrics_write_interval_seconds: float = 1
+    server_backlog: int = 2048
+    # Longer than the load balancer idle timeout, so the balancer
+    # closes idle connections and never reuses one uvicorn has closed.
+    server_keep_alive: int = 75
+    # Comma separated addresses (or '*') of the proxies whose
+    # X-Forwarded-For is trusted as the client IP, which the login and
+    # anonymous rate limits key on.
+    forwarded_allow_ips: str = '127.0.0.1'
+    # Connection budget of one replica across all its workers; keep
+    # replicas * budget under Postgres max_connections.
+    db_connections_per_replica: int = 20
+    # Pool of each engine of a worker, set by server.py from the
+    # budget above.
+    db_pool_size: Optional[int] = None
+    db_max_overflow: Optional[int] = None
+    # DB_URL (and replicas) point at PgBouncer in transaction pooling
+    # mode: no statement caching, NullPool unless a small pool is set.
+    db_pgbouncer: bool = False
+    db_pgbouncer_pool_size: int = 0
+    # Direct Postgres url for migrations and partition maintenance,
+    # which hold session advisory locks; required with DB_PGBOUNCER.
+    db_migration_url: Optional[str] = None
+    # Direct Postgres url for LISTEN, which PgBouncer cannot carry.
+    db_listen_url: Optional[str] = None
+    # Comma separated urls of the databases the user table is sharded
+    # over by project_id (see sql_app.database); DB_URL keeps the rest.
+    db_shard_urls: Optional[str] = None
+    # JSON object placing projects on shards by index, e.g. {"7": 1};
+    # other projects go to shard project_id % shard count.
+    db_shard_map: Optional[str] = None
+    # Comma separated urls of read replicas for read-only queries.
+    db_replica_urls: Optional[str] = None
+    db_replica_max_lag_seconds: float = 5
+    # Back-off before a failed replica is tried again.
+    db_replica_retry_seconds: float = 30
+    # In-process index of free bots used by POST /users/claim.
+    availability_index: bool = False
+    availability_index_refresh_seconds: float = 60
+    # Where responses of requests with an Idempotency-Key are kept:
+    # 'memory' (per worker) or 'postgres' (shared by all workers). By
+    # default memory with one worker, postgres (set by server.py) with
+    # several.
+    idempotency_store: Optional[Literal['memory', 'postgres']] = None
+    idempotency_ttl_seconds: float = 3600
+    # A key whose request is still in flight after this long (its worker
+    # died) may be reused.
+    idempotency_lease_seconds: float = 120
+    idempotency_max_entries: int = 100_000
+    # Token bucket per admin and route class; a rate of 0 disables it.
+    rate_limit_read_per_second: float = 20
+    rate_limit_read_burst: int = 40
+    rate_limit_write_per_second: float = 10
+    rate_limit_write_burst: int = 20
+    rate_limit_lock_per_second: float = 200
+    rate_limit_lock_burst: int = 400
+    # POST /token attempts per client IP.
+    rate_limit_login_per_second: float = 1
+    rate_limit_login_burst: int = 10
+    # Failed logins beyond the free ones block the login (or client IP)
+    # for BASE * 2 ** (extra failures) seconds, at most MAX; failures
+    # are forgotten TTL seconds after the last one.
+    login_free_failures: int = 5
+    login_ip_free_failures: int = 20
+    login_backoff_base_seconds: float = 1
+    login_backoff_max_seconds: float = 300
+    login_failures_ttl_seconds: float = 3600
+    # bcrypt checks run in threads, this many at once per worker; logins
+    # beyond LOGIN_MAX_PENDING waiting ones get 503.
+    login_bcrypt_concurrency: int = 1
+    login_max_pending: int = 16
+    # Non-lock requests get 503 while either average is above its limit.
+    shed_loop_lag_seconds: float = 0.2
+    shed_pool_wait_seconds: float = 0.5
+    shed_retry_after: int = 1
+    # Lock history writes (see sql_app.audit).
+    audit_batch_size: int = 500
+    audit_flush_interval: float = 1.0
+    audit_max_pending: int = 100_000
+    # Lock history partitions (see sql_app.partitions).
+    lock_history_partition: Literal['day', 'week'] = 'day'
+    lock_history_partitions_ahead: int = 7
+    lock_history_retention_days: int = 90
+    partition_maintenance_interval_seconds: float = 3600
+    # GET /stats/projects counts locks taken up to this long before the
+    # period from its start.
+    stats_lookback_hours: float = 24
+    # DDL of a maintenance pass gives up waiting for a lock after this
+    # long (0 waits forever); the next pass tries again.
+    partition_lock_timeout_seconds: float = 5
+    # Default lease extension of PATCH /users/{id}/renew_lock.
+    lease_seconds: float = 30
+    # Claim quotas (see sql_app.quotas): per-project max_locks and, with
+    # a CLAIM_CAPACITY, weighted fair shares of that many locks.
+    claim_quotas: bool = False
+    claim_capacity: int = 0
+    fair_share_window_seconds: float = 60
+    # Background jobs (see sql_app.jobs): runner tasks per worker (0
+    # runs none here), items per chunk transaction and the pause
+    # between chunks leaving room to the lock traffic.
+    job_workers: int = 1
+    job_chunk_size: int = 500
+    job_chunk_pause_seconds: float = 0
+    job_poll_seconds: float = 1
+    # A running job whose lease is not renewed for this long (its
+    # worker died) is resumed by another one.
+    job_lease_seconds: float = 60
+    job_max_attempts: int = 3
+    # Per-item errors kept with a job; the count goes on.
+    job_max_errors: int = 1000
+    # Migrations (see sql_app.migrate and sql_app.online_ddl): DDL gives
+    # up waiting for a table lock after this long instead of queueing
+    # the lock traffic behind it (0 waits forever), and the runner
+    # retries MIGRATION_RETRIES times, backing off from
+    # MIGRATION_RETRY_SECONDS.
+    migration_lock_timeout_seconds: float = 5
+    migration_retries: int = 5
+    migration_retry_seconds: float = 2
+    # Rows per transaction of batched backfills, and the pause between
+    # batches.
+    migration_backfill_batch_size: int = 5000
+    migration_backfill_pause_seconds: float = 0.1
+    # Tracing (see tracing.py): 'none', 'console', 'file' (JSON lines
+    # in TRACING_FILE) or 'otlp' (OTEL_EXPORTER_OTLP_* variables).
+    tracing_exporter: Literal['none', 'console', 'file', 'otlp'] = 'none'
+    tracing_sample_ratio: float = 1.0
+    tracing_file: str = 'traces.jsonl'
+    # Start tracemalloc with this many frames per traceback on startup,
+    # so request peaks are in the metrics from the first request
+    # (0 leaves it to POST /debug/memory/start).
+    memory_trace_frames: int = 0
+    # Rows changed more recently than this are left for the next
+    # GET /users/changes call; keep it above the longest write
+    # transaction.
+    changes_settle_seconds: float = 1.0
+
+    @classmethod
+    def from_env(cls) -> 'Settings':
+        load_dotenv()
+        return cls(
+            **{
+                name: os.environ[name.upper()]
+                for name in cls.model_fields
+                if name.upper() in os.environ
+            }
+        )
+
+
+@lru_cache
+def get_settings() -> Settings:
+    '''
+    Returns the settings, reading the environment on the first call only.
+
+    get_settings.cache_clear() forces a re-read (e.g. in tests).
+    '''
+    return Settings.from_env()
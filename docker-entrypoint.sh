@@ -1,4 +1,7 @@
 cd /app
-alembic upgrade head
+# Migrates DB_URL and the DB_SHARD_URLS shards; replicas starting
+# together wait for the one holding the migration lock.
+python -m sql_app.migrate
 
-uvicorn main:app --host 0.0.0.0 --port 8080
\ No newline at end of file
+# exec so the server is PID 1 and receives SIGTERM from the orchestrator.
+exec python server.py
\ No newline at end of file
@@ -4,12 +4,37 @@ from fastapi import FastAPI
 from fastapi_healthchecks.checks import Check, CheckResult
 from httpx import ASGITransport, AsyncClient
 
+from config import get_settings
+
 
 class AmIAlive(Check):
     async def __call__(self) -> CheckResult:
         return CheckResult(name='I\'m alive!', passed=True)
 
 
+class IsDatabaseReady(Check):
+    '''
+    PostgreSqlCheck built from the settings on the first probe,
+    so importing the app does not require database env vars.
+    '''
+
+    def __init__(self) -> None:
+        self._check = None
+
+    async def __call__(self) -> CheckResult:
+        if self._check is None:
+            from fastapi_healthchecks.checks.postgres import PostgreSqlCheck
+
+            settings = get_settings()
+            self._check = PostgreSqlCheck(
+                username=settings.postgres_user,
+                password=settings.postgres_password,
+                database=settings.postgres_db,
+                host=settings.postgres_host,
+            )
+        return await self._check()
+
+
 class IsSuperuserEndpointAlive(Check):
     def __init__(self, app: FastAPI) -> None:
         self._app = app
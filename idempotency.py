@@ -0,0 +1,350 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from typing import Union
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api_security.jwt_passwords import InvalidToken, decode_token
+from config import get_settings
+from sql_app.database import get_sessionmaker
+from sql_app.models import IdempotencyKey
+
+HEADER = b'idempotency-key'
+MAX_KEY_LENGTH = 255
+MUTATING_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+# Responses of requests that may succeed when retried as they are: the
+# key is released instead of replaying them (as for 5xx).
+TRANSIENT_STATUSES = {
+    HTTPStatus.UNAUTHORIZED,
+    HTTPStatus.REQUEST_TIMEOUT,
+    HTTPStatus.CONFLICT,
+    HTTPStatus.TOO_EARLY,
+    HTTPStatus.TOO_MANY_REQUESTS,
+}
+# Every how many saves expired keys are purged from Postgres.
+PURGE_EVERY = 1000
+
+
+@dataclass
+class StoredResponse:
+    fingerprint: str
+    status: Union[int, None] = None
+    content_type: Union[bytes, None] = None
+    body: bytes = b''
+
+    @property
+    def in_flight(self) -> bool:
+        return self.status is None
+
+
+class MemoryStore:
+    '''
+    Bounded in-process LRU of responses, expiring after the TTL (after
+    the lease while in flight).
+    '''
+
+    def __init__(self, ttl: float, max_entries: int, lease: float) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lease = lease
+        self._entries: OrderedDict[str, tuple[float, StoredResponse]] = (
+            OrderedDict()
+        )
+
+    async def reserve(
+        self, key: str, fingerprint: str
+    ) -> Union[StoredResponse, None]:
+        '''
+        Reserves the key for a new request.
+
+        Returns None if the request should run, or the stored (possibly
+        still in flight) entry if the key was already used.
+        '''
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            return entry[1]
+        self._entries[key] = (now + self.lease, StoredResponse(fingerprint))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return None
+
+    async def save(self, key: str, response: StoredResponse) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, response)
+
+    async def release(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+
+class PostgresStore:
+    '''Responses kept in the idempotency_key table, shared by all workers.'''
+
+    def __init__(self, ttl: float, lease: float) -> None:
+        self.ttl = ttl
+        self.lease = lease
+        self._saves = 0
+
+    async def reserve(
+        self, key: str, fingerprint: str
+    ) -> Union[StoredResponse, None]:
+        now = datetime.now()
+        table = IdempotencyKey.__table__
+        async with get_sessionmaker()() as session:
+            statement = insert(table).values(
+                key=key,
+                fingerprint=fingerprint,
+                created_at=now,
+                reserved_until=now + timedelta(seconds=self.lease),
+            )
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.key],
+                set_={
+                    'fingerprint': statement.excluded.fingerprint,
+                    'created_at': statement.excluded.created_at,
+                    'reserved_until': statement.excluded.reserved_until,
+                    'status': None,
+                    'content_type': None,
+                    'body': None,
+                },
+                # Expired, or left in flight by a worker that died.
+                where=or_(
+                    table.c.created_at < now - timedelta(seconds=self.ttl),
+                    and_(
+                        table.c.status.is_(None),
+                        table.c.reserved_until < now,
+                    ),
+                ),
+            ).returning(table.c.key)
+            reserved = await session.scalar(statement)
+            await session.commit()
+            if reserved is not None:
+                return None
+            row = (
+                await session.execute(
+                    select(IdempotencyKey).where(IdempotencyKey.key == key)
+                )
+            ).scalar_one()
+            return StoredResponse(
+                fingerprint=row.fingerprint,
+                status=row.status,
+                content_type=(
+                    row.content_type.encode('latin-1')
+                    if row.content_type is not None
+                    else None
+                ),
+                body=row.body or b'',
+            )
+
+    async def save(self, key: str, response: StoredResponse) -> None:
+        async with get_sessionmaker()() as session:
+            await session.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.key == key)
+                .values(
+                    status=response.status,
+                    content_type=(
+                        response.content_type.decode('latin-1')
+                        if response.content_type is not None
+                        else None
+                    ),
+                    body=response.body,
+                )
+            )
+            self._saves += 1
+            if self._saves % PURGE_EVERY == 0:
+                await session.execute(
+                    delete(IdempotencyKey).where(
+                        IdempotencyKey.created_at
+                        < datetime.now() - timedelta(seconds=self.ttl)
+                    )
+                )
+            await session.commit()
+
+    async def release(self, key: str) -> None:
+        async with get_sessionmaker()() as session:
+            await session.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.key == key)
+            )
+            await session.commit()
+
+
+def make_store() -> Union[MemoryStore, PostgresStore]:
+    settings = get_settings()
+    if settings.idempotency_store == 'postgres':
+        return PostgresStore(
+            ttl=settings.idempotency_ttl_seconds,
+            lease=settings.idempotency_lease_seconds,
+        )
+    return MemoryStore(
+        ttl=settings.idempotency_ttl_seconds,
+        max_entries=settings.idempotency_max_entries,
+        lease=settings.idempotency_lease_seconds,
+    )
+
+
+def _caller(authorization: bytes) -> bytes:
+    '''
+    The admin a request is made for: the JWT "sub", so that a token
+    refreshed before the retry keeps the key, or the raw Authorization
+    header when the token does not verify.
+    '''
+    scheme, _, token = authorization.decode('latin-1').partition(' ')
+    if scheme.lower() == 'bearer':
+        try:
+            login = decode_token(token).get('sub')
+        except InvalidToken:
+            login = None
+        if login is not None:
+            return b'sub:' + str(login).encode('utf-8')
+    return authorization
+
+
+async def _send_json(send: Send, status: int, detail: str) -> None:
+    body = json.dumps({'detail': detail}).encode('utf-8')
+    await send(
+        {
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode('latin-1')),
+            ],
+        }
+    )
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class IdempotencyMiddleware:
+    '''
+    Replays stored responses for mutating requests carrying an
+    Idempotency-Key header.
+
+    A key is scoped to the admin (the token's subject), the method,
+    the path and the query string. Reusing it within the TTL with the
+    same body returns the original response (with "Idempotent-Replayed:
+    true") without running the endpoint again; a different body is
+    rejected with 422 and a retry racing the original request with 409.
+    5xx and transient 4xx responses (TRANSIENT_STATUSES, e.g. 429) are
+    not stored, so those requests can be retried.
+    '''
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._store = None
+
+    @property
+    def store(self) -> Union[MemoryStore, PostgresStore]:
+        if self._store is None:
+            self._store = make_store()
+        return self._store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['method'] not in MUTATING_METHODS:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope['headers'])
+        idempotency_key = headers.get(HEADER)
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            await _send_json(
+                send, HTTPStatus.BAD_REQUEST, 'Idempotency-Key is too long'
+            )
+            return
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        key = hashlib.sha256(
+            b'\0'.join(
+                (
+                    _caller(headers.get(b'authorization', b'')),
+                    scope['method'].encode('latin-1'),
+                    scope['path'].encode('utf-8'),
+                    scope.get('query_string', b''),
+                    idempotency_key,
+                )
+            )
+        ).hexdigest()
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        stored = await self.store.reserve(key, fingerprint)
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                await _send_json(
+                    send,
+                    HTTPStatus.UNPROCESSABLE_ENTITY,
+                    'Idempotency-Key was used with a different request',
+                )
+            elif stored.in_flight:
+                await _send_json(
+                    send,
+                    HTTPStatus.CONFLICT,
+                    'a request with this Idempotency-Key is in progress',
+                )
+            else:
+                await self._replay(send, stored)
+            return
+
+        response = StoredResponse(fingerprint)
+        body_sent = False
+
+        async def replay_body() -> Message:
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def capture(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                response.status = message['status']
+                response.content_type = dict(message['headers']).get(
+                    b'content-type'
+                )
+            elif message['type'] == 'http.response.body':
+                response.body += message.get('body', b'')
+            await send(message)
+
+        try:
+            await self.app(scope, replay_body, capture)
+        except BaseException:
+            await self.store.release(key)
+            raise
+        if (
+            response.status is None
+            or response.status >= 500
+            or response.status in TRANSIENT_STATUSES
+        ):
+            await self.store.release(key)
+        else:
+            await self.store.save(key, response)
+
+    async def _replay(self, send: Send, stored: StoredResponse) -> None:
+        headers = [
+            (b'content-length', str(len(stored.body)).encode('latin-1')),
+            (b'idempotent-replayed', b'true'),
+        ]
+        if stored.content_type is not None:
+            headers.append((b'content-type', stored.content_type))
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': stored.status,
+                'headers': headers,
+            }
+        )
+        await send({'type': 'http.response.body', 'body': stored.body})
@@ -0,0 +1,121 @@
+import logging
+import time
+from http import HTTPStatus
+from typing import Awaitable, Callable
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+ShutdownHook = Callable[[], Awaitable[None]]
+
+_shutdown_hooks: list[ShutdownHook] = []
+
+
+def on_shutdown(hook: ShutdownHook) -> ShutdownHook:
+    '''
+    Registers a coroutine function run on lifespan shutdown, after
+    in-flight requests are drained and before the engine is disposed
+    (e.g. to flush buffered background writes). Usable as a decorator.
+    '''
+    _shutdown_hooks.append(hook)
+    return hook
+
+
+async def run_shutdown_hooks() -> None:
+    '''Runs the hooks in order; a failing hook does not stop the rest.'''
+    for hook in _shutdown_hooks:
+        try:
+            await hook()
+        except Exception:
+            logger.exception('shutdown hook %r failed', hook)
+
+
+class InFlightRequests:
+    '''Counter of HTTP requests currently being served.'''
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.draining = False
+        self._deadline = 0.0
+        self._started = 0.0
+
+    def started(self) -> None:
+        self.count += 1
+
+    def finished(self) -> None:
+        self.count -= 1
+
+    def drain(self, timeout: float) -> None:
+        '''
+        Stops accepting requests; the in-flight ones get up to `timeout`
+        seconds to finish (see drained).
+        '''
+        self.draining = True
+        self._started = time.monotonic()
+        self._deadline = self._started + timeout
+
+    def drained(self) -> bool:
+        '''
+        Whether draining is over: no requests are in flight anymore or
+        the deadline has passed.
+        '''
+        if not self.draining:
+            return False
+        now = time.monotonic()
+        if self.count == 0:
+            logger.info('drained requests in %.2fs', now - self._started)
+            return True
+        if now >= self._deadline:
+            logger.warning(
+                '%d requests still in flight after %.1fs of draining',
+                self.count,
+                now - self._started,
+            )
+            return True
+        return False
+
+
+in_flight_requests = InFlightRequests()
+
+
+class RequestDrainMiddleware:
+    '''
+    ASGI middleware that tracks in-flight HTTP requests.
+
+    Once draining has started (on SIGTERM, see server.DrainingServer),
+    new requests (readiness probes included) are refused with 503 and
+    "Connection: close", so clients and the load balancer move to
+    another replica while the requests already running are allowed to
+    finish.
+    '''
+
+    def __init__(
+        self, app: ASGIApp, requests: InFlightRequests = in_flight_requests
+    ) -> None:
+        self.app = app
+        self.requests = requests
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        if self.requests.draining:
+            await send(
+                {
+                    'type': 'http.response.start',
+                    'status': HTTPStatus.SERVICE_UNAVAILABLE,
+                    'headers': [
+                        (b'connection', b'close'),
+                        (b'retry-after', b'1'),
+                        (b'content-length', b'0'),
+                    ],
+                }
+            )
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        self.requests.started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.requests.finished()
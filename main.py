@@ -1,37 +1,98 @@
-import os
-from datetime import timedelta
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from http import HTTPStatus
-from typing import Annotated
+from typing import Annotated, Union
 
-from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Body, Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi_healthchecks.api.router import HealthcheckRouter, Probe
-from fastapi_healthchecks.checks.postgres import PostgreSqlCheck
 from fastapi_healthchecks.checks.settings import SettingsCheck
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
 
-from api_security import jwt_passwords
-from health_checks import AmIAlive, IsSuperuserEndpointAlive
-from sql_app import crud, schemas
-from sql_app.database import AsyncSession, get_session
-from sql_app.models import Admin, User
+from api_security import jwt_passwords, throttling
+from config import get_settings
+from health_checks import AmIAlive, IsDatabaseReady, IsSuperuserEndpointAlive
+from idempotency import IdempotencyMiddleware
+from lifecycle import (
+    RequestDrainMiddleware,
+    on_shutdown,
+    run_shutdown_hooks,
+)
+from memory import GroupBy, profiler, track_peak_memory
+from metrics import shared_metrics
+from negotiation import MsgPackRoute, negotiated
+from sql_app import crud, quotas, schemas
+from sql_app.audit import audit_writer
+from sql_app.availability import availability_index
+from sql_app.jobs import FINISHED, job_runner
+from sql_app.database import (
+    AsyncSession,
+    dispose_engine,
+    get_read_session,
+    get_session,
+    get_sessionmaker,
+    prepare_shards,
+)
+from sql_app.models import Admin, User, UserTombstone
+from sql_app.partitions import maintain_forever
+from tracing import TracingMiddleware, configure_tracing, shutdown_tracing
 
-load_dotenv()
+BULK_CREATE_LIMIT = 1000
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''
+    Loads the settings, sets up tracing (and tracemalloc with
+    MEMORY_TRACE_FRAMES), sets the user id sequences of the
+    DB_SHARD_URLS shards apart and starts background maintenance and
+    the JOB_WORKERS job runner tasks on startup.
+
+    On shutdown, which the server runs once requests are drained (see
+    server.DrainingServer), runs the shutdown hooks (flushing buffered
+    writes) and closes the connection pool.
+    '''
+    settings = get_settings()
+    configure_tracing()
+    if settings.memory_trace_frames:
+        profiler.start(settings.memory_trace_frames)
+    await prepare_shards()
+    if settings.availability_index:
+        await availability_index.start(
+            settings.availability_index_refresh_seconds
+        )
+    partition_maintenance = asyncio.create_task(maintain_forever())
+    shared_metrics.start(
+        settings.metrics_dir, settings.metrics_write_interval_seconds
+    )
+    job_runner.start(settings.job_workers)
+    yield
+    partition_maintenance.cancel()
+    await run_shutdown_hooks()
+    await availability_index.stop()
+    await dispose_engine()
+
+
+on_shutdown(job_runner.stop)
+on_shutdown(audit_writer.close)
+on_shutdown(shutdown_tracing)
+on_shutdown(throttling.load_monitor.stop)
+on_shutdown(shared_metrics.stop)
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = MsgPackRoute
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(RequestDrainMiddleware)
+app.add_middleware(TracingMiddleware)
 app.include_router(
     HealthcheckRouter(
         Probe(
             name='readiness',
-            checks=(
-                PostgreSqlCheck(
-                    username=os.getenv('POSTGRES_USER'),
-                    password=os.getenv('POSTGRES_PASSWORD'),
-                    database=os.getenv('POSTGRES_DB'),
-                    host=os.getenv('POSTGRES_HOST'),
-                ),
-            ),
+            checks=(IsDatabaseReady(),),
         ),
         Probe(
             name='liveness',
@@ -53,10 +114,14 @@ app.include_router(
 @app.get(
     '/users',
     response_model=list[schemas.User],
-    dependencies=[Depends(jwt_passwords.check_jwt_token)],
+    dependencies=[
+        Depends(throttling.throttle('read')),
+        Depends(track_peak_memory),
+    ],
 )
 async def get_user(
-    session: AsyncSession = Depends(get_session),
+    request: Request,
+    session: AsyncSession = Depends(get_read_session),
 ) -> list[schemas.User]:
     '''
     GET method users/ enpoint handler.
@@ -64,29 +129,84 @@ async def get_user(
     Returns a list of user data.
     '''
     users = await crud.get_users(session)
-    return [
-        schemas.User(
-            id=u.id,
-            login=u.login,
-            locktime=u.locktime,
-            created_at=u.created_at,
-            env=u.env,
-            domain=u.domain,
-            project_id=u.project_id,
-            password=u.password,
+    return negotiated(
+        request,
+        [schemas.User.model_validate(u) for u in users],
+    )
+
+
+@app.get(
+    '/users/changes',
+    response_model=schemas.UserChanges,
+    dependencies=[
+        Depends(throttling.throttle('read')),
+        Depends(track_peak_memory),
+    ],
+)
+async def get_user_changes(
+    request: Request,
+    since: Union[str, None] = None,
+    limit: int = Query(default=1000, ge=1, le=10000),
+    session: AsyncSession = Depends(get_session),
+) -> schemas.UserChanges:
+    '''
+    GET method users/changes enpoint handler.
+    Optional "since" query parameter is the cursor returned by the
+    previous call; without it the feed starts from the beginning.
+
+    Returns users changed after the cursor, the ids of those purged,
+    the next cursor and whether more changes are immediately available.
+    Reads the primary, so rows are never missing because of replica lag.
+    '''
+    try:
+        position = crud.decode_cursor(since) if since else None
+    except ValueError:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail='invalid cursor'
         )
-        for u in users
-    ]
+    changes = await crud.get_user_changes(
+        session,
+        since=position,
+        limit=limit,
+        settle_seconds=get_settings().changes_settle_seconds,
+    )
+    if changes:
+        since = crud.encode_cursor(*crud.change_position(changes[-1]))
+    changes = schemas.UserChanges(
+        users=[
+            schemas.User.model_validate(change)
+            for change in changes
+            if isinstance(change, User)
+        ],
+        deleted=[
+            change.id
+            for change in changes
+            if isinstance(change, UserTombstone)
+        ],
+        cursor=since,
+        has_more=len(changes) == limit,
+    )
+    return negotiated(request, changes)
+
+
+def _quota_exceeded(error: quotas.QuotaExceeded) -> HTTPException:
+    return HTTPException(
+        status_code=HTTPStatus.TOO_MANY_REQUESTS,
+        detail=f'project quota exceeded: {error.reason}',
+        headers={'Retry-After': str(get_settings().shed_retry_after)},
+    )
 
 
 @app.post(
     '/users',
     response_model=schemas.User,
     status_code=HTTPStatus.CREATED,
-    dependencies=[Depends(jwt_passwords.check_jwt_token)],
+    dependencies=[Depends(throttling.throttle('write'))],
 )
 async def create_user(
-    user: schemas.UserCreate, session: AsyncSession = Depends(get_session)
+    request: Request,
+    user: schemas.UserCreate,
+    session: AsyncSession = Depends(get_session),
 ) -> schemas.User:
     '''
     POST method users/ enpoint handler.
@@ -105,30 +225,107 @@ async def create_user(
             status_code=HTTPStatus.BAD_REQUEST,
             detail=f'user with login: {user.login} already exists',
         )
-    return user
+    except quotas.QuotaExceeded as error:
+        raise _quota_exceeded(error)
+    return negotiated(
+        request,
+        schemas.User.model_validate(user),
+        status_code=HTTPStatus.CREATED,
+    )
 
 
-@app.patch(
-    '/users/{id}/acquire_lock',
-    response_model=schemas.User,
-    dependencies=[Depends(jwt_passwords.check_jwt_token)],
+@app.post(
+    '/users/bulk',
+    response_model=list[schemas.User],
+    status_code=HTTPStatus.CREATED,
+    dependencies=[Depends(throttling.throttle('write'))],
 )
+async def create_users(
+    request: Request,
+    users: Annotated[
+        list[schemas.UserCreate],
+        Body(min_length=1, max_length=BULK_CREATE_LIMIT),
+    ],
+    session: AsyncSession = Depends(get_session),
+) -> list[schemas.User]:
+    '''
+    POST method users/bulk enpoint handler.
+    Expects a JSON or msgpack list of sql_app.schemas.UserCreate models,
+    at most BULK_CREATE_LIMIT of them, created all or none.
+
+    Returns created users' data.
+    '''
+    try:
+        users = await crud.create_users(session=session, users=users)
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail='some of the users already exist',
+        )
+    except quotas.QuotaExceeded as error:
+        raise _quota_exceeded(error)
+    return negotiated(
+        request,
+        [schemas.User.model_validate(u) for u in users],
+        status_code=HTTPStatus.CREATED,
+    )
+
+
+@app.post('/users/claim', response_model=schemas.User)
+async def claim_user(
+    request: Request,
+    claim: schemas.UserClaim,
+    admin: Admin = Depends(throttling.throttle('lock')),
+    session: AsyncSession = Depends(get_session),
+) -> schemas.User:
+    '''
+    POST method users/claim enpoint handler.
+    Expects project_id, env, domain and a locktime, locks any free user
+    of that project, env and domain.
+
+    Returns locked user's data, 429 if the project's quota (see
+    sql_app.quotas) does not allow another lock now.
+    '''
+    try:
+        user = await crud.claim_user(
+            session=session,
+            project_id=claim.project_id,
+            env=claim.env,
+            domain=claim.domain,
+            locktime=claim.locktime,
+            admin_login=admin.login,
+        )
+    except crud.NoResultFound:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail='no free user'
+        )
+    except quotas.QuotaExceeded as error:
+        raise _quota_exceeded(error)
+    return negotiated(request, schemas.User.model_validate(user))
+
+
+@app.patch('/users/{id}/acquire_lock', response_model=schemas.User)
 async def acquire_lock(
+    request: Request,
     locktime: schemas.UserLockTime,
     id: int,
+    admin: Admin = Depends(throttling.throttle('lock')),
     session: AsyncSession = Depends(get_session),
 ) -> schemas.User:
     '''
     PATCH method users/{id: int}/acquire_lock enpoint handler.
     Expects a datetime value for the locktime field and sets that locktime.
 
-    Returns modified user's data.
+    Returns modified user's data, 429 if the project's quota does not
+    allow another lock now.
     '''
     try:
         user = await crud.acquire_release_lock(
             session=session,
             locktime=locktime.locktime,
             id=id,
+            admin_login=admin.login,
         )
     except crud.NoResultFound:
         await session.rollback()
@@ -141,34 +338,338 @@ async def acquire_lock(
             status_code=HTTPStatus.BAD_REQUEST,
             detail=f'user with id: {id} is already occupied',
         )
-    return user
+    except quotas.QuotaExceeded as error:
+        raise _quota_exceeded(error)
+    return negotiated(request, schemas.User.model_validate(user))
 
 
-@app.patch(
-    '/users/{id}/release_lock',
-    dependencies=[Depends(jwt_passwords.check_jwt_token)],
-)
+@app.patch('/users/{id}/renew_lock', response_model=schemas.User)
+async def renew_lock(
+    request: Request,
+    lease: schemas.UserLeaseRenew,
+    id: int,
+    admin: Admin = Depends(throttling.throttle('lock')),
+    session: AsyncSession = Depends(get_session),
+) -> schemas.User:
+    '''
+    PATCH method users/{id: int}/renew_lock enpoint handler.
+    Expects the fencing token returned on acquire and optionally
+    lease_seconds (LEASE_SECONDS by default); extends the lease to that
+    many seconds from now.
+
+    Returns modified user's data, 409 if the lease was lost.
+    '''
+    lease_seconds = lease.lease_seconds or get_settings().lease_seconds
+    try:
+        user = await crud.renew_lease(
+            session=session,
+            id=id,
+            fencing_token=lease.fencing_token,
+            locktime=datetime.now() + timedelta(seconds=lease_seconds),
+        )
+    except crud.LeaseLost:
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT, detail='lease lost'
+        )
+    return negotiated(request, schemas.User.model_validate(user))
+
+
+@app.patch('/users/{id}/release_lock')
 async def release_lock(
-    id: int, session: AsyncSession = Depends(get_session)
+    request: Request,
+    id: int,
+    fencing_token: Union[int, None] = None,
+    admin: Admin = Depends(throttling.throttle('lock')),
+    session: AsyncSession = Depends(get_session),
 ) -> schemas.User:
     '''
     PATCH method users/{id: int}/release_lock enpoint handler.
-    NUlls the locktime for the user.
+    NUlls the locktime for the user. With the optional "fencing_token"
+    query parameter only the holder of that lease can release it.
 
     Returns modified user's data.
     '''
-    user = await crud.acquire_release_lock(
-        session=session,
-        locktime=None,
-        id=id,
+    try:
+        user = await crud.acquire_release_lock(
+            session=session,
+            locktime=None,
+            id=id,
+            admin_login=admin.login,
+            fencing_token=fencing_token,
+        )
+    except crud.LeaseLost:
+        await session.rollback()
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT, detail='lease lost'
+        )
+    return negotiated(request, schemas.User.model_validate(user))
+
+
+@app.get(
+    '/stats/projects',
+    response_model=list[schemas.ProjectUtilisation],
+    dependencies=[
+        Depends(throttling.throttle('read')),
+        Depends(track_peak_memory),
+    ],
+)
+async def get_project_stats(
+    hours: float = 24,
+    session: AsyncSession = Depends(get_read_session),
+) -> list[schemas.ProjectUtilisation]:
+    '''
+    GET method stats/projects enpoint handler.
+    Optional "hours" query parameter sets the period (24 by default).
+
+    Returns bot utilisation per project from the lock history.
+    '''
+    return await crud.get_project_utilisation(
+        session,
+        since=datetime.now() - timedelta(hours=hours),
+        lookback=timedelta(hours=get_settings().stats_lookback_hours),
+    )
+
+
+@app.get(
+    '/projects/quotas',
+    response_model=list[schemas.ProjectQuotaOut],
+    dependencies=[Depends(throttling.throttle('read'))],
+)
+async def get_project_quotas(
+    session: AsyncSession = Depends(get_session),
+) -> list[schemas.ProjectQuotaOut]:
+    '''
+    GET method projects/quotas enpoint handler.
+
+    Returns the claim quotas of the projects that have one.
+    '''
+    return await crud.get_project_quotas(session)
+
+
+@app.put(
+    '/projects/{project_id}/quota',
+    response_model=schemas.ProjectQuotaOut,
+    dependencies=[Depends(throttling.throttle('write'))],
+)
+async def set_project_quota(
+    project_id: int,
+    quota: schemas.ProjectQuota,
+    session: AsyncSession = Depends(get_session),
+) -> schemas.ProjectQuotaOut:
+    '''
+    PUT method projects/{project_id: int}/quota enpoint handler.
+    Expects max_locks (null for no cap) and a priority class ("low",
+    "normal" or "high"), enforced on claims while CLAIM_QUOTAS is on.
+
+    Returns the stored quota.
+    '''
+    return await crud.set_project_quota(
+        session, project_id=project_id, quota=quota
+    )
+
+
+@app.post('/jobs', response_model=schemas.Job, status_code=HTTPStatus.ACCEPTED)
+async def create_job(
+    job: schemas.JobCreate,
+    admin: Admin = Depends(throttling.throttle('write')),
+    session: AsyncSession = Depends(get_session),
+) -> schemas.Job:
+    '''
+    POST method jobs/ enpoint handler.
+    Expects a job: {"kind": "import", "users": [...]} with up to
+    JOB_IMPORT_LIMIT users, or a "lock" (with a locktime), "release" or
+    "purge" job of a project_id's users, optionally narrowed to an env,
+    a domain and a list of ids.
+
+    Returns the queued job; its progress is at jobs/{id}.
+    '''
+    db_job = await crud.create_job(session, job, admin_login=admin.login)
+    job_runner.wake()
+    return db_job
+
+
+@app.get(
+    '/jobs/{id}',
+    response_model=schemas.Job,
+    dependencies=[Depends(throttling.throttle('read'))],
+)
+async def get_job(
+    id: int, session: AsyncSession = Depends(get_session)
+) -> schemas.Job:
+    '''
+    GET method jobs/{id: int} enpoint handler.
+
+    Returns the job's status, progress and first per-item errors.
+    '''
+    try:
+        return await crud.get_job(session, id)
+    except crud.NoResultFound:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail='job not found'
+        )
+
+
+@app.get(
+    '/jobs/{id}/events',
+    response_class=StreamingResponse,
+    dependencies=[Depends(throttling.throttle('read'))],
+)
+async def get_job_events(
+    id: int, session_factory: sessionmaker = Depends(get_sessionmaker)
+) -> StreamingResponse:
+    '''
+    GET method jobs/{id: int}/events enpoint handler.
+
+    Streams the job as server-sent "progress" events, one whenever it
+    changed (checked every JOB_POLL_SECONDS), until it has finished.
+    Every poll takes a session of its own, so the stream holds no
+    connection while it waits.
+    '''
+    async with session_factory() as session:
+        try:
+            await crud.get_job(session, id)
+        except crud.NoResultFound:
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND, detail='job not found'
+            )
+
+    async def events():
+        sent = None
+        while True:
+            async with session_factory() as session:
+                job = schemas.Job.model_validate(
+                    await crud.get_job(session, id)
+                )
+            data = job.model_dump_json()
+            if data != sent:
+                yield f'event: progress\ndata: {data}\n\n'
+                sent = data
+            if job.status in FINISHED:
+                return
+            await asyncio.sleep(get_settings().job_poll_seconds)
+
+    return StreamingResponse(events(), media_type='text/event-stream')
+
+
+@app.post(
+    '/jobs/{id}/cancel',
+    response_model=schemas.Job,
+    dependencies=[Depends(throttling.throttle('write'))],
+)
+async def cancel_job(
+    id: int, session: AsyncSession = Depends(get_session)
+) -> schemas.Job:
+    '''
+    POST method jobs/{id: int}/cancel enpoint handler.
+    Cancels a queued or running job; the chunks already done stay done.
+
+    Returns the cancelled job, 409 if it had already finished.
+    '''
+    try:
+        job = await crud.cancel_job(session, id)
+    except crud.NoResultFound:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail='job not found'
+        )
+    if job.status != 'cancelled':
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT, detail=f'job is {job.status}'
+        )
+    return job
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    '''
+    GET method metrics/ endpoint handler.
+
+    Returns the metrics of every worker (see metrics.SharedMetrics) in
+    Prometheus text format.
+    '''
+    return PlainTextResponse(
+        shared_metrics.render(), media_type='text/plain; version=0.0.4'
     )
-    return user
+
+
+@app.post(
+    '/debug/memory/start',
+    dependencies=[Depends(jwt_passwords.check_jwt_token)],
+)
+async def start_memory_tracing(
+    frames: int = Query(default=1, ge=1, le=100),
+) -> dict:
+    '''
+    POST method debug/memory/start endpoint handler.
+    Optional "frames" query parameter sets the traceback depth kept per
+    allocation (1 by default). Restarts tracemalloc if it was running.
+
+    Returns the tracing status; the baseline snapshot is taken now.
+    '''
+    await run_in_threadpool(profiler.start, frames)
+    return profiler.status()
+
+
+@app.post(
+    '/debug/memory/snapshot',
+    dependencies=[Depends(jwt_passwords.check_jwt_token)],
+)
+async def rebase_memory_snapshot() -> dict:
+    '''
+    POST method debug/memory/snapshot endpoint handler.
+    Replaces the baseline snapshot with one taken now.
+
+    Returns the tracing status, 409 if tracemalloc is not tracing.
+    '''
+    if not profiler.tracing():
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT, detail='memory tracing is off'
+        )
+    await run_in_threadpool(profiler.rebase)
+    return profiler.status()
+
+
+@app.get(
+    '/debug/memory',
+    dependencies=[Depends(jwt_passwords.check_jwt_token)],
+)
+async def get_memory_top(
+    limit: int = Query(default=20, ge=1, le=1000),
+    group_by: GroupBy = 'lineno',
+) -> dict:
+    '''
+    GET method debug/memory endpoint handler.
+    Optional "limit" (20 by default) and "group_by" ("lineno",
+    "filename" or "traceback") query parameters.
+
+    Returns the allocation sites that grew the most since the baseline
+    snapshot, 409 if tracemalloc is not tracing.
+    '''
+    if not profiler.tracing():
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT, detail='memory tracing is off'
+        )
+    return await run_in_threadpool(profiler.top, limit, group_by)
+
+
+@app.post(
+    '/debug/memory/stop',
+    dependencies=[Depends(jwt_passwords.check_jwt_token)],
+)
+async def stop_memory_tracing() -> dict:
+    '''
+    POST method debug/memory/stop endpoint handler.
+    Stops tracemalloc and drops the baseline snapshot.
+
+    Returns the tracing status.
+    '''
+    profiler.stop()
+    return profiler.status()
 
 
 @app.post(
     '/admins',
     status_code=HTTPStatus.CREATED,
-    dependencies=[Depends(jwt_passwords.check_jwt_token)],
+    dependencies=[Depends(throttling.throttle('write'))],
 )
 async def create_admin(
     admin: schemas.AdminUser, session: AsyncSession = Depends(get_session)
@@ -200,38 +701,52 @@ async def create_first_admin(
 ) -> schemas.AdminUser:
     '''
     POST method superuser/ endpoint handler.
-    Used for creating a base admin.
+    Used for creating a base admin. Once the admin is known to exist
+    the worker answers from memory.
     '''
+    if jwt_passwords.first_admin.admin is not None:
+        return jwt_passwords.first_admin.admin
+    settings = get_settings()
     first_db_admin = await crud.create_first_admin(
         session=session,
-        login=os.getenv('FIRST_DB_ADMIN_LOGIN'),
-        password=os.getenv('FIRST_DB_ADMIN_PASSWORD'),
+        login=settings.first_db_admin_login,
+        password=settings.first_db_admin_password,
+    )
+    jwt_passwords.first_admin.admin = schemas.AdminUser.model_validate(
+        first_db_admin
     )
-    return first_db_admin
+    return jwt_passwords.first_admin.admin
 
 
 @app.post('/token', status_code=HTTPStatus.CREATED)
 async def get_token(
+    request: Request,
     credentials: Annotated[OAuth2PasswordRequestForm, Depends()],
     session: AsyncSession = Depends(get_session),
 ) -> schemas.Token:
     '''
     POST method token/ endpoint handler.
-    Expects login and password.
+    Expects login and password. Attempts are throttled per client IP,
+    and failed ones make the login and the client back off
+    exponentially (429 with Retry-After).
 
     Returns a JWT-token if presented credentials are correct.
     '''
+    client = request.client.host if request.client else 'unknown'
+    throttling.check_login_attempt(client, credentials.username)
     admin = await jwt_passwords.auth_admin(
         session=session,
         username=credentials.username,
         password=credentials.password,
     )
     if not admin:
+        throttling.login_failed(client, credentials.username)
         raise HTTPException(
             status_code=HTTPStatus.UNAUTHORIZED,
             detail=f'incorrect username or password',
             headers={'WWW-Authenticate': 'Bearer'},
         )
+    throttling.login_succeeded(client, credentials.username)
     access_token = jwt_passwords.create_access_token(
         data={'sub': admin.login},
         expires_delta=timedelta(
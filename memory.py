@@ -0,0 +1,160 @@
+import tracemalloc
+from typing import Literal, Union
+
+from fastapi import Request
+
+from metrics import Counter, Summary, peak_rss_bytes, registry
+
+GroupBy = Literal['lineno', 'filename', 'traceback']
+# Allocations of the profiler itself and of the import machinery.
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+request_peak_traced = registry.register(
+    Summary(
+        'http_request_peak_traced_memory_bytes',
+        'Peak Python memory allocated while serving a request, measured '
+        'while tracemalloc runs, for requests not overlapping others.',
+        labels=('route',),
+    )
+)
+request_peak_rss_growth = registry.register(
+    Summary(
+        'http_request_peak_rss_growth_bytes',
+        'Growth of the worker peak RSS while serving a request.',
+        labels=('route',),
+    )
+)
+overlapped_requests = registry.register(
+    Counter(
+        'http_request_memory_overlapped',
+        'Requests whose traced peak was not recorded because other '
+        'accounted requests ran at the same time.',
+        labels=('route',),
+    )
+)
+
+
+class MemoryProfiler:
+    '''
+    Starts and stops tracemalloc and compares snapshots against a
+    baseline.
+
+    The baseline is taken on start and replaced with `rebase`, so
+    `top` shows what was allocated and is still alive since then.
+    '''
+
+    def __init__(self) -> None:
+        self.baseline: Union[tracemalloc.Snapshot, None] = None
+
+    @staticmethod
+    def tracing() -> bool:
+        return tracemalloc.is_tracing()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def start(self, frames: int = 1) -> None:
+        '''
+        Starts tracing with `frames` frames per allocation traceback
+        (more frames cost more memory and time per allocation).
+        '''
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        tracemalloc.start(frames)
+        self.baseline = self._snapshot()
+
+    def rebase(self) -> None:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError('tracemalloc is not tracing')
+        self.baseline = self._snapshot()
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        self.baseline = None
+
+    def status(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            'tracing': tracemalloc.is_tracing(),
+            'frames': tracemalloc.get_traceback_limit(),
+            'traced_bytes': current,
+            'traced_peak_bytes': peak,
+            'tracemalloc_overhead_bytes': tracemalloc.get_tracemalloc_memory(),
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+
+    def top(self, limit: int = 20, group_by: GroupBy = 'lineno') -> dict:
+        '''
+        Takes a snapshot and returns the `limit` allocation sites that
+        grew the most since the baseline. Blocks the calling thread
+        for as long as that takes: call it from a threadpool.
+        '''
+        if not tracemalloc.is_tracing():
+            raise RuntimeError('tracemalloc is not tracing')
+        snapshot = self._snapshot()
+        stats = snapshot.compare_to(self.baseline, group_by)
+        return {
+            **self.status(),
+            'group_by': group_by,
+            'sites': [
+                {
+                    'traceback': stat.traceback.format(),
+                    'size_bytes': stat.size,
+                    'size_diff_bytes': stat.size_diff,
+                    'count': stat.count,
+                    'count_diff': stat.count_diff,
+                }
+                for stat in stats[:limit]
+            ],
+        }
+
+
+class PeakMemoryAccounting:
+    '''
+    Records the memory peak of each request into the route's metrics.
+
+    tracemalloc keeps a single peak for the process, so the traced peak
+    of a request is only recorded when no other accounted request ran
+    at the same time; the others are counted as overlapped. The RSS
+    high-water mark growth is recorded for every request.
+    '''
+
+    def __init__(self) -> None:
+        self.running = 0
+        self.started = 0
+
+    async def __call__(self, request: Request):
+        route = request.scope['route'].path
+        alone = self.running == 0
+        self.running += 1
+        self.started += 1
+        started = self.started
+        rss_before = peak_rss_bytes()
+        traced = tracemalloc.is_tracing()
+        if traced and alone:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            self.running -= 1
+            request_peak_rss_growth.observe(
+                route, value=peak_rss_bytes() - rss_before
+            )
+            if traced and tracemalloc.is_tracing():
+                if alone and started == self.started:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    request_peak_traced.observe(
+                        route, value=peak - traced_before
+                    )
+                else:
+                    overlapped_requests.inc(route)
+
+
+profiler = MemoryProfiler()
+track_peak_memory = PeakMemoryAccounting()
@@ -0,0 +1,330 @@
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from typing import Callable, Literal, Union
+
+logger = logging.getLogger(__name__)
+
+# Label values of a sample, in the order of the metric's label names.
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names: tuple[str, ...], values: Labels) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+class Metric:
+    '''A metric family with samples per label values.'''
+
+    type = 'untyped'
+
+    def __init__(
+        self, name: str, help: str, labels: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def _header(self, name: str, type: str) -> list[str]:
+        return [f'# HELP {name} {self.help}', f'# TYPE {name} {type}']
+
+    def snapshot(self) -> dict[Labels, object]:
+        '''This worker's samples, as written for the other workers.'''
+        return self.values
+
+    def merge(self, snapshots: list[dict[Labels, object]]) -> dict:
+        '''Combines the snapshots of every worker into one sample set.'''
+        raise NotImplementedError
+
+    def render(self, values: Union[dict, None] = None) -> list[str]:
+        '''Renders the values (merged ones) or this worker's samples.'''
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    '''Monotonically increasing count.'''
+
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def merge(self, snapshots: list[dict[Labels, float]]) -> dict:
+        merged = {}
+        for values in snapshots:
+            for labels, value in values.items():
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+    def render(self, values: Union[dict, None] = None) -> list[str]:
+        lines = self._header(f'{self.name}_total', self.type)
+        for labels, value in (
+            self.values if values is None else values
+        ).items():
+            lines.append(
+                f'{self.name}_total{_format_labels(self.labels, labels)} '
+                f'{value}'
+            )
+        return lines
+
+
+class Gauge(Metric):
+    '''
+    Value that goes up and down, either set explicitly or read by
+    `collect` when rendered.
+
+    Across workers the most recently set value is reported, or with
+    merge='max' the largest one.
+    '''
+
+    type = 'gauge'
+
+    def __init__(
+        self,
+        *args,
+        collect: Union[Callable[[], dict[Labels, float]], None] = None,
+        merge: Literal['last', 'max'] = 'last',
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.values: dict[Labels, float] = {}
+        # labels -> time.time() of the last set, for merge='last'
+        self.updated: dict[Labels, float] = {}
+        self.collect = collect
+        self.merge_by = merge
+
+    def set(self, *labels: str, value: float) -> None:
+        self.values[labels] = value
+        self.updated[labels] = time.time()
+
+    def snapshot(self) -> dict[Labels, list[float]]:
+        if self.collect:
+            now = time.time()
+            return {
+                labels: [value, now]
+                for labels, value in self.collect().items()
+            }
+        return {
+            labels: [value, self.updated[labels]]
+            for labels, value in self.values.items()
+        }
+
+    def merge(self, snapshots: list[dict[Labels, list[float]]]) -> dict:
+        merged = {}
+        index = 0 if self.merge_by == 'max' else 1
+        for values in snapshots:
+            for labels, sample in values.items():
+                if (
+                    labels not in merged
+                    or sample[index] > merged[labels][index]
+                ):
+                    merged[labels] = sample
+        return {labels: value for labels, (value, _) in merged.items()}
+
+    def render(self, values: Union[dict, None] = None) -> list[str]:
+        if values is None:
+            values = self.collect() if self.collect else self.values
+        lines = self._header(self.name, self.type)
+        for labels, value in values.items():
+            lines.append(
+                f'{self.name}{_format_labels(self.labels, labels)} {value}'
+            )
+        return lines
+
+
+class Summary(Metric):
+    '''
+    Count and sum of observations, plus their maximum as a separate
+    `<name>_max` gauge.
+    '''
+
+    type = 'summary'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # labels -> [count, sum, max]
+        self.values: dict[Labels, list[float]] = {}
+
+    def observe(self, *labels: str, value: float) -> None:
+        sample = self.values.get(labels)
+        if sample is None:
+            self.values[labels] = [1, value, value]
+            return
+        sample[0] += 1
+        sample[1] += value
+        sample[2] = max(sample[2], value)
+
+    def merge(self, snapshots: list[dict[Labels, list[float]]]) -> dict:
+        merged = {}
+        for values in snapshots:
+            for labels, (count, total, maximum) in values.items():
+                sample = merged.setdefault(labels, [0, 0, maximum])
+                sample[0] += count
+                sample[1] += total
+                sample[2] = max(sample[2], maximum)
+        return merged
+
+    def render(self, values: Union[dict, None] = None) -> list[str]:
+        lines = self._header(self.name, self.type)
+        maxima = self._header(f'{self.name}_max', 'gauge')
+        for labels, (count, total, maximum) in (
+            self.values if values is None else values
+        ).items():
+            label_text = _format_labels(self.labels, labels)
+            lines.append(f'{self.name}_count{label_text} {count}')
+            lines.append(f'{self.name}_sum{label_text} {total}')
+            maxima.append(f'{self.name}_max{label_text} {maximum}')
+        return lines + maxima
+
+
+class Registry:
+    '''
+    The metrics of this worker, rendered in Prometheus text format.
+
+    With several workers (METRICS_DIR, see SharedMetrics) each writes
+    snapshots of its samples and renders merge them all.
+    '''
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f'metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict[str, list]:
+        '''The samples of every metric, as JSON serializable lists.'''
+        return {
+            name: [
+                [list(labels), value]
+                for labels, value in metric.snapshot().items()
+            ]
+            for name, metric in self.metrics.items()
+        }
+
+    def render(self, snapshots: Union[list[dict], None] = None) -> str:
+        '''
+        Renders this worker's samples, or the merge of the snapshots
+        (of Registry.snapshot) when given.
+        '''
+        lines = []
+        for name, metric in self.metrics.items():
+            values = None
+            if snapshots is not None:
+                values = metric.merge(
+                    [
+                        {
+                            tuple(labels): value
+                            for labels, value in snapshot.get(name, ())
+                        }
+                        for snapshot in snapshots
+                    ]
+                )
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self) -> None:
+        '''Drops the samples, keeping the metrics registered.'''
+        for metric in self.metrics.values():
+            metric.values.clear()
+
+
+class SharedMetrics:
+    '''
+    Shares the registry between the workers of a server through files
+    in a directory (METRICS_DIR): every worker writes a snapshot of its
+    samples to <pid>.json every METRICS_WRITE_INTERVAL_SECONDS, and the
+    worker serving GET /metrics renders them all merged. Snapshots of
+    exited workers are kept, so their counts stay in the totals;
+    server.py empties the directory on start.
+    '''
+
+    def __init__(self, registry: Registry) -> None:
+        self.registry = registry
+        self.directory = None
+        self._writer = None
+
+    def write(self) -> None:
+        '''Writes this worker's snapshot, replacing the previous one.'''
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(self.registry.snapshot(), file)
+        os.replace(f'{path}.tmp', path)
+
+    def read(self) -> list[dict]:
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                logger.warning('unreadable metrics snapshot %s', name)
+        return snapshots
+
+    def render(self) -> str:
+        '''Every worker's metrics, or only this one's without a directory.'''
+        if self.directory is None:
+            return self.registry.render()
+        self.write()
+        return self.registry.render(self.read())
+
+    async def _write_forever(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.write()
+            except OSError:
+                logger.exception('failed to write the metrics snapshot')
+
+    def start(self, directory: Union[str, None], interval: float) -> None:
+        self.directory = directory
+        if directory is not None:
+            self._writer = asyncio.create_task(self._write_forever(interval))
+
+    async def stop(self) -> None:
+        '''Stops writing, after a last snapshot.'''
+        if self._writer is not None:
+            self._writer.cancel()
+            self.write()
+        self._writer = None
+        self.directory = None
+
+
+def peak_rss_bytes() -> int:
+    '''High-water mark of this process' resident set size.'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+registry = Registry()
+registry.register(
+    Gauge(
+        'process_peak_resident_memory_bytes',
+        'Peak resident set size of the worker (the largest one).',
+        collect=lambda: {(): peak_rss_bytes()},
+        merge='max',
+    )
+)
+shared_metrics = SharedMetrics(registry)
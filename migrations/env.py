@@ -1,25 +1,27 @@
 import asyncio
-import os
-import sys
 from logging.config import fileConfig
 
 from alembic import context
-from dotenv import load_dotenv
-from sqlalchemy import pool
+from sqlalchemy import pool, text
 from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config
 
+from config import get_settings
+from sql_app.database import direct_url
 from sql_app.models import *
 
-load_dotenv()
-
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
-config.set_main_option('sqlalchemy.url', os.getenv('DB_URL'))
-if 'pytest' in sys.modules:
-    config.set_main_option('sqlalchemy.url', os.getenv('TEST_DB_URL'))
+# A url passed with `-x db_url=...` (e.g. a DB_SHARD_URLS shard), then
+# an explicitly configured one (e.g. a per-worker test database) take
+# precedence over the environment.
+db_url = context.get_x_argument(as_dictionary=True).get('db_url')
+if db_url:
+    config.set_main_option('sqlalchemy.url', db_url.replace('%', '%%'))
+elif not config.get_main_option('sqlalchemy.url'):
+    config.set_main_option('sqlalchemy.url', direct_url().replace('%', '%%'))
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -63,7 +65,23 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    # DDL waiting for a table lock would queue the app's queries behind
+    # it: give up after MIGRATION_LOCK_TIMEOUT_SECONDS instead, the
+    # runner (sql_app.migrate) retries.
+    lock_timeout = get_settings().migration_lock_timeout_seconds
+    if lock_timeout:
+        connection.execute(
+            text("SELECT set_config('lock_timeout', :timeout, false)"),
+            {'timeout': f'{int(lock_timeout * 1000)}ms'},
+        )
+        connection.commit()
+    # One transaction per revision: a failed revision does not undo the
+    # ones before it, and sql_app.online_ddl helpers may commit midway.
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        transaction_per_migration=True,
+    )
 
     with context.begin_transaction():
         context.run_migrations()
@@ -11,6 +11,8 @@ from typing import Sequence, Union
 import sqlalchemy as sa
 from alembic import op
 
+from sql_app.online_ddl import add_unique_constraint, create_table
+
 # revision identifiers, used by Alembic.
 revision: str = '2e279cb8acc0'
 down_revision: Union[str, None] = '8d165c97a1f9'
@@ -20,7 +22,8 @@ depends_on: Union[str, Sequence[str], None] = None
 
 def upgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
-    op.create_table(
+    # Committed by add_unique_constraint, so a retry finds it in place.
+    create_table(
         'admin',
         sa.Column('id', sa.Integer(), nullable=False),
         sa.Column('login', sa.String(), nullable=True),
@@ -28,12 +31,14 @@ def upgrade() -> None:
         sa.PrimaryKeyConstraint('id'),
         sa.UniqueConstraint('login'),
     )
-    op.create_unique_constraint(None, 'user', ['login'])
     # ### end Alembic commands ###
+    # Named as Postgres names it; the index is built without blocking
+    # writes to the user table.
+    add_unique_constraint('user_login_key', 'user', ['login'])
 
 
 def downgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_constraint(None, 'user', type_='unique')
+    op.drop_constraint('user_login_key', 'user', type_='unique')
     op.drop_table('admin')
     # ### end Alembic commands ###
@@ -0,0 +1,51 @@
+"""add updated_at to user
+
+Revision ID: 3f8b6d0e2c57
+Revises: e07a3d5c94f1
+Create Date: 2026-10-19 13:41:08.673291
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from sql_app.online_ddl import (
+    add_column,
+    backfill,
+    create_index_concurrently,
+    drop_index_concurrently,
+    set_not_null,
+)
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8b6d0e2c57'
+down_revision: Union[str, None] = 'e07a3d5c94f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Added without a default, which would rewrite the whole table for
+    # a volatile one; new rows get it from the default set right after,
+    # existing rows from the batched backfill. Every step is skipped
+    # when already done, for the runner to retry the revision.
+    add_column('user', sa.Column('updated_at', sa.TIMESTAMP()))
+    op.alter_column(
+        'user', 'updated_at', server_default=sa.text('clock_timestamp()')
+    )
+    backfill(
+        'user',
+        'updated_at = COALESCE(created_at, clock_timestamp())',
+        where='updated_at IS NULL',
+    )
+    set_not_null('user', 'updated_at')
+    create_index_concurrently(
+        'ix_user_updated_at_id', 'user', ['updated_at', 'id']
+    )
+
+
+def downgrade() -> None:
+    drop_index_concurrently('ix_user_updated_at_id', 'user')
+    op.drop_column('user', 'updated_at')
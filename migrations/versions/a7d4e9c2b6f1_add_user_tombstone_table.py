@@ -0,0 +1,43 @@
+"""add user_tombstone table
+
+Revision ID: a7d4e9c2b6f1
+Revises: f5c3b8e1a2d4
+Create Date: 2026-10-20 11:47:15.902846
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d4e9c2b6f1'
+down_revision: Union[str, None] = 'f5c3b8e1a2d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_tombstone',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=True),
+        sa.Column(
+            'deleted_at',
+            sa.TIMESTAMP(),
+            server_default=sa.text('clock_timestamp()'),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        'ix_user_tombstone_deleted_at_id',
+        'user_tombstone',
+        ['deleted_at', 'id'],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_tombstone_deleted_at_id', 'user_tombstone')
+    op.drop_table('user_tombstone')
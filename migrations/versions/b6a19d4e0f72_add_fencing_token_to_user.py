@@ -0,0 +1,35 @@
+"""add fencing_token to user
+
+Revision ID: b6a19d4e0f72
+Revises: 3f8b6d0e2c57
+Create Date: 2026-10-19 15:02:37.418905
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6a19d4e0f72'
+down_revision: Union[str, None] = '3f8b6d0e2c57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A constant default is only stored in the catalog, no table rewrite.
+    op.add_column(
+        'user',
+        sa.Column(
+            'fencing_token',
+            sa.BigInteger(),
+            server_default='0',
+            nullable=False,
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('user', 'fencing_token')
@@ -0,0 +1,63 @@
+"""drop lock_event default partition
+
+Revision ID: b8e2c6f4a1d7
+Revises: a7d4e9c2b6f1
+Create Date: 2026-10-20 15:02:41.337120
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from config import get_settings
+from sql_app.partitions import (
+    create_partition_sql,
+    period_length,
+    period_start,
+)
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e2c6f4a1d7'
+down_revision: Union[str, None] = 'a7d4e9c2b6f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = 'id, created_at, user_id, project_id, event, locktime, admin_login'
+
+
+def upgrade() -> None:
+    # DETACH PARTITION ... CONCURRENTLY is refused while a default
+    # partition exists. Its rows move to range partitions covering them.
+    op.execute('ALTER TABLE lock_event DETACH PARTITION lock_event_default')
+    granularity = get_settings().lock_history_partition
+    days = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT DISTINCT date_trunc('day', created_at) "
+                'FROM lock_event_default'
+            )
+        )
+        .scalars()
+    )
+    for start in sorted({period_start(day, granularity) for day in days}):
+        op.execute(
+            create_partition_sql(
+                f'lock_event_p{start:%Y%m%d}',
+                start,
+                start + period_length(granularity),
+            )
+        )
+    op.execute(
+        f'INSERT INTO lock_event ({COLUMNS}) '
+        f'SELECT {COLUMNS} FROM lock_event_default'
+    )
+    op.drop_table('lock_event_default')
+
+
+def downgrade() -> None:
+    op.execute(
+        'CREATE TABLE lock_event_default PARTITION OF lock_event DEFAULT'
+    )
@@ -0,0 +1,28 @@
+"""add reserved_until to idempotency_key
+
+Revision ID: c3a9d7e5f2b8
+Revises: b8e2c6f4a1d7
+Create Date: 2026-10-20 16:24:09.518733
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from sql_app.online_ddl import add_column
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3a9d7e5f2b8'
+down_revision: Union[str, None] = 'b8e2c6f4a1d7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    add_column('idempotency_key', sa.Column('reserved_until', sa.TIMESTAMP()))
+
+
+def downgrade() -> None:
+    op.drop_column('idempotency_key', 'reserved_until')
@@ -0,0 +1,50 @@
+"""add project_quota table
+
+Revision ID: c41e8f2a6d93
+Revises: b6a19d4e0f72
+Create Date: 2026-10-19 18:24:05.117342
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from sql_app.online_ddl import (
+    create_index_concurrently,
+    create_table,
+    drop_index_concurrently,
+)
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e8f2a6d93'
+down_revision: Union[str, None] = 'b6a19d4e0f72'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    create_table(
+        'project_quota',
+        sa.Column('project_id', sa.Integer(), autoincrement=False),
+        sa.Column('max_locks', sa.Integer(), nullable=True),
+        sa.Column(
+            'priority',
+            sa.String(),
+            server_default='normal',
+            nullable=False,
+        ),
+        sa.Column('last_refused_at', sa.TIMESTAMP(), nullable=True),
+        sa.PrimaryKeyConstraint('project_id'),
+    )
+    create_index_concurrently(
+        'ix_user_project_id_locktime', 'user', ['project_id', 'locktime']
+    )
+    create_index_concurrently('ix_user_locktime', 'user', ['locktime'])
+
+
+def downgrade() -> None:
+    drop_index_concurrently('ix_user_locktime', 'user')
+    drop_index_concurrently('ix_user_project_id_locktime', 'user')
+    op.drop_table('project_quota')
@@ -0,0 +1,37 @@
+"""add job_chunk table
+
+Revision ID: d2b7f9a4c6e1
+Revises: c3a9d7e5f2b8
+Create Date: 2026-10-20 18:41:52.207316
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2b7f9a4c6e1'
+down_revision: Union[str, None] = 'c3a9d7e5f2b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'job_chunk',
+        sa.Column(
+            'job_id', sa.BigInteger(), autoincrement=False, nullable=False
+        ),
+        sa.Column('start', sa.BigInteger(), nullable=False),
+        sa.Column(
+            'results', postgresql.JSONB(astext_type=sa.Text()), nullable=False
+        ),
+        sa.PrimaryKeyConstraint('job_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('job_chunk')
@@ -0,0 +1,67 @@
+"""add job table
+
+Revision ID: d8e2f61b5a07
+Revises: c41e8f2a6d93
+Create Date: 2026-10-19 21:12:48.530217
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8e2f61b5a07'
+down_revision: Union[str, None] = 'c41e8f2a6d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'job',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column(
+            'status', sa.String(), server_default='queued', nullable=False
+        ),
+        sa.Column(
+            'params', postgresql.JSONB(astext_type=sa.Text()), nullable=False
+        ),
+        sa.Column('admin_login', sa.String(), nullable=True),
+        sa.Column('total', sa.Integer(), nullable=True),
+        sa.Column('cursor', sa.BigInteger(), nullable=True),
+        sa.Column(
+            'processed', sa.Integer(), server_default='0', nullable=False
+        ),
+        sa.Column(
+            'succeeded', sa.Integer(), server_default='0', nullable=False
+        ),
+        sa.Column('failed', sa.Integer(), server_default='0', nullable=False),
+        sa.Column(
+            'errors',
+            postgresql.JSONB(astext_type=sa.Text()),
+            server_default='[]',
+            nullable=False,
+        ),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('attempt', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('lease_until', sa.TIMESTAMP(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+        sa.Column('started_at', sa.TIMESTAMP(), nullable=True),
+        sa.Column('finished_at', sa.TIMESTAMP(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        'ix_job_status_lease_until',
+        'job',
+        ['status', 'lease_until'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_job_status_lease_until', table_name='job')
+    op.drop_table('job')
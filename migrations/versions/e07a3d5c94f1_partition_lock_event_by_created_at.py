@@ -0,0 +1,109 @@
+"""partition lock_event by created_at
+
+Revision ID: e07a3d5c94f1
+Revises: 9c4e2a71d3b8
+Create Date: 2026-10-19 12:26:50.118406
+
+"""
+
+from datetime import datetime
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from config import get_settings
+from sql_app.partitions import (
+    create_partition_sql,
+    partition_ranges,
+    period_length,
+)
+
+# revision identifiers, used by Alembic.
+revision: str = 'e07a3d5c94f1'
+down_revision: Union[str, None] = '9c4e2a71d3b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = 'id, created_at, user_id, project_id, event, locktime, admin_login'
+
+
+def _move_aside() -> None:
+    '''Renames the current table and everything named after it.'''
+    op.drop_index('ix_lock_event_user_id_created_at', table_name='lock_event')
+    op.drop_index('ix_lock_event_created_at', table_name='lock_event')
+    op.rename_table('lock_event', 'lock_event_old')
+    op.execute(
+        'ALTER TABLE lock_event_old '
+        'RENAME CONSTRAINT lock_event_pkey TO lock_event_old_pkey'
+    )
+    op.execute(
+        'ALTER SEQUENCE lock_event_id_seq RENAME TO lock_event_old_id_seq'
+    )
+
+
+def _create_table(**kwargs) -> None:
+    primary_key = ('id', 'created_at') if kwargs else ('id',)
+    op.create_table(
+        'lock_event',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=True),
+        sa.Column('event', sa.String(), nullable=False),
+        sa.Column('locktime', sa.TIMESTAMP(), nullable=True),
+        sa.Column('admin_login', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint(*primary_key),
+        **kwargs,
+    )
+    op.create_index(
+        'ix_lock_event_created_at', 'lock_event', ['created_at'], unique=False
+    )
+    op.create_index(
+        'ix_lock_event_user_id_created_at',
+        'lock_event',
+        ['user_id', 'created_at'],
+        unique=False,
+    )
+
+
+def _copy_back() -> None:
+    op.execute(
+        f'INSERT INTO lock_event ({COLUMNS}) '
+        f'SELECT {COLUMNS} FROM lock_event_old'
+    )
+    op.execute(
+        "SELECT setval(pg_get_serial_sequence('lock_event', 'id'), "
+        'COALESCE((SELECT max(id) FROM lock_event), 0) + 1, false)'
+    )
+    op.drop_table('lock_event_old')
+
+
+def upgrade() -> None:
+    settings = get_settings()
+    _move_aside()
+    _create_table(postgresql_partition_by='RANGE (created_at)')
+    op.execute(
+        'CREATE TABLE lock_event_default PARTITION OF lock_event DEFAULT'
+    )
+    now = datetime.now()
+    oldest = (
+        op.get_bind()
+        .execute(sa.text('SELECT min(created_at) FROM lock_event_old'))
+        .scalar()
+    )
+    granularity = settings.lock_history_partition
+    for name, start, end in partition_ranges(
+        oldest or now,
+        now
+        + period_length(granularity) * settings.lock_history_partitions_ahead,
+        granularity,
+    ):
+        op.execute(create_partition_sql(name, start, end))
+    _copy_back()
+
+
+def downgrade() -> None:
+    _move_aside()
+    _create_table()
+    _copy_back()
@@ -0,0 +1,31 @@
+"""add user_login table
+
+Revision ID: f5c3b8e1a2d4
+Revises: d8e2f61b5a07
+Create Date: 2026-10-20 10:02:37.418265
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5c3b8e1a2d4'
+down_revision: Union[str, None] = 'd8e2f61b5a07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_login',
+        sa.Column('login', sa.String(), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('login'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_login')
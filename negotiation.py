@@ -0,0 +1,116 @@
+from datetime import datetime, timezone
+from http import HTTPStatus
+from typing import Any, Callable, Union
+
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:  # msgpack support is optional
+    msgpack = None
+
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def _encode_default(value: Any) -> Any:
+    # Naive datetimes (the columns are TIMESTAMP WITHOUT TIME ZONE) are
+    # sent as timestamps of the same wall clock time in UTC.
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(value)
+    raise TypeError(f'cannot serialize {type(value).__name__}')
+
+
+def _naive(value: Any) -> Any:
+    '''Turns decoded UTC timestamps back into naive datetimes.'''
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    if isinstance(value, dict):
+        return {key: _naive(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_naive(item) for item in value]
+    return value
+
+
+def is_msgpack(content_type: Union[str, None]) -> bool:
+    if not content_type:
+        return False
+    return content_type.split(';', 1)[0].strip().lower() in MSGPACK_TYPES
+
+
+def wants_msgpack(request: Request) -> bool:
+    '''True if the client accepts msgpack and msgpack is installed.'''
+    if msgpack is None:
+        return False
+    accept = request.headers.get('accept', '')
+    return any(is_msgpack(item) for item in accept.split(','))
+
+
+class MsgPackResponse(Response):
+    media_type = MSGPACK_TYPES[0]
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, default=_encode_default)
+
+
+def negotiated(
+    request: Request,
+    content: Union[BaseModel, list[BaseModel]],
+    status_code: int = HTTPStatus.OK,
+) -> Union[BaseModel, list[BaseModel], Response]:
+    '''
+    Returns a msgpack response of the models when the client asks for
+    it with "Accept: application/msgpack", otherwise the models as-is
+    for FastAPI to serialize as JSON.
+    '''
+    if not wants_msgpack(request):
+        return content
+    if isinstance(content, list):
+        payload = [item.model_dump() for item in content]
+    else:
+        payload = content.model_dump()
+    return MsgPackResponse(payload, status_code=status_code)
+
+
+class MsgPackRequest(Request):
+    '''Request whose msgpack body is decoded by json().'''
+
+    async def json(self) -> Any:
+        if not hasattr(self, '_json'):
+            self._json = _naive(
+                msgpack.unpackb(await self.body(), timestamp=3)
+            )
+        return self._json
+
+
+class MsgPackRoute(APIRoute):
+    '''
+    Route accepting "Content-Type: application/msgpack" bodies.
+
+    Such a request is handed to FastAPI as a JSON request whose json()
+    decodes msgpack, so validation runs on the decoded data as usual.
+    '''
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            if is_msgpack(request.headers.get('content-type')):
+                if msgpack is None:
+                    raise HTTPException(
+                        status_code=HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                        detail='msgpack is not supported',
+                    )
+                scope = dict(request.scope)
+                scope['headers'] = [
+                    (key, value)
+                    for key, value in request.scope['headers']
+                    if key != b'content-type'
+                ] + [(b'content-type', b'application/json')]
+                request = MsgPackRequest(scope, request.receive)
+            return await original_route_handler(request)
+
+        return route_handler
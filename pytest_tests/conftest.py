@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 from enum import Enum
@@ -6,18 +7,46 @@ import pytest
 import pytest_asyncio
 from alembic import command
 from alembic.config import Config
-from dotenv import load_dotenv
 from httpx import ASGITransport, AsyncClient
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import sessionmaker
-
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from api_security.jwt_passwords import first_admin, token_cache
+from api_security.throttling import login_throttle, rate_limiter
+from config import get_settings
 from main import app
-from sql_app.database import Base, engine
+from sql_app.audit import audit_writer
+from sql_app.database import (
+    Base,
+    configure_engine,
+    get_session,
+    get_sessionmaker,
+)
+from sql_app.jobs import job_runner
+
+settings = get_settings()
+
+FIRST_DB_ADMIN_LOGIN = settings.first_db_admin_login
+FIRST_DB_ADMIN_PASSWORD = settings.first_db_admin_password
+
+# pytest-xdist exports the worker id ("gw0", "gw1", ...) to its workers;
+# a plain pytest run is a single "master" worker.
+WORKER_ID = os.getenv('PYTEST_XDIST_WORKER', 'master')
+BASE_TEST_DB_URL = make_url(settings.test_db_url)
+if WORKER_ID == 'master':
+    TEST_DB_URL = BASE_TEST_DB_URL
+else:
+    TEST_DB_URL = BASE_TEST_DB_URL.set(
+        database=f'{BASE_TEST_DB_URL.database}_{WORKER_ID}'
+    )
 
-load_dotenv()
+configure_engine(TEST_DB_URL)
 
-FIRST_DB_ADMIN_LOGIN = os.getenv('FIRST_DB_ADMIN_LOGIN')
-FIRST_DB_ADMIN_PASSWORD = os.getenv('FIRST_DB_ADMIN_PASSWORD')
+# Every test gets a fresh connection on its own event loop,
+# so pooled connections are never reused across loops.
+test_engine = create_async_engine(TEST_DB_URL, poolclass=NullPool)
 
 
 class MethodType(Enum):
@@ -27,14 +56,54 @@ class MethodType(Enum):
     PATCH = 3
 
 
+async def _manage_worker_database(create: bool) -> None:
+    '''Creates or drops this worker's database next to the base one.'''
+    admin_engine = create_async_engine(
+        BASE_TEST_DB_URL, poolclass=NullPool, isolation_level='AUTOCOMMIT'
+    )
+    name = TEST_DB_URL.database
+    async with admin_engine.connect() as conn:
+        exists = await conn.scalar(
+            text('SELECT 1 FROM pg_database WHERE datname = :name'),
+            {'name': name},
+        )
+        if create and not exists:
+            await conn.execute(text(f'CREATE DATABASE "{name}"'))
+        elif not create and exists:
+            await conn.execute(text(f'DROP DATABASE "{name}" WITH (FORCE)'))
+    await admin_engine.dispose()
+
+
 @pytest.fixture(scope='session')
 def setup_database():
+    '''
+    Builds the schema once per test session.
+
+    Under pytest-xdist every worker gets its own database next to the
+    base test database, created and migrated once from
+    alembic_tests.ini.
+    '''
+    if WORKER_ID != 'master':
+        asyncio.run(_manage_worker_database(create=True))
     alembic_cfg = Config('alembic_tests.ini')
+    alembic_cfg.set_main_option(
+        'sqlalchemy.url',
+        TEST_DB_URL.render_as_string(hide_password=False).replace('%', '%%'),
+    )
     command.upgrade(alembic_cfg, 'head')
+    yield
+    if WORKER_ID == 'master':
+        command.downgrade(alembic_cfg, 'base')
+    else:
+        asyncio.run(_manage_worker_database(create=False))
 
 
 @pytest_asyncio.fixture
-async def async_client():
+async def async_client(async_session):
+    rate_limiter.clear()
+    login_throttle.clear()
+    token_cache.clear()
+    first_admin.clear()
     async with AsyncClient(
         transport=ASGITransport(app=app),
         base_url='http://test',
@@ -43,19 +112,52 @@ async def async_client():
 
 
 @pytest_asyncio.fixture(scope='function')
-async def async_session():
-    session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-
-    async with session() as s:
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-
-        yield s
-
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-
-    await engine.dispose()
+async def async_session(setup_database):
+    '''
+    Runs the test inside a transaction that is rolled back afterwards.
+
+    Sessions join the outer transaction through SAVEPOINTs, so commits
+    and rollbacks made by the app stay inside the test. The app's
+    get_session dependency and the audit writer use the same connection.
+    '''
+    async with test_engine.connect() as conn:
+        await conn.begin()
+        for table in Base.metadata.sorted_tables:
+            if 'id' not in table.c:
+                continue
+            await conn.execute(
+                text(
+                    "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                    '1, false)'
+                ),
+                {'table': f'"{table.name}"'},
+            )
+        session_factory = async_sessionmaker(
+            bind=conn,
+            expire_on_commit=False,
+            join_transaction_mode='create_savepoint',
+        )
+
+        async def get_test_session():
+            async with session_factory() as session:
+                yield session
+
+        app.dependency_overrides[get_session] = get_test_session
+        app.dependency_overrides[get_sessionmaker] = lambda: session_factory
+        # Lock events are written on the test connection when a test
+        # calls audit_writer.flush(), never from a background task.
+        audit_writer.session_factory = session_factory
+        audit_writer.background = False
+        # Tests run jobs with job_runner.run_once() on that connection.
+        job_runner.session_factory = session_factory
+        async with session_factory() as s:
+            yield s
+        audit_writer.discard()
+        audit_writer.session_factory = None
+        job_runner.session_factory = None
+        app.dependency_overrides.pop(get_session, None)
+        app.dependency_overrides.pop(get_sessionmaker, None)
+        await conn.rollback()
 
 
 @pytest_asyncio.fixture(scope='function')
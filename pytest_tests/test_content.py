@@ -1,12 +1,15 @@
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from http import HTTPStatus
 
+import msgpack
 import pytest
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from config import get_settings
 from pytest_tests.conftest import FIRST_DB_ADMIN_LOGIN
+from sql_app.audit import audit_writer
 
 EXPECTED_RESPONSE_USERS_CREATE_RETRIEVE = {
     'login': 'aboba',
@@ -172,3 +175,164 @@ async def test_admin_create(
     response_body = response.json()
     assert 'login' in response_body
     assert 'password' in response_body
+
+
+@pytest.mark.asyncio
+async def test_users_claim(
+    async_client: AsyncClient,
+    async_session: AsyncSession,
+    create_user,
+    token: str,
+):
+    LOCKTIME = datetime.now() + timedelta(days=1)
+    LOCKTIME = LOCKTIME.strftime('%Y-%m-%d')
+    data = {
+        'project_id': 1,
+        'env': 'prod',
+        'domain': 'canary',
+        'locktime': LOCKTIME,
+    }
+    response = await async_client.post(
+        '/users/claim',
+        content=json.dumps(data),
+        headers={'Authorization': 'Bearer ' + token},
+    )
+    assert response.status_code == HTTPStatus.OK
+    response_body = response.json()
+    assert response_body['id'] == 1
+    assert datetime.strptime(
+        response_body['locktime'], '%Y-%m-%dT%H:%M:%S'
+    ) == datetime.strptime(LOCKTIME, '%Y-%m-%d')
+
+
+@pytest.mark.asyncio
+async def test_project_stats(
+    async_client: AsyncClient,
+    async_session: AsyncSession,
+    create_user,
+    token: str,
+):
+    LOCKTIME = datetime.now() + timedelta(days=1)
+    data = json.dumps({'locktime': LOCKTIME.strftime('%Y-%m-%d')})
+    headers = {'Authorization': 'Bearer ' + token}
+    await async_client.patch(
+        '/users/1/acquire_lock', content=data, headers=headers
+    )
+    await async_client.patch('/users/1/release_lock', headers=headers)
+    await audit_writer.flush()
+
+    response = await async_client.get('/stats/projects', headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    response_body = response.json()
+    assert len(response_body) == 1
+    stats = response_body[0]
+    assert stats['project_id'] == 1
+    assert stats['bots'] == 1
+    assert stats['locked_bots'] == 1
+    assert stats['locks'] == 1
+    assert stats['releases'] == 1
+    assert stats['locked_seconds'] >= 0
+
+
+@pytest.mark.asyncio
+async def test_users_changes(
+    async_client: AsyncClient,
+    async_session: AsyncSession,
+    create_user,
+    token: str,
+    monkeypatch,
+):
+    monkeypatch.setattr(get_settings(), 'changes_settle_seconds', 0)
+    headers = {'Authorization': 'Bearer ' + token}
+    response = await async_client.get('/users/changes', headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    response_body = response.json()
+    assert [u['id'] for u in response_body['users']] == [1]
+    assert response_body['deleted'] == []
+    assert response_body['has_more'] is False
+    cursor = response_body['cursor']
+
+    response = await async_client.get(
+        '/users/changes', params={'since': cursor}, headers=headers
+    )
+    assert response.json()['users'] == []
+    assert response.json()['cursor'] == cursor
+
+    LOCKTIME = datetime.now() + timedelta(days=1)
+    await async_client.patch(
+        '/users/1/acquire_lock',
+        content=json.dumps({'locktime': LOCKTIME.strftime('%Y-%m-%d')}),
+        headers=headers,
+    )
+    response = await async_client.get(
+        '/users/changes', params={'since': cursor}, headers=headers
+    )
+    changed = response.json()['users']
+    assert len(changed) == 1
+    assert changed[0]['locktime'] is not None
+    assert response.json()['cursor'] != cursor
+
+
+@pytest.mark.asyncio
+async def test_users_retrieve_msgpack(
+    async_client: AsyncClient,
+    async_session: AsyncSession,
+    create_user,
+    token: str,
+):
+    response = await async_client.get(
+        '/users',
+        headers={
+            'Authorization': 'Bearer ' + token,
+            'Accept': 'application/msgpack',
+        },
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'] == 'application/msgpack'
+    retrieved_user = msgpack.unpackb(response.content)[0]
+    for key in EXPECTED_USER_KEYS:
+        assert (
+            retrieved_user[key] == EXPECTED_RESPONSE_USERS_CREATE_RETRIEVE[key]
+        )
+    assert isinstance(retrieved_user['created_at'], msgpack.Timestamp)
+
+
+@pytest.mark.asyncio
+async def test_users_bulk_create_msgpack(
+    async_client: AsyncClient,
+    async_session: AsyncSession,
+    token: str,
+):
+    users = [
+        {
+            'login': f'bulk{i}',
+            'project_id': 1,
+            'env': 'prod',
+            'domain': 'canary',
+            'password': '1234',
+            'locktime': datetime.now(timezone.utc) + timedelta(days=1),
+        }
+        for i in range(3)
+    ]
+    response = await async_client.post(
+        '/users/bulk',
+        content=msgpack.packb(users, datetime=True),
+        headers={
+            'Authorization': 'Bearer ' + token,
+            'Content-Type': 'application/msgpack',
+        },
+    )
+    assert response.status_code == HTTPStatus.CREATED
+    response_body = response.json()
+    assert [u['login'] for u in response_body] == ['bulk0', 'bulk1', 'bulk2']
+    assert all(u['locktime'] is not None for u in response_body)
+
+    response = await async_client.post(
+        '/users/bulk',
+        content=msgpack.packb(users[:1], datetime=True),
+        headers={
+            'Authorization': 'Bearer ' + token,
+            'Content-Type': 'application/msgpack',
+        },
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from config import get_settings
+from pytest_tests.conftest import TEST_DB_URL
+from sql_app import migrate
+
+TEST_URL = TEST_DB_URL.render_as_string(hide_password=False)
+# The revision before updated_at was added to the user table.
+BEFORE_UPDATED_AT = 'e07a3d5c94f1'
+
+
+def alembic_config() -> Config:
+    config = Config('alembic_tests.ini')
+    config.set_main_option('sqlalchemy.url', TEST_URL.replace('%', '%%'))
+    return config
+
+
+@pytest.mark.asyncio
+async def test_concurrent_migration_runners(setup_database, monkeypatch):
+    monkeypatch.setattr(get_settings(), 'db_url', TEST_URL)
+    monkeypatch.setattr(get_settings(), 'db_shard_urls', None)
+    await asyncio.gather(
+        migrate.upgrade('alembic_tests.ini'),
+        migrate.upgrade('alembic_tests.ini'),
+    )
+    engine = create_async_engine(TEST_DB_URL, poolclass=NullPool)
+    async with engine.connect() as conn:
+        version = await conn.scalar(
+            text('SELECT version_num FROM alembic_version')
+        )
+        # Released by both runners.
+        assert await conn.scalar(
+            text('SELECT pg_try_advisory_lock(:id)'),
+            {'id': migrate.MIGRATION_LOCK_ID},
+        )
+        await conn.execute(
+            text('SELECT pg_advisory_unlock(:id)'),
+            {'id': migrate.MIGRATION_LOCK_ID},
+        )
+    await engine.dispose()
+    head = ScriptDirectory.from_config(alembic_config()).get_current_head()
+    assert version == head
+
+
+@pytest.mark.asyncio
+async def test_updated_at_is_backfilled_in_batches(
+    setup_database, monkeypatch
+):
+    monkeypatch.setattr(get_settings(), 'migration_backfill_batch_size', 2)
+    monkeypatch.setattr(get_settings(), 'migration_backfill_pause_seconds', 0)
+    config = alembic_config()
+    engine = create_async_engine(TEST_DB_URL, poolclass=NullPool)
+    await asyncio.to_thread(command.downgrade, config, BEFORE_UPDATED_AT)
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(
+                    'INSERT INTO "user" (login, created_at) '
+                    "SELECT 'old' || n, now() - n * interval '1 day' "
+                    'FROM generate_series(1, 5) AS n'
+                )
+            )
+        await asyncio.to_thread(command.upgrade, config, 'head')
+        async with engine.connect() as conn:
+            assert (
+                await conn.scalar(
+                    text(
+                        'SELECT count(*) FROM "user" '
+                        'WHERE updated_at = created_at'
+                    )
+                )
+                == 5
+            )
+            assert await conn.scalar(
+                text(
+                    'SELECT attnotnull FROM pg_attribute '
+                    "WHERE attrelid = '\"user\"'::regclass "
+                    "AND attname = 'updated_at'"
+                )
+            )
+            assert await conn.scalar(
+                text(
+                    'SELECT bool_and(indisvalid) FROM pg_index '
+                    "WHERE indrelid = '\"user\"'::regclass"
+                )
+            )
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text('DELETE FROM "user"'))
+        await engine.dispose()
+        await asyncio.to_thread(command.upgrade, config, 'head')
+
+
+@pytest.mark.asyncio
+async def test_half_applied_revision_is_run_again(setup_database):
+    config = alembic_config()
+    engine = create_async_engine(TEST_DB_URL, poolclass=NullPool)
+    await asyncio.to_thread(command.downgrade, config, BEFORE_UPDATED_AT)
+    try:
+        # What 3f8b6d0e2c57 commits before its SET NOT NULL times out.
+        async with engine.begin() as conn:
+            await conn.execute(
+                text('ALTER TABLE "user" ADD COLUMN updated_at timestamp')
+            )
+            await conn.execute(
+                text(
+                    'ALTER TABLE "user" ADD CONSTRAINT '
+                    'user_updated_at_not_null '
+                    'CHECK (updated_at IS NOT NULL) NOT VALID'
+                )
+            )
+        await asyncio.to_thread(command.upgrade, config, 'head')
+        async with engine.connect() as conn:
+            assert not await conn.scalar(
+                text(
+                    'SELECT count(*) FROM pg_constraint '
+                    "WHERE conname = 'user_updated_at_not_null'"
+                )
+            )
+    finally:
+        await engine.dispose()
+        await asyncio.to_thread(command.upgrade, config, 'head')
+
+
+def test_pgbouncer_needs_a_direct_migration_url(monkeypatch):
+    monkeypatch.setattr(get_settings(), 'db_pgbouncer', True)
+    monkeypatch.setattr(get_settings(), 'db_migration_url', None)
+    with pytest.raises(RuntimeError):
+        migrate.database_urls()
+    monkeypatch.setattr(get_settings(), 'db_migration_url', TEST_URL)
+    assert migrate.database_urls()[0] == TEST_URL
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from pytest_tests.conftest import TEST_DB_URL
+from sql_app import crud
+from sql_app.database import pgbouncer_kwargs
+from tools.pgbouncer import TransactionPoolerStandIn
+
+
+@pytest_asyncio.fixture
+async def standin(setup_database):
+    standin = TransactionPoolerStandIn(
+        TEST_DB_URL.host or 'localhost', TEST_DB_URL.port or 5432
+    )
+    await standin.start()
+    yield standin
+    await standin.stop()
+
+
+async def run_crud_operations(engine) -> None:
+    '''Several requests' worth of crud reads, one session each.'''
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+    for _ in range(3):
+        async with sessionmaker() as session:
+            await crud.get_users(session)
+            await crud.get_user_admin(
+                session=session, type=crud.QueryTypes.ADMIN, login='admin'
+            )
+            await crud.get_project_utilisation(session, since=datetime.now())
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_pgbouncer_mode_is_transaction_pooling_safe(standin):
+    for pool_size in (0, 2):
+        engine = create_async_engine(
+            standin.url(TEST_DB_URL), **pgbouncer_kwargs(pool_size)
+        )
+        await run_crud_operations(engine)
+    assert standin.violations == []
+
+
+@pytest.mark.asyncio
+async def test_default_mode_breaks_transaction_pooling(standin):
+    engine = create_async_engine(standin.url(TEST_DB_URL), pool_size=1)
+    await run_crud_operations(engine)
+    assert standin.violations
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from tools.replay import load_records, replay, summarize
+
+
+@pytest.mark.asyncio
+async def test_replay_recorded_traffic(
+    async_client: AsyncClient,
+    async_session: AsyncSession,
+    token: str,
+    tmp_path,
+):
+    log = tmp_path / 'traffic.jsonl'
+    records = [
+        {
+            'ts': 0.0,
+            'method': 'POST',
+            'path': '/users',
+            'json': {
+                'login': 'aboba',
+                'project_id': 1,
+                'env': 'prod',
+                'domain': 'canary',
+                'password': '1234',
+            },
+        },
+        {'ts': 0.01, 'method': 'GET', 'path': '/users'},
+        {'ts': 0.02, 'method': 'PATCH', 'path': '/users/1/release_lock'},
+    ]
+    log.write_text('\n'.join(json.dumps(r) for r in records) + '\n')
+
+    samples = await replay(
+        async_client, load_records(log), speed=0, concurrency=1, token=token
+    )
+    report = summarize(samples)
+
+    assert set(report) == {
+        'POST /users',
+        'GET /users',
+        'PATCH /users/{id}/release_lock',
+    }
+    assert all(stats['errors'] == 0 for stats in report.values())
+    assert all(s.status < 400 for s in samples)
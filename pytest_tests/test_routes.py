@@ -14,9 +14,19 @@ from pytest_tests.conftest import (
 URLS_METHOD_TYPES = {
     'users': MethodType.GET,
     'users_post': MethodType.POST,
+    'users_bulk': MethodType.POST,
+    'users_claim': MethodType.POST,
     'users_acquire_lock': MethodType.PATCH,
     'users_release_lock': MethodType.PATCH,
+    'users_renew_lock': MethodType.PATCH,
     'admins': MethodType.POST,
+    'stats_projects': MethodType.GET,
+    'projects_quotas': MethodType.GET,
+    'projects_quota': MethodType.PUT,
+    'jobs': MethodType.POST,
+    'job': MethodType.GET,
+    'debug_memory': MethodType.GET,
+    'debug_memory_start': MethodType.POST,
     'superuser': MethodType.POST,
     'token': MethodType.POST,
 }
@@ -35,11 +45,26 @@ URLS_METHOD_TYPES = {
             URLS_METHOD_TYPES['users_post'],
             HTTPStatus.UNAUTHORIZED,
         ),
+        (
+            '/users/bulk',
+            URLS_METHOD_TYPES['users_bulk'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
+        (
+            '/users/claim',
+            URLS_METHOD_TYPES['users_claim'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
         (
             '/users/1/acquire_lock',
             URLS_METHOD_TYPES['users_acquire_lock'],
             HTTPStatus.UNAUTHORIZED,
         ),
+        (
+            '/users/1/renew_lock',
+            URLS_METHOD_TYPES['users_renew_lock'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
         (
             '/users/1/release_lock',
             URLS_METHOD_TYPES['users_release_lock'],
@@ -50,6 +75,41 @@ URLS_METHOD_TYPES = {
             URLS_METHOD_TYPES['admins'],
             HTTPStatus.UNAUTHORIZED,
         ),
+        (
+            '/stats/projects',
+            URLS_METHOD_TYPES['stats_projects'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
+        (
+            '/projects/quotas',
+            URLS_METHOD_TYPES['projects_quotas'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
+        (
+            '/projects/1/quota',
+            URLS_METHOD_TYPES['projects_quota'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
+        (
+            '/jobs',
+            URLS_METHOD_TYPES['jobs'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
+        (
+            '/jobs/1',
+            URLS_METHOD_TYPES['job'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
+        (
+            '/debug/memory',
+            URLS_METHOD_TYPES['debug_memory'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
+        (
+            '/debug/memory/start',
+            URLS_METHOD_TYPES['debug_memory_start'],
+            HTTPStatus.UNAUTHORIZED,
+        ),
         (
             '/superuser',
             URLS_METHOD_TYPES['superuser'],
@@ -90,11 +150,26 @@ async def test_routes_availability_without_token(
             URLS_METHOD_TYPES['users_post'],
             HTTPStatus.UNPROCESSABLE_ENTITY,
         ),
+        (
+            '/users/bulk',
+            URLS_METHOD_TYPES['users_bulk'],
+            HTTPStatus.UNPROCESSABLE_ENTITY,
+        ),
+        (
+            '/users/claim',
+            URLS_METHOD_TYPES['users_claim'],
+            HTTPStatus.UNPROCESSABLE_ENTITY,
+        ),
         (
             '/users/1/acquire_lock',
             URLS_METHOD_TYPES['users_acquire_lock'],
             HTTPStatus.UNPROCESSABLE_ENTITY,
         ),
+        (
+            '/users/1/renew_lock',
+            URLS_METHOD_TYPES['users_renew_lock'],
+            HTTPStatus.UNPROCESSABLE_ENTITY,
+        ),
         (
             '/users/1/release_lock',
             URLS_METHOD_TYPES['users_release_lock'],
@@ -105,6 +180,31 @@ async def test_routes_availability_without_token(
             URLS_METHOD_TYPES['admins'],
             HTTPStatus.UNPROCESSABLE_ENTITY,
         ),
+        (
+            '/stats/projects',
+            URLS_METHOD_TYPES['stats_projects'],
+            HTTPStatus.OK,
+        ),
+        (
+            '/projects/quotas',
+            URLS_METHOD_TYPES['projects_quotas'],
+            HTTPStatus.OK,
+        ),
+        (
+            '/projects/1/quota',
+            URLS_METHOD_TYPES['projects_quota'],
+            HTTPStatus.UNPROCESSABLE_ENTITY,
+        ),
+        (
+            '/jobs',
+            URLS_METHOD_TYPES['jobs'],
+            HTTPStatus.UNPROCESSABLE_ENTITY,
+        ),
+        (
+            '/jobs/1',
+            URLS_METHOD_TYPES['job'],
+            HTTPStatus.NOT_FOUND,
+        ),
     ],
 )
 @pytest.mark.asyncio
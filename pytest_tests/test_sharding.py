@@ -0,0 +1,230 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from config import get_settings
+from pytest_tests.conftest import BASE_TEST_DB_URL, TEST_DB_URL
+from sql_app import crud, jobs, models, schemas
+from sql_app.audit import audit_writer
+from sql_app.database import (
+    dispose_engine,
+    get_engine,
+    get_sessionmaker,
+    get_shards,
+    prepare_shards,
+    shard_for_project,
+    shard_for_user,
+)
+
+SHARD_URLS = [
+    TEST_DB_URL.set(database=f'{TEST_DB_URL.database}_shard{index}')
+    for index in range(2)
+]
+
+
+async def _manage_shard_databases(create: bool) -> None:
+    admin_engine = create_async_engine(
+        BASE_TEST_DB_URL, poolclass=NullPool, isolation_level='AUTOCOMMIT'
+    )
+    async with admin_engine.connect() as conn:
+        for url in SHARD_URLS:
+            await conn.execute(
+                text(f'DROP DATABASE IF EXISTS "{url.database}" WITH (FORCE)')
+            )
+            if create:
+                await conn.execute(text(f'CREATE DATABASE "{url.database}"'))
+    await admin_engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def shards(setup_database, monkeypatch):
+    '''
+    Two fresh, migrated shard databases next to the test database, with
+    project 7 pinned to the second one. The logins registered in the
+    test database are removed afterwards.
+    '''
+    await _manage_shard_databases(create=True)
+    urls = [url.render_as_string(hide_password=False) for url in SHARD_URLS]
+    for url in urls:
+        alembic_cfg = Config('alembic_tests.ini')
+        alembic_cfg.set_main_option('sqlalchemy.url', url.replace('%', '%%'))
+        command.upgrade(alembic_cfg, 'head')
+    settings = get_settings()
+    monkeypatch.setattr(settings, 'db_shard_urls', ','.join(urls))
+    monkeypatch.setattr(settings, 'db_shard_map', json.dumps({'7': 1}))
+    monkeypatch.setattr(audit_writer, 'background', False)
+    await dispose_engine()
+    await prepare_shards()
+    yield get_shards()
+    audit_writer.discard()
+    async with get_engine().begin() as conn:
+        await conn.execute(delete(models.UserLogin))
+    await dispose_engine()
+    await _manage_shard_databases(create=False)
+
+
+def user_create(project_id: int, login: str) -> schemas.UserCreate:
+    return schemas.UserCreate(
+        login=login,
+        password='1234',
+        project_id=project_id,
+        env='prod',
+        domain='canary',
+    )
+
+
+@pytest.mark.asyncio
+async def test_users_are_sharded_by_project(shards):
+    assert shard_for_project(4) == 'shard0'
+    assert shard_for_project(5) == 'shard1'
+    assert shard_for_project(7) == 'shard1'
+
+    async with get_sessionmaker()() as session:
+        created = await crud.create_users(
+            session,
+            [
+                user_create(project_id, f'bot{index}')
+                for index, project_id in enumerate((4, 7, 4, 5))
+            ],
+        )
+    ids = [user.id for user in created]
+    assert len(set(ids)) == 4
+    for user in created:
+        assert shard_for_user(user.id) == shard_for_project(user.project_id)
+
+    # Every row is stored on its project's shard only.
+    for name, engine in shards.items():
+        async with engine.connect() as conn:
+            stored = set(await conn.scalars(select(models.User.id)))
+        assert stored == {
+            user.id
+            for user in created
+            if shard_for_project(user.project_id) == name
+        }
+
+    async with get_sessionmaker()() as session:
+        users = await crud.get_users(session)
+        assert [user.id for user in users] == sorted(ids)
+        changes = await crud.get_user_changes(
+            session, since=None, limit=3, settle_seconds=0
+        )
+        assert len(changes) == 3
+
+    locktime = datetime.now() + timedelta(minutes=5)
+    async with get_sessionmaker()() as session:
+        locked = await crud.acquire_release_lock(
+            session, id=created[1].id, locktime=locktime
+        )
+        assert locked.locktime == locktime
+    async with get_sessionmaker()() as session:
+        claimed = await crud.claim_user(
+            session,
+            project_id=4,
+            env='prod',
+            domain='canary',
+            locktime=locktime,
+            admin_login='admin',
+        )
+        assert claimed.project_id == 4
+        assert shard_for_user(claimed.id) == 'shard0'
+
+
+@pytest.mark.asyncio
+async def test_prepare_shards_is_idempotent(shards):
+    async with get_sessionmaker()() as session:
+        first = await crud.create_user(session, user_create(4, 'first'))
+    await prepare_shards()
+    async with get_sessionmaker()() as session:
+        second = await crud.create_user(session, user_create(4, 'second'))
+    assert second.id == first.id + 64
+
+
+@pytest.mark.asyncio
+async def test_logins_are_unique_across_shards(shards):
+    async with get_sessionmaker()() as session:
+        created = await crud.create_user(session, user_create(4, 'taken'))
+    async with get_sessionmaker()() as session:
+        with pytest.raises(IntegrityError):
+            await crud.create_user(session, user_create(5, 'taken'))
+    async with get_sessionmaker()() as session:
+        found = await crud.get_user_admin(
+            session, type=crud.QueryTypes.USER, login='taken'
+        )
+        assert found.id == created.id
+
+
+@pytest.mark.asyncio
+async def test_failed_creations_free_their_logins(shards, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise RuntimeError('creation failed')
+
+    monkeypatch.setattr(crud.availability_index, 'notify', fail)
+    async with get_sessionmaker()() as session:
+        with pytest.raises(RuntimeError):
+            await crud.create_users(
+                session, [user_create(4, 'first'), user_create(5, 'second')]
+            )
+    async with get_sessionmaker()() as session:
+        registered = await session.scalars(select(models.UserLogin.login))
+        assert registered.all() == []
+    monkeypatch.undo()
+    async with get_sessionmaker()() as session:
+        created = await crud.create_user(session, user_create(4, 'first'))
+    assert created.login == 'first'
+
+
+@pytest.mark.asyncio
+async def test_prepare_shards_refuses_shards_with_users(shards):
+    # A shard that held users before sharding was turned on.
+    async with shards['shard0'].begin() as conn:
+        await conn.execute(text('ALTER SEQUENCE user_id_seq INCREMENT BY 1'))
+        await conn.execute(text("INSERT INTO \"user\" (login) VALUES ('old')"))
+    with pytest.raises(RuntimeError):
+        await prepare_shards()
+
+
+@pytest.mark.asyncio
+async def test_job_chunk_run_again_reports_its_first_run(shards):
+    async with get_sessionmaker()() as session:
+        job = await crud.create_job(
+            session,
+            schemas.ImportJob(
+                kind='import',
+                users=[user_create(4, 'imported'), user_create(7, 'taken')],
+            ),
+        )
+    try:
+        # The users commit on their shards, then the progress does not.
+        async with get_sessionmaker()() as session:
+            async with get_sessionmaker()() as users:
+                chunk = await jobs._import_chunk(session, users, job, 10)
+                await users.commit()
+        assert not chunk.errors
+        # Meanwhile another user took one of the logins.
+        async with get_engine().begin() as conn:
+            await conn.execute(
+                insert(models.UserLogin).values(login='taken', project_id=5)
+            )
+
+        assert await jobs.job_runner.run_once()
+        async with get_sessionmaker()() as session:
+            job = await crud.get_job(session, job.id)
+        assert (job.status, job.succeeded, job.failed) == ('done', 1, 1)
+        assert job.errors == [{'item': 1, 'error': 'login already exists'}]
+        async with shards['shard1'].connect() as conn:
+            assert not list(await conn.scalars(select(models.User.login)))
+        async with shards['shard0'].connect() as conn:
+            assert list(await conn.scalars(select(models.User.login))) == [
+                'imported'
+            ]
+    finally:
+        async with get_engine().begin() as conn:
+            await conn.execute(delete(models.Job))
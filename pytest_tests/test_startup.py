@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# Cumulative time allowed for "import main" in a fresh interpreter.
+IMPORT_TIME_BUDGET_US = 1_500_000
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DATABASE_ENV_VARS = (
+    'DB_URL',
+    'TEST_DB_URL',
+    'POSTGRES_DB',
+    'POSTGRES_USER',
+    'POSTGRES_PASSWORD',
+    'POSTGRES_HOST',
+    'SECRET_KEY',
+)
+
+
+def import_main(code: str) -> subprocess.CompletedProcess:
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in DATABASE_ENV_VARS
+    }
+    # Run outside the project dir so no .env file is picked up.
+    env['PYTHONPATH'] = str(PROJECT_ROOT)
+    return subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd='/',
+    )
+
+
+def test_import_does_not_need_database():
+    result = import_main(
+        'import sys, main; assert "asyncpg" not in sys.modules'
+    )
+    assert result.returncode == 0, result.stderr
+
+
+def test_import_time_budget():
+    result = import_main('import main')
+    assert result.returncode == 0, result.stderr
+    main_line = next(
+        line
+        for line in result.stderr.splitlines()
+        if line.rstrip().endswith('| main')
+    )
+    cumulative_us = int(main_line.split('|')[1])
+    assert cumulative_us < IMPORT_TIME_BUDGET_US
@@ -0,0 +1,205 @@
+import logging
+import math
+import os
+import sys
+import tempfile
+from importlib.util import find_spec
+from types import FrameType
+from typing import Union
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from config import get_settings
+from lifecycle import in_flight_requests
+
+logger = logging.getLogger(__name__)
+
+CGROUP_V2_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+CGROUP_V1_CPU_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CGROUP_V1_CPU_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+
+def _read(path: str) -> Union[str, None]:
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_quota() -> Union[float, None]:
+    '''
+    Returns the container CPU limit in cores from the cgroup (v2 or v1),
+    or None when the container is not limited.
+    '''
+    cpu_max = _read(CGROUP_V2_CPU_MAX)
+    if cpu_max is not None:
+        quota, _, period = cpu_max.partition(' ')
+        if quota != 'max':
+            return int(quota) / int(period or 100000)
+        return None
+    quota, period = _read(CGROUP_V1_CPU_QUOTA), _read(CGROUP_V1_CPU_PERIOD)
+    if quota is not None and period is not None and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def worker_count() -> int:
+    '''
+    WEB_CONCURRENCY if set, otherwise one worker per CPU of the container
+    quota (rounded up), bounded by the CPUs the process may run on.
+    '''
+    settings = get_settings()
+    if settings.web_concurrency:
+        return settings.web_concurrency
+    if hasattr(os, 'sched_getaffinity'):
+        available = len(os.sched_getaffinity(0))
+    else:
+        available = os.cpu_count() or 1
+    quota = cpu_quota()
+    if quota is None:
+        return available
+    return max(1, min(available, math.ceil(quota)))
+
+
+def connections_per_worker() -> tuple[int, int]:
+    '''
+    Returns (engines, reserved) for one worker: the pooled engines it
+    creates (the primary, one per read replica and one per shard) and
+    the connections held outside of them (the availability index
+    LISTEN).
+    '''
+    settings = get_settings()
+    engines = 1
+    for urls in (settings.db_replica_urls, settings.db_shard_urls):
+        engines += len([url for url in (urls or '').split(',') if url.strip()])
+    return engines, int(settings.availability_index)
+
+
+def max_workers() -> int:
+    '''Workers DB_CONNECTIONS_PER_REPLICA has a connection per engine for.'''
+    engines, reserved = connections_per_worker()
+    return get_settings().db_connections_per_replica // (engines + reserved)
+
+
+def pool_sizes(workers: int) -> tuple[int, int]:
+    '''
+    Splits DB_CONNECTIONS_PER_REPLICA between workers and, within a
+    worker, between its engines, so that the connections all workers
+    open never exceed it. Raises ValueError when it is too small for a
+    single connection per engine (see max_workers).
+
+    Returns (pool_size, max_overflow) for each engine of a worker.
+    '''
+    engines, reserved = connections_per_worker()
+    budget = get_settings().db_connections_per_replica // workers
+    per_engine = (budget - reserved) // engines
+    if per_engine < 1:
+        raise ValueError(
+            f'DB_CONNECTIONS_PER_REPLICA is too small for {workers} '
+            f'workers of {engines + reserved} connections'
+        )
+    max_overflow = per_engine // 4
+    return per_engine - max_overflow, max_overflow
+
+
+class DrainingServer(uvicorn.Server):
+    '''
+    Uvicorn server that drains before it closes its listeners.
+
+    On the first SIGTERM (or SIGINT) the worker starts draining: new
+    requests and readiness probes get 503 from RequestDrainMiddleware
+    while the in-flight ones get up to SHUTDOWN_DRAIN_SECONDS to
+    finish. Only then does uvicorn shut down as usual. A second signal
+    shuts down at once.
+    '''
+
+    def handle_exit(self, sig: int, frame: Union[FrameType, None]) -> None:
+        if not self.started or in_flight_requests.draining:
+            super().handle_exit(sig, frame)
+            return
+        # Re-raised by uvicorn once it has shut down.
+        self._captured_signals.append(sig)
+        in_flight_requests.drain(get_settings().shutdown_drain_seconds)
+
+    async def on_tick(self, counter: int) -> bool:
+        if not self.should_exit and in_flight_requests.drained():
+            self.should_exit = True
+        return await super().on_tick(counter)
+
+
+def main() -> None:
+    settings = get_settings()
+    workers = worker_count()
+    if workers > max_workers():
+        if settings.web_concurrency or not max_workers():
+            sys.exit(
+                f'DB_CONNECTIONS_PER_REPLICA is too small for {workers} '
+                'workers, raise it or lower WEB_CONCURRENCY'
+            )
+        logger.warning(
+            'capping %d workers to the %d DB_CONNECTIONS_PER_REPLICA '
+            'has connections for',
+            workers,
+            max_workers(),
+        )
+        workers = max_workers()
+    pool_size, max_overflow = pool_sizes(workers)
+    # Workers are spawned processes: they inherit the environment and
+    # build their engine from it on first use.
+    os.environ.setdefault('DB_POOL_SIZE', str(pool_size))
+    os.environ.setdefault('DB_MAX_OVERFLOW', str(max_overflow))
+    if workers > 1:
+        # A retry usually reaches another worker than the original.
+        if settings.idempotency_store == 'memory':
+            sys.exit(
+                'IDEMPOTENCY_STORE=memory keeps keys per worker, '
+                f'use postgres with {workers} workers'
+            )
+        os.environ.setdefault('IDEMPOTENCY_STORE', 'postgres')
+        # GET /metrics reaches one worker, which reports them all.
+        if settings.metrics_dir is None:
+            os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='metrics-')
+    if settings.metrics_dir is not None:
+        # Snapshots of a previous run's workers.
+        for name in os.listdir(settings.metrics_dir):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(settings.metrics_dir, name))
+    loop = 'uvloop' if find_spec('uvloop') else 'asyncio'
+    http = 'httptools' if find_spec('httptools') else 'h11'
+    logger.info(
+        'starting %d workers (%s, %s), db pool %s+%s per engine',
+        workers,
+        loop,
+        http,
+        os.environ['DB_POOL_SIZE'],
+        os.environ['DB_MAX_OVERFLOW'],
+    )
+    config = uvicorn.Config(
+        'main:app',
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keep_alive,
+        timeout_graceful_shutdown=settings.shutdown_drain_seconds,
+        proxy_headers=True,
+        forwarded_allow_ips=settings.forwarded_allow_ips,
+    )
+    # What uvicorn.run does, with the draining server.
+    server = DrainingServer(config)
+    if workers > 1:
+        sock = config.bind_socket()
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+        if not server.started:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Union
+
+from sqlalchemy import insert, text
+from sqlalchemy.exc import DBAPIError
+
+from config import get_settings
+
+from . import models, partitions
+from .database import get_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# check_violation, raised for a row no partition of lock_event takes.
+NO_PARTITION = '23514'
+
+
+class AuditWriter:
+    '''
+    Buffers lock events in memory and writes them in batches.
+
+    record() never touches the database, so auditing adds no round trip
+    to the lock request. A background task started on first use flushes
+    the buffer with one multi-row INSERT per AUDIT_BATCH_SIZE events,
+    as soon as a batch is full or every AUDIT_FLUSH_INTERVAL seconds.
+    If the buffer reaches AUDIT_MAX_PENDING (e.g. the database is down)
+    new events are dropped and counted instead of growing memory.
+    '''
+
+    def __init__(self) -> None:
+        # Session factory used for inserts, the app's one if None.
+        self.session_factory = None
+        # Tests flush explicitly instead of running the task.
+        self.background = True
+        self.dropped = 0
+        self._pending = deque()
+        self._task = None
+        self._wakeup = None
+        self._closing = False
+
+    def record(
+        self,
+        event: str,
+        user: models.User,
+        admin_login: Union[str, None] = None,
+    ) -> None:
+        settings = get_settings()
+        if len(self._pending) >= settings.audit_max_pending:
+            self.dropped += 1
+            if self.dropped % settings.audit_max_pending == 1:
+                logger.warning('audit buffer full, dropping lock events')
+            return
+        self._pending.append(
+            {
+                'created_at': datetime.now(),
+                'user_id': user.id,
+                'project_id': user.project_id,
+                'event': event,
+                'locktime': user.locktime,
+                'admin_login': admin_login,
+            }
+        )
+        if self.background:
+            self._ensure_started()
+            if len(self._pending) >= settings.audit_batch_size:
+                self._wakeup.set()
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if (
+            self._task is None
+            or self._task.done()
+            or self._task.get_loop() is not loop
+        ):
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        settings = get_settings()
+        while not self._closing:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), settings.audit_flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('failed to write lock events, will retry')
+
+    async def _insert(self, session_factory, batch: list[dict]) -> None:
+        async with session_factory() as session:
+            await session.execute(insert(models.LockEvent).values(batch))
+            await session.commit()
+
+    async def _place(self, session_factory, batch: list[dict]) -> list[dict]:
+        '''
+        Creates the lock_event partitions missing for the batch (while
+        maintenance is behind). Events still without one are logged and
+        dropped; the others are returned.
+        '''
+        settings = get_settings()
+        lock_timeout = settings.partition_lock_timeout_seconds
+        async with session_factory() as session:
+            conn = await session.connection()
+            try:
+                if lock_timeout:
+                    await conn.execute(
+                        text(
+                            "SELECT set_config('lock_timeout', :timeout, true)"
+                        ),
+                        {'timeout': f'{int(lock_timeout * 1000)}ms'},
+                    )
+                created = await partitions.cover(
+                    conn,
+                    [event['created_at'] for event in batch],
+                    settings.lock_history_partition,
+                )
+                await session.commit()
+                logger.warning('created lock_event partitions %s', created)
+            except DBAPIError:
+                await session.rollback()
+                logger.exception('failed to create lock_event partitions')
+            existing = await partitions.existing_partitions(
+                await session.connection()
+            )
+        placed = [
+            event
+            for event in batch
+            if partitions.covered(existing, event['created_at'])
+        ]
+        if len(placed) < len(batch):
+            self.dropped += len(batch) - len(placed)
+            logger.error(
+                'dropped lock events without a partition: %s',
+                [event for event in batch if event not in placed],
+            )
+        return placed
+
+    async def flush(self) -> None:
+        '''
+        Writes every buffered event; failed batches are put back, except
+        for events no partition can take (see _place).
+        '''
+        batch_size = get_settings().audit_batch_size
+        session_factory = self.session_factory or get_sessionmaker()
+        while self._pending:
+            batch = [
+                self._pending.popleft()
+                for _ in range(min(batch_size, len(self._pending)))
+            ]
+            try:
+                try:
+                    await self._insert(session_factory, batch)
+                except DBAPIError as error:
+                    if getattr(error.orig, 'sqlstate', None) != NO_PARTITION:
+                        raise
+                    batch = await self._place(session_factory, batch)
+                    if batch:
+                        await self._insert(session_factory, batch)
+            except BaseException:
+                self._pending.extendleft(reversed(batch))
+                raise
+
+    async def close(self) -> None:
+        '''Stops the background task and writes what is left.'''
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._closing = False
+        await self.flush()
+
+    def discard(self) -> None:
+        self._pending.clear()
+
+
+audit_writer = AuditWriter()
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Union
+
+from sqlalchemy import String, bindparam, func, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from config import get_settings
+
+from . import models
+from .database import AsyncSession, engine_url, get_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'bot_availability'
+
+BucketKey = tuple[int, str, str]
+
+NOTIFY_MANY = select(
+    func.pg_notify(
+        CHANNEL, func.unnest(bindparam('payloads', type_=ARRAY(String)))
+    )
+)
+
+
+def bucket_of(user: models.User) -> BucketKey:
+    return (user.project_id, user.env, user.domain)
+
+
+def _payload(user: models.User, free: bool) -> str:
+    return json.dumps([free, user.id, user.project_id, user.env, user.domain])
+
+
+class AvailabilityIndex:
+    '''
+    In-process index of free bot ids bucketed by (project_id, env, domain).
+
+    The index only proposes candidates: a claim still goes through a
+    conditional UPDATE in the database, which stays the source of truth.
+    It is rebuilt from the user table on start, kept up to date by the
+    crud functions of this worker and by NOTIFY messages on the
+    bot_availability channel from every other worker.
+    '''
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._free: dict[BucketKey, set[int]] = defaultdict(set)
+        self._listener = None
+        self._refresher = None
+        self._listen_engine = None
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self._free.values())
+
+    async def rebuild(self, session: AsyncSession) -> None:
+        '''
+        Replaces the index content with the free bots in the database,
+        picking up the ones whose lease ran out since the last rebuild.
+        '''
+        rows = await session.execute(
+            select(
+                models.User.id,
+                models.User.project_id,
+                models.User.env,
+                models.User.domain,
+            ).where(models.User.is_free(datetime.now()))
+        )
+        free = defaultdict(set)
+        for id, project_id, env, domain in rows:
+            free[(project_id, env, domain)].add(id)
+        self._free = free
+        self.enabled = True
+
+    def mark_free(self, key: BucketKey, id: int) -> None:
+        if self.enabled:
+            self._free[key].add(id)
+
+    def mark_locked(self, key: BucketKey, id: int) -> None:
+        if self.enabled:
+            self._free[key].discard(id)
+
+    def take_candidate(self, key: BucketKey) -> Union[int, None]:
+        '''
+        Removes and returns a free id of the bucket, None if it is empty.
+
+        Taking the id out keeps concurrent claims of this worker from
+        racing for the same row; give_back() returns it on failure.
+        '''
+        bucket = self._free.get(key)
+        if not bucket:
+            return None
+        return bucket.pop()
+
+    def give_back(self, key: BucketKey, id: int) -> None:
+        self.mark_free(key, id)
+
+    async def notify(
+        self, session: AsyncSession, user: models.User, free: bool
+    ) -> None:
+        '''
+        Queues a NOTIFY in the session's transaction, delivered to the
+        other workers only if the transaction commits.
+        '''
+        if not self.enabled:
+            return
+        await session.execute(
+            select(func.pg_notify(CHANNEL, _payload(user, free)))
+        )
+
+    async def notify_many(
+        self, session: AsyncSession, changes: list[tuple[models.User, bool]]
+    ) -> None:
+        '''notify() for several (user, free) changes in one statement.'''
+        if not self.enabled or not changes:
+            return
+        await session.execute(
+            NOTIFY_MANY,
+            {'payloads': [_payload(user, free) for user, free in changes]},
+        )
+
+    def _on_notification(self, connection, pid, channel, payload) -> None:
+        free, id, project_id, env, domain = json.loads(payload)
+        if free:
+            self.mark_free((project_id, env, domain), id)
+        else:
+            self.mark_locked((project_id, env, domain), id)
+
+    async def _listen(self) -> None:
+        '''Holds a dedicated connection LISTENing for changes.'''
+        while True:
+            try:
+                async with self._listen_engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    driver_connection = raw.driver_connection
+                    await driver_connection.add_listener(
+                        CHANNEL, self._on_notification
+                    )
+                    # Changes made before LISTEN took effect are missed,
+                    # so rebuild once the listener is in place.
+                    async with get_sessionmaker()() as session:
+                        await self.rebuild(session)
+                    while not driver_connection.is_closed():
+                        await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('availability listener failed, retrying')
+            await asyncio.sleep(1)
+
+    async def _refresh(self, interval: float) -> None:
+        '''Periodic full rebuild, a safety net for lost notifications.'''
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with get_sessionmaker()() as session:
+                    await self.rebuild(session)
+            except Exception:
+                logger.exception('availability index refresh failed')
+
+    async def start(self, refresh_interval: float) -> None:
+        '''
+        Starts listening for changes; the index is enabled once the first
+        rebuild after LISTEN has completed.
+
+        LISTEN holds a connection of its own, outside of the request
+        pool, to DB_LISTEN_URL or else DB_URL. Behind PgBouncer, which
+        cannot carry it, DB_LISTEN_URL is needed; without it the index is
+        built once and then only follows the rebuilds.
+        '''
+        settings = get_settings()
+        listen_url = settings.db_listen_url
+        if listen_url is None and not settings.db_pgbouncer:
+            listen_url = engine_url()
+        if listen_url is not None:
+            self._listen_engine = create_async_engine(
+                listen_url, poolclass=NullPool
+            )
+            self._listener = asyncio.create_task(self._listen())
+        else:
+            logger.warning('no DB_LISTEN_URL, availability index polls only')
+            try:
+                async with get_sessionmaker()() as session:
+                    await self.rebuild(session)
+            except Exception:
+                logger.exception('availability index build failed')
+        self._refresher = asyncio.create_task(self._refresh(refresh_interval))
+
+    async def stop(self) -> None:
+        self.enabled = False
+        for task in (self._listener, self._refresher):
+            if task is not None:
+                task.cancel()
+        self._listener = self._refresher = None
+        self._free = defaultdict(set)
+        if self._listen_engine is not None:
+            await self._listen_engine.dispose()
+        self._listen_engine = None
+
+
+availability_index = AvailabilityIndex()
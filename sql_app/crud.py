@@ -1,13 +1,38 @@
-from datetime import datetime
+import base64
+from collections import Counter
+from datetime import datetime, timedelta
 from enum import Enum
 from typing import Union
 
 import bcrypt
-from sqlalchemy import select
+from sqlalchemy import (
+    and_,
+    bindparam,
+    case,
+    delete,
+    func,
+    or_,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import NoResultFound
 
-from . import models, schemas
-from .database import AsyncSession
+from . import models, quotas, schemas
+from .audit import audit_writer
+from .availability import availability_index, bucket_of
+from .database import (
+    HOME,
+    AsyncSession,
+    get_shards,
+    shard_for_project,
+    shard_for_user,
+)
+
+
+class LeaseLost(Exception):
+    '''The lease was released or acquired by someone else.'''
 
 
 class QueryTypes(Enum):
@@ -15,6 +40,268 @@ class QueryTypes(Enum):
     ADMIN = 1
 
 
+# Hot path statements are built once with bound parameters: SQLAlchemy
+# keeps their cache key and compiled form, so requests only bind values.
+# Their statement_name execution option names their tracing spans.
+user_table = models.User.__table__
+
+
+def _load_returned_users(statement, name: str):
+    '''
+    ORM statement loading the users returned by a Core UPDATE. Users
+    already in the session are refreshed from the returned rows; ORM
+    UPDATEs would instead synchronize them from the statement's values,
+    which are only bound at execution here.
+    '''
+    return (
+        select(models.User)
+        .from_statement(statement.returning(*user_table.c))
+        .execution_options(populate_existing=True, statement_name=name)
+    )
+
+
+def _named(statement, name: str):
+    return statement.execution_options(statement_name=name)
+
+
+def _on(shard_id: str) -> dict:
+    '''bind_arguments running a statement on one shard only.'''
+    return {'shard_id': shard_id}
+
+
+def _by_id(user: models.User) -> int:
+    return user.id
+
+
+def change_position(
+    change: Union[models.User, models.UserTombstone],
+) -> tuple[datetime, int]:
+    '''Change feed position of a changed user or of a purged one.'''
+    if isinstance(change, models.UserTombstone):
+        return change.deleted_at, change.id
+    return change.updated_at, change.id
+
+
+GET_USERS = _named(select(models.User).order_by(models.User.id), 'get_users')
+GET_USER_ADMIN = {
+    (QueryTypes.ADMIN, 'id'): _named(
+        select(models.Admin).where(models.Admin.id == bindparam('value')),
+        'get_admin_by_id',
+    ),
+    (QueryTypes.ADMIN, 'login'): _named(
+        select(models.Admin).where(models.Admin.login == bindparam('value')),
+        'get_admin_by_login',
+    ),
+    (QueryTypes.USER, 'id'): _named(
+        select(models.User).where(models.User.id == bindparam('value')),
+        'get_user_by_id',
+    ),
+    (QueryTypes.USER, 'login'): _named(
+        select(models.User).where(models.User.login == bindparam('value')),
+        'get_user_by_login',
+    ),
+}
+GET_LOGIN_PROJECT = _named(
+    select(models.UserLogin.project_id).where(
+        models.UserLogin.login == bindparam('value')
+    ),
+    'get_login_project',
+)
+GET_PROJECT_OF_USER = _named(
+    select(models.User.project_id).where(
+        models.User.id == bindparam('user_id')
+    ),
+    'get_project_of_user',
+)
+GET_CREATED_LOGINS = _named(
+    select(models.User.login).where(
+        models.User.login.in_(bindparam('logins', expanding=True))
+    ),
+    'get_created_logins',
+)
+UNREGISTER_LOGINS = _named(
+    delete(models.UserLogin).where(
+        models.UserLogin.login.in_(bindparam('logins', expanding=True))
+    ),
+    'unregister_logins',
+)
+LOCK_USER_FOR_UPDATE = (
+    select(models.User)
+    .where(models.User.id == bindparam('user_id'))
+    .with_for_update()
+    .execution_options(populate_existing=True, statement_name='lock_user')
+)
+LOCK_IF_FREE = _load_returned_users(
+    update(user_table)
+    .where(
+        user_table.c.id == bindparam('user_id'),
+        models.User.is_free(bindparam('now')),
+    )
+    .values(
+        locktime=bindparam('new_locktime'),
+        fencing_token=user_table.c.fencing_token + 1,
+    ),
+    'lock_if_free',
+)
+CLAIM_FREE_USER = _load_returned_users(
+    update(user_table)
+    .where(
+        user_table.c.id
+        == select(user_table.c.id)
+        .where(
+            user_table.c.project_id == bindparam('bucket_project_id'),
+            user_table.c.env == bindparam('bucket_env'),
+            user_table.c.domain == bindparam('bucket_domain'),
+            models.User.is_free(bindparam('now')),
+        )
+        .order_by(user_table.c.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    .values(
+        locktime=bindparam('new_locktime'),
+        fencing_token=user_table.c.fencing_token + 1,
+    ),
+    'claim_free_user',
+)
+RENEW_LEASE = _load_returned_users(
+    update(user_table)
+    .where(
+        user_table.c.id == bindparam('user_id'),
+        user_table.c.fencing_token == bindparam('token'),
+        user_table.c.locktime.is_not(None),
+    )
+    .values(locktime=bindparam('new_locktime')),
+    'renew_lease',
+)
+GET_JOB = (
+    select(models.Job)
+    .where(models.Job.id == bindparam('job_id'))
+    .execution_options(populate_existing=True, statement_name='get_job')
+)
+CANCEL_JOB = (
+    select(models.Job)
+    .from_statement(
+        update(models.Job.__table__)
+        .where(
+            models.Job.id == bindparam('job_id'),
+            models.Job.status.in_(('queued', 'running')),
+        )
+        .values(
+            status='cancelled',
+            finished_at=bindparam('now'),
+            lease_until=None,
+        )
+        .returning(*models.Job.__table__.c)
+    )
+    .execution_options(populate_existing=True, statement_name='cancel_job')
+)
+
+
+async def _admit_locked(
+    session: AsyncSession, users: list[schemas.UserCreate]
+) -> None:
+    '''
+    Checks the quotas of the projects of users created locked; raises
+    quotas.QuotaExceeded after committing the refusal.
+    '''
+    locked = Counter(
+        user.project_id for user in users if user.locktime is not None
+    )
+    # In project order, as concurrent creations take the project locks.
+    for project_id, count in sorted(locked.items()):
+        admitted, reason = await quotas.admit_locks(session, project_id, count)
+        if admitted < count:
+            await session.commit()
+            raise quotas.QuotaExceeded(project_id, reason)
+
+
+async def _register_logins(
+    session: AsyncSession, users: list[schemas.UserCreate]
+) -> None:
+    '''
+    Registers the logins in user_login when the user table is sharded,
+    which raises IntegrityError for a login taken on any shard.
+
+    The registration is committed before the users are created on their
+    shards: a login is never free while its user exists. Should creating
+    the users fail, _unregister_logins frees the logins again.
+    '''
+    await session.execute(
+        insert(models.UserLogin.__table__),
+        [
+            {'login': user.login, 'project_id': user.project_id}
+            for user in users
+        ],
+        bind_arguments=_on(HOME),
+    )
+    await session.commit()
+
+
+async def _unregister_logins(
+    session: AsyncSession, users: list[schemas.UserCreate]
+) -> None:
+    '''
+    Rolls back a failed creation of users and deletes the registered
+    logins of those that do not exist on any shard, as a commit may have
+    failed on some shards only.
+    '''
+    await session.rollback()
+    logins = {user.login for user in users}
+    created = await session.scalars(
+        GET_CREATED_LOGINS, {'logins': sorted(logins)}
+    )
+    missing = logins.difference(created)
+    if missing:
+        await session.execute(
+            UNREGISTER_LOGINS,
+            {'logins': sorted(missing)},
+            bind_arguments=_on(HOME),
+        )
+    await session.commit()
+
+
+async def _insert_users(
+    session: AsyncSession, users: list[schemas.UserCreate]
+) -> list[models.User]:
+    '''
+    Admits and inserts users, notifying the availability index, and
+    commits them.
+    '''
+    await _admit_locked(session, users)
+    db_users = [models.User(**user.model_dump()) for user in users]
+    session.add_all(db_users)
+    await session.flush()
+    for db_user in db_users:
+        await availability_index.notify(
+            session, db_user, free=db_user.locktime is None
+        )
+        await session.refresh(db_user)
+    await session.commit()
+    for db_user in db_users:
+        if db_user.locktime is None:
+            availability_index.mark_free(bucket_of(db_user), db_user.id)
+    return db_users
+
+
+async def _create_users(
+    session: AsyncSession, users: list[schemas.UserCreate]
+) -> list[models.User]:
+    '''
+    Creates users; when the user table is sharded their logins are
+    registered first, and freed again if the users are not created.
+    '''
+    if not get_shards():
+        return await _insert_users(session, users)
+    await _register_logins(session, users)
+    try:
+        return await _insert_users(session, users)
+    except BaseException:
+        await _unregister_logins(session, users)
+        raise
+
+
 async def create_user(
     session: AsyncSession, user: schemas.UserCreate
 ) -> models.User:
@@ -25,15 +312,29 @@ async def create_user(
         - AsyncSession instance.
         - sql_app.schemas.UserCreate Pydantic model.
 
-    A created user is returned.
+    A created user is returned, quotas.QuotaExceeded is raised if it is
+    created locked beyond its project's quota.
     '''
-    db_user = models.User(**user.model_dump())
-    session.add(db_user)
-    await session.commit()
-    await session.refresh(db_user)
+    (db_user,) = await _create_users(session, [user])
     return db_user
 
 
+async def create_users(
+    session: AsyncSession, users: list[schemas.UserCreate]
+) -> list[models.User]:
+    '''
+    Creates several users in the database in one transaction.
+
+    Arguments:
+        - AsyncSession instance.
+        - list of sql_app.schemas.UserCreate Pydantic models.
+
+    Created users are returned in the order given, quotas.QuotaExceeded
+    is raised if those created locked go beyond a project's quota.
+    '''
+    return await _create_users(session, users)
+
+
 async def get_users(session: AsyncSession) -> list[models.User]:
     '''
     Gets all users from the database.
@@ -41,14 +342,81 @@ async def get_users(session: AsyncSession) -> list[models.User]:
     Arguments:
         - AsyncSession instance.
 
-    A list of users is returned.
+    A list of users ordered by id is returned.
     '''
-    users = await session.execute(select(models.User).order_by(models.User.id))
-    return users.scalars().all()
+    users = (await session.execute(GET_USERS)).scalars().all()
+    # Sharded sessions concatenate the shards' ordered results; sorting
+    # merges those runs in linear time.
+    return sorted(users, key=_by_id)
+
+
+def encode_cursor(updated_at: datetime, id: int) -> str:
+    '''Opaque change feed cursor pointing after the given row.'''
+    raw = f'{updated_at.isoformat()}|{id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    '''Inverse of encode_cursor, raises ValueError on a malformed cursor.'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode()
+        updated_at, id = raw.split('|')
+        return datetime.fromisoformat(updated_at), int(id)
+    except (UnicodeError, TypeError, ValueError) as error:
+        raise ValueError('invalid cursor') from error
+
+
+async def get_user_changes(
+    session: AsyncSession,
+    since: Union[tuple[datetime, int], None],
+    limit: int,
+    settle_seconds: float,
+) -> list[Union[models.User, models.UserTombstone]]:
+    '''
+    Gets users changed or purged after a change feed position.
+
+    Arguments:
+        - AsyncSession instance.
+        - since: position (see change_position) of the last change
+          already seen, or None.
+        - limit: maximum number of changes.
+        - settle_seconds: rows changed more recently are left for the
+          next call, so a transaction committing late with an earlier
+          updated_at is not skipped.
+
+    Users and the tombstones of purged users are returned ordered by
+    position.
+    '''
+    settled = func.clock_timestamp() - timedelta(seconds=settle_seconds)
+    user, tombstone = models.User, models.UserTombstone
+    users = select(user).where(user.updated_at <= settled)
+    tombstones = select(tombstone).where(tombstone.deleted_at <= settled)
+    if since is not None:
+        users = users.where(tuple_(user.updated_at, user.id) > tuple_(*since))
+        tombstones = tombstones.where(
+            tuple_(tombstone.deleted_at, tombstone.id) > tuple_(*since)
+        )
+    changes = [
+        *await session.scalars(
+            users.order_by(user.updated_at, user.id).limit(limit)
+        ),
+        *await session.scalars(
+            tombstones.order_by(tombstone.deleted_at, tombstone.id).limit(
+                limit
+            )
+        ),
+    ]
+    # Each shard and table returns up to limit rows in order: merge and
+    # cut.
+    return sorted(changes, key=change_position)[:limit]
 
 
 async def acquire_release_lock(
-    session: AsyncSession, locktime: Union[datetime, None], id: int
+    session: AsyncSession,
+    locktime: Union[datetime, None],
+    id: int,
+    admin_login: Union[str, None] = None,
+    fencing_token: Union[int, None] = None,
 ) -> models.User:
     '''
     Sets user's locktime to a datetime or a null value.
@@ -57,24 +425,386 @@ async def acquire_release_lock(
         - AsyncSession instance.
         - Locktime: datetime or null.
         - id: User's id.
+        - admin_login: login of the admin recorded in the lock history.
+        - fencing_token: if given, the release only succeeds while the
+          lease still carries this token.
+
+    A user whose lease ran out can be acquired again; acquiring bumps
+    the fencing token and is subject to the project's quota. ValueError
+    is raised if the user is occupied, LeaseLost if the fencing token
+    does not match, quotas.QuotaExceeded if the project may not lock
+    another user.
 
     User with specified id and modified locktime is returned.
     '''
-    db_user = await get_user_admin(
-        session=session,
-        type=QueryTypes.USER,
-        id=id,
+    if locktime is None:
+        # The row lock keeps the token check and the release atomic.
+        db_user = await session.scalar(
+            LOCK_USER_FOR_UPDATE,
+            {'user_id': id},
+            bind_arguments=_on(shard_for_user(id)),
+        )
+        if db_user is None:
+            raise NoResultFound
+        if (
+            fencing_token is not None
+            and db_user.fencing_token != fencing_token
+        ):
+            raise LeaseLost
+        db_user.locktime = None
+    else:
+        if quotas.enabled():
+            project_id = await session.scalar(
+                GET_PROJECT_OF_USER,
+                {'user_id': id},
+                bind_arguments=_on(shard_for_user(id)),
+            )
+            if project_id is None:
+                raise NoResultFound
+            await quotas.admit_claim(session, project_id)
+        db_user = await _lock_if_free(session, id, locktime)
+        if db_user is None:
+            exists = await session.scalar(
+                select(models.User.id).where(models.User.id == id),
+                bind_arguments=_on(shard_for_user(id)),
+            )
+            if exists is None:
+                raise NoResultFound
+            raise ValueError
+    await availability_index.notify(session, db_user, free=locktime is None)
+    await session.refresh(db_user)
+    await session.commit()
+    if locktime is None:
+        availability_index.mark_free(bucket_of(db_user), id)
+    else:
+        availability_index.mark_locked(bucket_of(db_user), id)
+    audit_writer.record(
+        'release' if locktime is None else 'acquire', db_user, admin_login
+    )
+    return db_user
+
+
+async def renew_lease(
+    session: AsyncSession,
+    id: int,
+    fencing_token: int,
+    locktime: datetime,
+) -> models.User:
+    '''
+    Extends the lease of a locked user in one conditional UPDATE.
+
+    Arguments:
+        - AsyncSession instance.
+        - id: User's id.
+        - fencing_token: token returned when the lease was acquired.
+        - Locktime: the new end of the lease.
+
+    The lease is renewed as long as nobody acquired the user since,
+    even if it ran out meanwhile. Renewals are not recorded in the lock
+    history.
+
+    The user is returned, LeaseLost is raised if the user was released
+    or acquired by someone else (or does not exist).
+    '''
+    result = await session.execute(
+        RENEW_LEASE,
+        {'user_id': id, 'token': fencing_token, 'new_locktime': locktime},
+        bind_arguments=_on(shard_for_user(id)),
     )
+    db_user = result.scalar_one_or_none()
     if db_user is None:
+        await session.rollback()
+        raise LeaseLost
+    await session.commit()
+    return db_user
+
+
+async def _lock_if_free(
+    session: AsyncSession, id: int, locktime: datetime
+) -> Union[models.User, None]:
+    '''Conditionally locks a user, None if it is gone or already locked.'''
+    result = await session.execute(
+        LOCK_IF_FREE,
+        {'user_id': id, 'now': datetime.now(), 'new_locktime': locktime},
+        bind_arguments=_on(shard_for_user(id)),
+    )
+    return result.scalar_one_or_none()
+
+
+async def claim_user(
+    session: AsyncSession,
+    project_id: int,
+    env: str,
+    domain: str,
+    locktime: datetime,
+    admin_login: Union[str, None] = None,
+) -> models.User:
+    '''
+    Locks any free user of the given project, env and domain.
+
+    Arguments:
+        - AsyncSession instance.
+        - project_id, env, domain: the bucket to claim from.
+        - Locktime: datetime.
+        - admin_login: login of the admin recorded in the lock history.
+
+    The project's quota is checked first (see sql_app.quotas), in the
+    same transaction. Candidates come from the availability index when
+    it is enabled, otherwise (or once they run out) a free row is picked
+    in the database with FOR UPDATE SKIP LOCKED. Either way the lock
+    itself is a conditional UPDATE.
+
+    The locked user is returned, NoResultFound is raised if none is
+    free, quotas.QuotaExceeded if the project may not lock another one.
+    '''
+    await quotas.admit_claim(session, project_id)
+    key = (project_id, env, domain)
+    db_user = None
+    while db_user is None:
+        id = availability_index.take_candidate(key)
+        if id is None:
+            break
+        try:
+            db_user = await _lock_if_free(session, id, locktime)
+        except Exception:
+            availability_index.give_back(key, id)
+            raise
+    if db_user is None:
+        result = await session.execute(
+            CLAIM_FREE_USER,
+            {
+                'bucket_project_id': project_id,
+                'bucket_env': env,
+                'bucket_domain': domain,
+                'now': datetime.now(),
+                'new_locktime': locktime,
+            },
+            bind_arguments=_on(shard_for_project(project_id)),
+        )
+        db_user = result.scalar_one_or_none()
+    if db_user is None:
+        await session.rollback()
         raise NoResultFound
-    if db_user.locktime is not None and locktime is not None:
-        raise ValueError
-    db_user.locktime = locktime
+    await availability_index.notify(session, db_user, free=False)
     await session.commit()
-    await session.refresh(db_user)
+    availability_index.mark_locked(key, db_user.id)
+    audit_writer.record('claim', db_user, admin_login)
     return db_user
 
 
+async def get_project_quotas(
+    session: AsyncSession,
+) -> list[models.ProjectQuota]:
+    '''
+    Lists the claim quotas of projects.
+
+    Arguments:
+        - AsyncSession instance.
+
+    Projects are returned ordered by project_id.
+    '''
+    rows = await session.scalars(
+        select(models.ProjectQuota).order_by(models.ProjectQuota.project_id)
+    )
+    return sorted(rows.all(), key=lambda quota: quota.project_id)
+
+
+async def set_project_quota(
+    session: AsyncSession, project_id: int, quota: schemas.ProjectQuota
+) -> models.ProjectQuota:
+    '''
+    Creates or replaces the claim quota of a project.
+
+    Arguments:
+        - AsyncSession instance.
+        - project_id: the project.
+        - sql_app.schemas.ProjectQuota Pydantic model.
+
+    The stored quota is returned.
+    '''
+    statement = insert(models.ProjectQuota).values(
+        project_id=project_id,
+        max_locks=quota.max_locks,
+        priority=quota.priority,
+    )
+    db_quota = await session.scalar(
+        statement.on_conflict_do_update(
+            index_elements=[models.ProjectQuota.project_id],
+            set_={
+                'max_locks': statement.excluded.max_locks,
+                'priority': statement.excluded.priority,
+            },
+        ).returning(models.ProjectQuota),
+        execution_options={'populate_existing': True},
+        bind_arguments=_on(shard_for_project(project_id)),
+    )
+    await session.commit()
+    return db_quota
+
+
+async def create_job(
+    session: AsyncSession,
+    job: schemas.JobCreate,
+    admin_login: Union[str, None] = None,
+) -> models.Job:
+    '''
+    Queues a background job (see sql_app.jobs).
+
+    Arguments:
+        - AsyncSession instance.
+        - one of the sql_app.schemas job Pydantic models.
+        - login of the admin queueing it.
+
+    The queued job is returned.
+    '''
+    db_job = models.Job(
+        kind=job.kind,
+        params=job.model_dump(mode='json', exclude={'kind'}),
+        admin_login=admin_login,
+    )
+    session.add(db_job)
+    await session.flush()
+    await session.refresh(db_job)
+    await session.commit()
+    return db_job
+
+
+async def get_job(session: AsyncSession, id: int) -> models.Job:
+    '''
+    Gets a background job with its progress.
+
+    Arguments:
+        - AsyncSession instance.
+        - id: the job.
+
+    Raises NoResultFound if there is no such job.
+    '''
+    return (await session.execute(GET_JOB, {'job_id': id})).scalar_one()
+
+
+async def cancel_job(session: AsyncSession, id: int) -> models.Job:
+    '''
+    Cancels a queued or running job; a running job stops before its
+    next chunk, the chunks already committed stay.
+
+    Arguments:
+        - AsyncSession instance.
+        - id: the job.
+
+    The job is returned, unchanged if it had already finished. Raises
+    NoResultFound if there is no such job.
+    '''
+    result = await session.execute(
+        CANCEL_JOB, {'job_id': id, 'now': datetime.now()}
+    )
+    db_job = result.scalar_one_or_none()
+    await session.commit()
+    if db_job is None:
+        return await get_job(session, id)
+    return db_job
+
+
+async def get_project_utilisation(
+    session: AsyncSession,
+    since: datetime,
+    lookback: timedelta = timedelta(hours=24),
+) -> list[schemas.ProjectUtilisation]:
+    '''
+    Aggregates the lock history per project.
+
+    Arguments:
+        - AsyncSession instance.
+        - since: start of the period.
+        - lookback: how long before the period a lock still counted
+          may have been taken.
+
+    A lock is counted from its acquire/claim event to the following
+    release of the same user. A lock whose lease ran out (its holder
+    died) is counted up to the earlier of its recorded locktime and the
+    user's next event; one still held, up to now. Locks taken within
+    the lookback before the period are counted from its start.
+    Utilisation is locked_seconds divided by the project's bot count
+    times the period length.
+    '''
+    event = models.LockEvent
+    window = {
+        'partition_by': event.user_id,
+        'order_by': (event.created_at, event.id),
+    }
+    ordered = (
+        select(
+            event.project_id,
+            event.user_id,
+            event.event,
+            event.created_at,
+            event.locktime,
+            func.lead(event.event).over(**window).label('next_event'),
+            func.lead(event.created_at).over(**window).label('next_at'),
+        )
+        .where(event.created_at >= since - lookback)
+        .subquery()
+    )
+    in_period = ordered.c.created_at >= since
+    is_lock = ordered.c.event.in_(('acquire', 'claim'))
+    # Renewals are not recorded, so a release, not the locktime, ends a
+    # lock it follows.
+    ended = case(
+        (ordered.c.next_event == 'release', ordered.c.next_at),
+        else_=func.least(
+            func.coalesce(ordered.c.next_at, datetime.now()),
+            ordered.c.locktime,
+        ),
+    )
+    held = ended - func.greatest(ordered.c.created_at, since)
+    overlaps = and_(is_lock, ended > since)
+    counted = or_(in_period, overlaps)
+    per_project = (
+        select(
+            ordered.c.project_id,
+            func.count().filter(is_lock, in_period).label('locks'),
+            func.count()
+            .filter(ordered.c.event == 'release', in_period)
+            .label('releases'),
+            func.count(ordered.c.user_id.distinct())
+            .filter(counted)
+            .label('locked_bots'),
+            func.coalesce(
+                func.sum(func.extract('epoch', held)).filter(overlaps), 0
+            ).label('locked_seconds'),
+        )
+        .group_by(ordered.c.project_id)
+        .having(func.count().filter(counted) > 0)
+        .order_by(ordered.c.project_id)
+    )
+    # Bots are counted apart: the user table may be sharded away from
+    # the lock history.
+    bots = {}
+    for project_id, count in await session.execute(
+        select(models.User.project_id, func.count()).group_by(
+            models.User.project_id
+        )
+    ):
+        bots[project_id] = bots.get(project_id, 0) + count
+    rows = await session.execute(per_project)
+    period = max((datetime.now() - since).total_seconds(), 1)
+    return [
+        schemas.ProjectUtilisation(
+            project_id=row.project_id,
+            bots=bots.get(row.project_id, 0),
+            locked_bots=row.locked_bots,
+            locks=row.locks,
+            releases=row.releases,
+            locked_seconds=float(row.locked_seconds),
+            utilisation=(
+                float(row.locked_seconds) / (bots[row.project_id] * period)
+                if bots.get(row.project_id)
+                else 0.0
+            ),
+        )
+        for row in rows
+    ]
+
+
 async def create_admin(
     session: AsyncSession, admin: schemas.AdminUser
 ) -> models.Admin:
@@ -92,8 +822,9 @@ async def create_admin(
         password=bcrypt.hashpw(admin.password, bcrypt.gensalt()),
     )
     session.add(db_admin)
-    await session.commit()
+    await session.flush()
     await session.refresh(db_admin)
+    await session.commit()
     return db_admin
 
 
@@ -121,8 +852,9 @@ async def create_first_admin(
             password=bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()),
         )
         session.add(first_db_admin)
-        await session.commit()
+        await session.flush()
         await session.refresh(first_db_admin)
+        await session.commit()
     return first_db_admin
 
 
@@ -143,22 +875,20 @@ async def get_user_admin(
 
     Returns an Admin or User instance
     '''
-    if type == QueryTypes.ADMIN:
-        if id is not None:
-            user_admin = await session.execute(
-                select(models.Admin).filter(models.Admin.id == id)
-            )
-        elif login is not None:
-            user_admin = await session.execute(
-                select(models.Admin).filter(models.Admin.login == login)
-            )
-    elif type == QueryTypes.USER:
-        if id is not None:
-            user_admin = await session.execute(
-                select(models.User).filter(models.User.id == id)
-            )
-        elif login is not None:
-            user_admin = await session.execute(
-                select(models.User).filter(models.User.login == login)
+    bind_arguments = None
+    if id is not None:
+        query, value = GET_USER_ADMIN[(type, 'id')], id
+    else:
+        query, value = GET_USER_ADMIN[(type, 'login')], login
+        if type == QueryTypes.USER and get_shards():
+            # Only the user_login registry knows the login's shard.
+            project_id = await session.scalar(
+                GET_LOGIN_PROJECT, {'value': login}, bind_arguments=_on(HOME)
             )
+            if project_id is None:
+                return None
+            bind_arguments = _on(shard_for_project(project_id))
+    user_admin = await session.execute(
+        query, {'value': value}, bind_arguments=bind_arguments
+    )
     return user_admin.scalar_one_or_none()
@@ -1,25 +1,495 @@
-import os
-import sys
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
 
-from dotenv import load_dotenv
+from fastapi import Depends
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.util import find_tables
 
-load_dotenv()
+from config import get_settings
 
-DATABASE_URL = os.getenv('DB_URL')
-if 'pytest' in sys.modules:
-    DATABASE_URL = os.getenv('TEST_DB_URL')
+logger = logging.getLogger(__name__)
 
-engine = create_async_engine(DATABASE_URL)
-async_session = sessionmaker(
-    bind=engine, expire_on_commit=False, class_=AsyncSession
-)
+_engine = None
+_async_session = None
+_engine_url = None
+_engine_kwargs = {}
+_replicas = None
+_replica_cycle = None
+_shards = None
+_shard_map = {}
+_pool_wait_callbacks = []
 
 Base = declarative_base()
 
+REPLICA_LAG_QUERY = text(
+    '''
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+    '''
+)
+# How often a replica's lag is re-measured, and how long that may take
+# before the replica is considered unavailable.
+REPLICA_LAG_CHECK_INTERVAL = 5.0
+REPLICA_LAG_CHECK_TIMEOUT = 1.0
+# Shard id of the DB_URL database, home of every table not sharded.
+HOME = 'home'
+# User ids of shard i are i + 1 modulo the stride (see prepare_shards),
+# so an id alone names its shard. Also the maximum number of shards.
+SHARD_ID_STRIDE = 64
+# Serializes prepare_shards between workers.
+SHARD_PREPARE_LOCK_ID = 0x5A4D
+
+
+def configure_engine(url, **engine_kwargs) -> None:
+    '''
+    Sets the url and options of the engine used by get_session.
+
+    The engine itself is created lazily on first use. By default it is
+    built from the DB_URL setting; tests call this to point the app at
+    their own per-worker database.
+    '''
+    global _engine, _async_session, _engine_url, _engine_kwargs
+    _engine = None
+    _async_session = None
+    _engine_url = url
+    _engine_kwargs = engine_kwargs
+
+
+def _unique_statement_name() -> str:
+    return f'__asyncpg_{uuid.uuid4()}__'
+
+
+def pgbouncer_kwargs(pool_size: int = 0) -> dict:
+    '''
+    Engine options for PgBouncer in transaction pooling mode.
+
+    Consecutive transactions of one client connection may run on
+    different server connections there, so asyncpg's statement caches
+    are disabled and every prepared statement gets a unique name. The
+    pool is a NullPool, or a small fixed one when pool_size is given,
+    as PgBouncer does the actual pooling.
+    '''
+    engine_kwargs = {
+        'connect_args': {
+            'statement_cache_size': 0,
+            'prepared_statement_cache_size': 0,
+            'prepared_statement_name_func': _unique_statement_name,
+        }
+    }
+    if pool_size > 0:
+        engine_kwargs.update(pool_size=pool_size, max_overflow=0)
+    else:
+        engine_kwargs['poolclass'] = NullPool
+    return engine_kwargs
+
+
+def _pool_kwargs() -> dict:
+    settings = get_settings()
+    if settings.db_pgbouncer:
+        return pgbouncer_kwargs(settings.db_pgbouncer_pool_size)
+    engine_kwargs = {}
+    if settings.db_pool_size is not None:
+        engine_kwargs['pool_size'] = settings.db_pool_size
+    if settings.db_max_overflow is not None:
+        engine_kwargs['max_overflow'] = settings.db_max_overflow
+    return engine_kwargs
+
+
+def engine_url() -> str:
+    '''Url of the engine: DB_URL, or the one given to configure_engine.'''
+    return _engine_url or get_settings().db_url
+
+
+def get_engine():
+    '''Returns the engine, creating it on the first call.'''
+    global _engine
+    if _engine is None:
+        engine_kwargs = _pool_kwargs()
+        engine_kwargs.update(_engine_kwargs)
+        _engine = create_async_engine(engine_url(), **engine_kwargs)
+    return _engine
+
+
+def direct_url() -> str:
+    '''
+    DB_MIGRATION_URL, otherwise DB_URL: Postgres itself, for the work
+    that needs a session of its own (session advisory locks, SET,
+    migrations). Raises RuntimeError when DB_URL is PgBouncer
+    (DB_PGBOUNCER) and DB_MIGRATION_URL is not set.
+    '''
+    settings = get_settings()
+    if settings.db_migration_url:
+        return settings.db_migration_url
+    if settings.db_pgbouncer:
+        raise RuntimeError(
+            'DB_PGBOUNCER is set: DB_MIGRATION_URL must point at Postgres '
+            'directly'
+        )
+    return settings.db_url
+
+
+class TimedSession(Session):
+    '''Sync session class measuring how long a connection checkout waits.'''
+
+
+@event.listens_for(TimedSession, 'after_transaction_create')
+def _transaction_created(session, transaction) -> None:
+    if transaction.parent is None:
+        session.info['begin_started'] = time.perf_counter()
+
+
+@event.listens_for(TimedSession, 'after_begin')
+def _transaction_began(session, transaction, connection) -> None:
+    started = session.info.pop('begin_started', None)
+    if started is not None:
+        waited = time.perf_counter() - started
+        for callback in _pool_wait_callbacks:
+            callback(waited)
+
+
+def on_pool_wait(callback) -> None:
+    '''Registers a callback receiving every connection wait in seconds.'''
+    _pool_wait_callbacks.append(callback)
+
+
+def get_shards() -> dict:
+    '''
+    Returns the shard engines from DB_SHARD_URLS by shard id, creating
+    them once; empty when the user table is not sharded.
+    '''
+    global _shards, _shard_map
+    if _shards is None:
+        settings = get_settings()
+        urls = [
+            url.strip()
+            for url in (settings.db_shard_urls or '').split(',')
+            if url.strip()
+        ]
+        if len(urls) > SHARD_ID_STRIDE:
+            raise ValueError(f'at most {SHARD_ID_STRIDE} shards')
+        _shard_map = {
+            int(project_id): int(index)
+            for project_id, index in json.loads(
+                settings.db_shard_map or '{}'
+            ).items()
+        }
+        _shards = {
+            f'shard{index}': create_async_engine(url, **_pool_kwargs())
+            for index, url in enumerate(urls)
+        }
+    return _shards
+
+
+def shard_for_project(project_id) -> str:
+    '''Shard id of a project's rows: DB_SHARD_MAP, or by modulo.'''
+    shards = get_shards()
+    if not shards:
+        return HOME
+    index = _shard_map.get(project_id, (project_id or 0) % len(shards))
+    return f'shard{index}'
+
+
+def shard_for_user(id: int) -> str:
+    '''Shard id of a user id (see prepare_shards).'''
+    shards = get_shards()
+    if not shards:
+        return HOME
+    return f'shard{(id - 1) % SHARD_ID_STRIDE % len(shards)}'
+
+
+# Sharded tables with the shard of a row by its primary key; every
+# other table lives in the home database.
+SHARDED_TABLES = {
+    'user': shard_for_user,
+    'user_tombstone': shard_for_user,
+    'project_quota': shard_for_project,
+}
+
+
+class ShardedTimedSession(ShardedSession, TimedSession):
+    '''
+    TimedSession spread over the shards. Statements run on the shard
+    given as bind_arguments={'shard_id': ...}; otherwise statements on a
+    sharded table run on every shard, with the results concatenated,
+    and the rest on the home database.
+    '''
+
+
+def _is_sharded(mapper) -> bool:
+    return mapper is not None and mapper.local_table.name in SHARDED_TABLES
+
+
+def _choose_shard(mapper, instance, clause=None) -> str:
+    if not _is_sharded(mapper):
+        return HOME
+    if instance is None:
+        raise ValueError(f'{mapper.local_table.name} needs a shard_id')
+    return shard_for_project(instance.project_id)
+
+
+def _choose_identity_shards(mapper, primary_key, **kwargs) -> list[str]:
+    if not _is_sharded(mapper):
+        return [HOME]
+    return [SHARDED_TABLES[mapper.local_table.name](primary_key[0])]
+
+
+def _choose_execute_shards(context) -> list[str]:
+    tables = find_tables(context.statement, include_crud=True)
+    if any(table.name in SHARDED_TABLES for table in tables):
+        return list(get_shards())
+    return [HOME]
+
+
+def get_sessionmaker() -> sessionmaker:
+    '''
+    Returns the session factory bound to the engine, or to the home
+    engine and the shards when DB_SHARD_URLS is set.
+    '''
+    global _async_session
+    if _async_session is None:
+        shards = get_shards()
+        if not shards:
+            _async_session = sessionmaker(
+                bind=get_engine(),
+                expire_on_commit=False,
+                class_=AsyncSession,
+                sync_session_class=TimedSession,
+            )
+            return _async_session
+        _async_session = sessionmaker(
+            expire_on_commit=False,
+            class_=AsyncSession,
+            sync_session_class=ShardedTimedSession,
+            shards={
+                name: engine.sync_engine
+                for name, engine in {HOME: get_engine(), **shards}.items()
+            },
+            shard_chooser=_choose_shard,
+            identity_chooser=_choose_identity_shards,
+            execute_chooser=_choose_execute_shards,
+        )
+    return _async_session
+
+
+async def prepare_shards() -> None:
+    '''
+    Makes shard i hand out the user ids i + 1, i + 1 + SHARD_ID_STRIDE,
+    ... Runs once per shard, under an advisory lock.
+
+    Raises RuntimeError for a shard that already has users: their ids
+    do not name the shard, nor are their logins in user_login.
+    '''
+    for index, engine in enumerate(get_shards().values()):
+        async with engine.begin() as conn:
+            await conn.execute(
+                text('SELECT pg_advisory_xact_lock(:id)'),
+                {'id': SHARD_PREPARE_LOCK_ID},
+            )
+            sequence = await conn.scalar(
+                text("SELECT pg_get_serial_sequence('\"user\"', 'id')")
+            )
+            increment = await conn.scalar(
+                text(
+                    'SELECT seqincrement FROM pg_sequence '
+                    'WHERE seqrelid = CAST(:sequence AS regclass)'
+                ),
+                {'sequence': sequence},
+            )
+            if increment == SHARD_ID_STRIDE:
+                continue
+            has_users = await conn.scalar(
+                text('SELECT EXISTS (SELECT FROM "user")')
+            )
+            if has_users:
+                raise RuntimeError(
+                    f'shard {index} has users from before it was prepared; '
+                    'shards must start empty'
+                )
+            last = await conn.scalar(
+                text(
+                    'SELECT greatest(max(id), '
+                    'pg_sequence_last_value(CAST(:sequence AS regclass)), '
+                    '0) FROM "user"'
+                ),
+                {'sequence': sequence},
+            )
+            await conn.execute(
+                text(
+                    f'ALTER SEQUENCE {sequence} INCREMENT BY {SHARD_ID_STRIDE}'
+                )
+            )
+            await conn.execute(
+                text('SELECT setval(:sequence, :next, false)'),
+                {
+                    'sequence': sequence,
+                    'next': last + 1 + (index - last) % SHARD_ID_STRIDE,
+                },
+            )
+
+
+class Replica:
+    '''A read replica engine with its health and lag state.'''
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.engine = create_async_engine(url, **_pool_kwargs())
+        self.unavailable_until = 0.0
+        self.lag_checked_at = 0.0
+        self.lag = 0.0
+        self._lag_check = None
+
+    def mark_failed(self) -> None:
+        self.unavailable_until = (
+            time.monotonic() + get_settings().db_replica_retry_seconds
+        )
+
+    async def _query_lag(self) -> float:
+        async with self.engine.connect() as conn:
+            return float(await conn.scalar(REPLICA_LAG_QUERY))
+
+    async def _measure_lag(self) -> None:
+        try:
+            self.lag = await asyncio.wait_for(
+                self._query_lag(), REPLICA_LAG_CHECK_TIMEOUT
+            )
+        except (DBAPIError, OSError, asyncio.TimeoutError):
+            logger.warning('replica %s is unavailable', self.url)
+            self.mark_failed()
+            return
+        self.lag_checked_at = time.monotonic()
+
+    async def is_usable(self) -> bool:
+        '''
+        False while the replica is in its failure back-off or lags behind
+        the primary by more than DB_REPLICA_MAX_LAG_SECONDS.
+
+        Lag is measured in a background task, so requests never wait on
+        it; until a measurement is at most two intervals old the replica
+        is not used.
+        '''
+        now = time.monotonic()
+        if now < self.unavailable_until:
+            return False
+        if now - self.lag_checked_at > REPLICA_LAG_CHECK_INTERVAL and (
+            self._lag_check is None or self._lag_check.done()
+        ):
+            self._lag_check = asyncio.create_task(self._measure_lag())
+        if now - self.lag_checked_at > 2 * REPLICA_LAG_CHECK_INTERVAL:
+            return False
+        return self.lag <= get_settings().db_replica_max_lag_seconds
+
+
+def get_replicas() -> list[Replica]:
+    '''Returns the replicas from DB_REPLICA_URLS, creating them once.'''
+    global _replicas, _replica_cycle
+    if _replicas is None:
+        urls = (
+            url.strip()
+            for url in (get_settings().db_replica_urls or '').split(',')
+        )
+        _replicas = [Replica(url) for url in urls if url]
+        _replica_cycle = itertools.cycle(_replicas)
+    return _replicas
+
+
+async def _pick_replica():
+    '''Round-robins over usable replicas; None means use the primary.'''
+    for _ in get_replicas():
+        replica = next(_replica_cycle)
+        if await replica.is_usable():
+            return replica
+    return None
+
+
+def _is_connection_error(error: Exception) -> bool:
+    if isinstance(error, (OSError, OperationalError, InterfaceError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+class ReplicaSession(AsyncSession):
+    '''
+    Read-only session bound to a replica.
+
+    If the replica fails before any statement succeeded, the replica is
+    put into back-off and the statement is retried on the primary.
+    '''
+
+    def __init__(self, replica: Replica, **kwargs) -> None:
+        super().__init__(bind=replica.engine, **kwargs)
+        self.replica = replica
+        self._succeeded = False
+
+    async def execute(self, *args, **kwargs):
+        try:
+            result = await super().execute(*args, **kwargs)
+        except (DBAPIError, OSError) as error:
+            if self._succeeded or not _is_connection_error(error):
+                raise
+            logger.warning(
+                'replica %s failed, falling back to primary', self.replica.url
+            )
+            self.replica.mark_failed()
+            await self.rollback()
+            self.bind = get_engine()
+            self.sync_session.bind = self.bind.sync_engine
+            result = await super().execute(*args, **kwargs)
+        self._succeeded = True
+        return result
+
+
+async def dispose_engine() -> None:
+    '''Closes every pooled connection; engines are rebuilt on next use.'''
+    global _engine, _async_session, _replicas, _shards
+    if _engine is not None:
+        await _engine.dispose()
+    for replica in _replicas or ():
+        if replica._lag_check is not None:
+            replica._lag_check.cancel()
+        await replica.engine.dispose()
+    for shard in (_shards or {}).values():
+        await shard.dispose()
+    _engine = None
+    _async_session = None
+    _replicas = None
+    _shards = None
+
 
 async def get_session():
     '''Dependency session.'''
-    async with async_session() as session:
+    async with get_sessionmaker()() as session:
+        yield session
+
+
+async def get_read_session(session: AsyncSession = Depends(get_session)):
+    '''
+    Dependency session for read-only queries.
+
+    Uses a replica from DB_REPLICA_URLS when one is healthy and not
+    lagging, otherwise the request's primary session (sessions only
+    check out a connection on first use, so the unused one is free).
+    Replicas hold the home database only, so with DB_SHARD_URLS reads
+    stay on the primaries.
+    '''
+    if get_shards():
+        yield session
+        return
+    replica = await _pick_replica()
+    if replica is None:
         yield session
+        return
+    async with ReplicaSession(replica, expire_on_commit=False) as read_session:
+        yield read_session
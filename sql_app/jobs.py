@@ -0,0 +1,795 @@
+import asyncio
+import contextlib
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, NamedTuple, Union
+
+from sqlalchemy import bindparam, delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import JSONB, insert
+
+from config import get_settings
+from metrics import Counter, registry
+
+from . import models, quotas
+from .audit import audit_writer
+from .availability import availability_index, bucket_of
+from .database import (
+    HOME,
+    AsyncSession,
+    get_sessionmaker,
+    get_shards,
+    shard_for_project,
+)
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ('done', 'failed', 'cancelled')
+# Lock history event of the users a job changed.
+AUDIT_EVENTS = {'lock': 'acquire', 'release': 'release'}
+
+job_table = models.Job.__table__
+user_table = models.User.__table__
+login_table = models.UserLogin.__table__
+tombstone_table = models.UserTombstone.__table__
+chunk_table = models.JobChunk.__table__
+# Columns of the changed users the index and the audit log need.
+CHANGED = (
+    user_table.c.id,
+    user_table.c.login,
+    user_table.c.project_id,
+    user_table.c.env,
+    user_table.c.domain,
+    user_table.c.locktime,
+)
+
+# The oldest queued job, or a running one whose worker lost its lease.
+CLAIM_JOB = (
+    select(models.Job)
+    .from_statement(
+        update(job_table)
+        .where(
+            job_table.c.id
+            == select(job_table.c.id)
+            .where(
+                job_table.c.status.in_(('queued', 'running')),
+                or_(
+                    job_table.c.lease_until.is_(None),
+                    job_table.c.lease_until < bindparam('now'),
+                ),
+            )
+            .order_by(job_table.c.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        .values(
+            status='running',
+            attempt=job_table.c.attempt + 1,
+            lease_until=bindparam('new_lease_until'),
+            started_at=func.coalesce(job_table.c.started_at, bindparam('now')),
+        )
+        .returning(*job_table.c)
+    )
+    .execution_options(populate_existing=True, statement_name='claim_job')
+)
+# Updates of the job held by a worker: they change nothing once the job
+# was cancelled or taken over by another worker.
+_held_job = update(job_table).where(
+    job_table.c.id == bindparam('job_id'),
+    job_table.c.attempt == bindparam('held_attempt'),
+    job_table.c.status == 'running',
+)
+ADVANCE_JOB = _held_job.values(
+    total=bindparam('new_total'),
+    cursor=bindparam('new_cursor'),
+    processed=job_table.c.processed + bindparam('new_processed'),
+    succeeded=job_table.c.succeeded + bindparam('new_succeeded'),
+    failed=job_table.c.failed + bindparam('new_failed'),
+    errors=job_table.c.errors.op('||', return_type=JSONB)(
+        bindparam('new_errors', type_=JSONB)
+    ),
+    status=bindparam('new_status'),
+    lease_until=bindparam('new_lease_until'),
+    finished_at=bindparam('new_finished_at'),
+).execution_options(statement_name='advance_job')
+SET_JOB_STATUS = _held_job.values(
+    status=bindparam('new_status'),
+    error=bindparam('new_error'),
+    lease_until=bindparam('new_lease_until'),
+    finished_at=bindparam('new_finished_at'),
+).execution_options(statement_name='set_job_status')
+# Puts a job back in the queue on shutdown, not counting the attempt.
+RELEASE_JOB = _held_job.values(
+    status='queued', lease_until=None, attempt=job_table.c.attempt - 1
+).execution_options(statement_name='release_job')
+
+_in_chunk = user_table.c.id.in_(bindparam('ids', expanding=True))
+LOCK_USERS = (
+    update(user_table)
+    .where(_in_chunk, models.User.is_free(bindparam('now')))
+    .values(
+        locktime=bindparam('new_locktime'),
+        fencing_token=user_table.c.fencing_token + 1,
+    )
+    .returning(*CHANGED)
+    .execution_options(statement_name='job_lock_users')
+)
+RELEASE_USERS = (
+    update(user_table)
+    .where(_in_chunk)
+    .values(locktime=None)
+    .returning(*CHANGED)
+    .execution_options(statement_name='job_release_users')
+)
+# The free users of a chunk, counted against the project's quota
+# before a lock job locks them.
+FREE_USERS = (
+    select(user_table.c.id)
+    .where(_in_chunk, models.User.is_free(bindparam('now')))
+    .order_by(user_table.c.id)
+    .execution_options(statement_name='job_free_users')
+)
+
+
+def _delete_users(*conditions):
+    '''Deletes the users, leaving a tombstone for the change feed.'''
+    deleted = (
+        delete(user_table)
+        .where(_in_chunk, *conditions)
+        .returning(*CHANGED)
+        .cte('deleted')
+    )
+    return select(deleted).add_cte(
+        insert(tombstone_table)
+        .from_select(
+            ['id', 'project_id'], select(deleted.c.id, deleted.c.project_id)
+        )
+        .cte('tombstones')
+    )
+
+
+# Locked users are left alone.
+PURGE_USERS = _delete_users(
+    models.User.is_free(bindparam('now'))
+).execution_options(statement_name='job_purge_users')
+# Users of an import chunk run again whose login went to another user.
+UNDO_IMPORTED_USERS = _delete_users().execution_options(
+    statement_name='job_undo_imported_users'
+)
+GET_CHUNK = (
+    select(chunk_table.c.results)
+    .where(
+        chunk_table.c.job_id == bindparam('job_id'),
+        chunk_table.c.start == bindparam('start'),
+    )
+    .execution_options(statement_name='get_job_chunk')
+)
+_chunk = insert(chunk_table).values(
+    job_id=bindparam('job_id'),
+    start=bindparam('start'),
+    results=bindparam('results'),
+)
+STORE_CHUNK = _chunk.on_conflict_do_update(
+    index_elements=[chunk_table.c.job_id],
+    set_={'start': _chunk.excluded.start, 'results': _chunk.excluded.results},
+).execution_options(statement_name='store_job_chunk')
+
+job_items = registry.register(
+    Counter(
+        'job_items',
+        'Items handled by background jobs.',
+        labels=('kind', 'result'),
+    )
+)
+
+
+class Chunk(NamedTuple):
+    '''What one chunk transaction of a job did.'''
+
+    cursor: int
+    processed: int
+    # The users created or changed, as returned rows.
+    rows: list
+    errors: list[dict]
+    done: bool
+
+
+class ChangedUser(NamedTuple):
+    '''A changed user (the CHANGED columns) recorded in job_chunk.'''
+
+    id: int
+    login: str
+    project_id: int
+    env: str
+    domain: str
+    locktime: Union[datetime, None]
+
+    @classmethod
+    def load(cls, data: dict) -> 'ChangedUser':
+        locktime = data['locktime']
+        if locktime is not None:
+            locktime = datetime.fromisoformat(locktime)
+        return cls(**{**data, 'locktime': locktime})
+
+
+def _dump(row) -> dict:
+    data = row._asdict()
+    if data['locktime'] is not None:
+        data['locktime'] = data['locktime'].isoformat()
+    return data
+
+
+def _error(item: int, error: str) -> dict:
+    return {'item': item, 'error': error}
+
+
+async def _stored_chunk(
+    shards: AsyncSession, job: models.Job, start: int, shard_id: str
+) -> Union[dict, None]:
+    '''
+    The results the job's chunk from start recorded on the shard, None
+    if it did not (or the user table is not sharded).
+    '''
+    if not get_shards():
+        return None
+    return await shards.scalar(
+        GET_CHUNK,
+        {'job_id': job.id, 'start': start},
+        bind_arguments={'shard_id': shard_id},
+    )
+
+
+async def _store_chunk(
+    shards: AsyncSession,
+    job: models.Job,
+    start: int,
+    shard_id: str,
+    results: dict,
+) -> None:
+    '''Records the results of the chunk on the shard, when sharded.'''
+    if get_shards():
+        await shards.execute(
+            STORE_CHUNK,
+            {'job_id': job.id, 'start': start, 'results': results},
+            bind_arguments={'shard_id': shard_id},
+        )
+
+
+def _is_free(job: models.Job, row) -> bool:
+    return job.kind != 'purge' and row.locktime is None
+
+
+def _refused(reason: quotas.Refusal) -> str:
+    return f'project quota exceeded: {reason}'
+
+
+async def _admit_locked(
+    session: AsyncSession, items: dict[int, dict]
+) -> dict[int, str]:
+    '''
+    Checks the quotas of the projects of users imported locked, items
+    by position. Returns the errors of the items refused, by position,
+    the last ones of their project.
+    '''
+    locked = defaultdict(list)
+    for position, item in items.items():
+        if item['locktime'] is not None:
+            locked[item['project_id']].append(position)
+    refused = {}
+    for project_id, positions in sorted(locked.items()):
+        admitted, reason = await quotas.admit_locks(
+            session, project_id, len(positions)
+        )
+        for position in positions[admitted:]:
+            refused[position] = _refused(reason)
+    return refused
+
+
+async def _register_logins(
+    session: AsyncSession, items: list[dict]
+) -> set[str]:
+    '''
+    Registers the logins in user_login when the user table is sharded.
+    Returns the logins registered, not those taken on any shard.
+    '''
+    if not get_shards():
+        return {item['login'] for item in items}
+    if not items:
+        return set()
+    result = await session.scalars(
+        insert(login_table)
+        .values(
+            [
+                {'login': item['login'], 'project_id': item['project_id']}
+                for item in items
+            ]
+        )
+        .on_conflict_do_nothing()
+        .returning(login_table.c.login),
+        bind_arguments={'shard_id': HOME},
+    )
+    return set(result)
+
+
+async def _import_chunk(
+    session: AsyncSession, shards: AsyncSession, job: models.Job, size: int
+) -> Chunk:
+    '''
+    Inserts the next users, skipping the logins that already exist on
+    any shard (per-item errors) instead of failing the whole chunk.
+
+    Run again, the chunk takes the results a shard recorded for it
+    instead of inserting its users there twice; those whose login was
+    registered for another user in between are deleted.
+    '''
+    users = job.params['users']
+    if job.total is None:
+        job.total = len(users)
+    start = job.cursor or 0
+    items = dict(enumerate(users[start : start + size], start))
+    by_shard = defaultdict(list)
+    for position, item in items.items():
+        by_shard[shard_for_project(item['project_id'])].append(position)
+    # The created user or the error of each item, by position.
+    results, fresh = {}, {}
+    for shard_id, positions in by_shard.items():
+        stored = await _stored_chunk(shards, job, start, shard_id)
+        if stored is None:
+            fresh.update((position, items[position]) for position in positions)
+            continue
+        for position, result in stored.items():
+            if not isinstance(result, str):
+                result = ChangedUser.load(result)
+            results[int(position)] = result
+    results.update(await _admit_locked(shards, fresh))
+    # The first of several equal logins wins.
+    first = {}
+    for position, item in items.items():
+        if not isinstance(results.get(position), str):
+            first.setdefault(item['login'], position)
+    registered = await _register_logins(
+        session, [items[position] for position in first.values()]
+    )
+    for position, result in list(results.items()):
+        login = items[position]['login']
+        if isinstance(result, str) or (
+            first[login] == position and login in registered
+        ):
+            continue
+        await shards.execute(
+            UNDO_IMPORTED_USERS,
+            {'ids': [result.id]},
+            bind_arguments={
+                'shard_id': shard_for_project(items[position]['project_id'])
+            },
+        )
+        del results[position]
+    now = datetime.now()
+    rows_by_shard = defaultdict(list)
+    for login, position in first.items():
+        if login not in registered or position in results:
+            continue
+        row = {**items[position], 'created_at': now}
+        if row['locktime'] is not None:
+            row['locktime'] = datetime.fromisoformat(row['locktime'])
+        rows_by_shard[shard_for_project(row['project_id'])].append(row)
+    for shard_id, rows in rows_by_shard.items():
+        result = await shards.execute(
+            insert(user_table)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=[user_table.c.login])
+            .returning(*CHANGED),
+            bind_arguments={'shard_id': shard_id},
+        )
+        results.update((first[row.login], row) for row in result)
+    for position in items:
+        results.setdefault(position, 'login already exists')
+    for shard_id, positions in by_shard.items():
+        await _store_chunk(
+            shards,
+            job,
+            start,
+            shard_id,
+            {
+                str(position): (
+                    results[position]
+                    if isinstance(results[position], str)
+                    else _dump(results[position])
+                )
+                for position in positions
+            },
+        )
+    rows, errors = [], []
+    for position, result in sorted(results.items()):
+        if isinstance(result, str):
+            errors.append(_error(position, result))
+        else:
+            rows.append(result)
+    cursor = start + len(items)
+    return Chunk(cursor, len(items), rows, errors, cursor >= len(users))
+
+
+def _target_conditions(params: dict) -> list:
+    conditions = [user_table.c.project_id == params['project_id']]
+    if params.get('env') is not None:
+        conditions.append(user_table.c.env == params['env'])
+    if params.get('domain') is not None:
+        conditions.append(user_table.c.domain == params['domain'])
+    return conditions
+
+
+async def _next_targets(
+    session: AsyncSession, job: models.Job, size: int, shard: dict
+) -> tuple[list[int], list[int]]:
+    '''
+    The ids of the next chunk of targets, in id order: the requested
+    ones and those that exist, which differ when explicit ids are given.
+    '''
+    conditions = _target_conditions(job.params)
+    cursor = job.cursor or 0
+    ids = job.params.get('ids')
+    if ids is None:
+        if job.total is None:
+            job.total = await session.scalar(
+                select(func.count())
+                .select_from(user_table)
+                .where(*conditions),
+                bind_arguments=shard,
+            )
+        found = list(
+            await session.scalars(
+                select(user_table.c.id)
+                .where(*conditions, user_table.c.id > cursor)
+                .order_by(user_table.c.id)
+                .limit(size),
+                bind_arguments=shard,
+            )
+        )
+        return found, found
+    ids = sorted(set(ids))
+    if job.total is None:
+        job.total = len(ids)
+    requested = [id for id in ids if id > cursor][:size]
+    found = await session.scalars(
+        select(user_table.c.id).where(
+            *conditions, user_table.c.id.in_(requested)
+        ),
+        bind_arguments=shard,
+    )
+    return requested, sorted(found)
+
+
+async def _admit_lock_targets(
+    session: AsyncSession,
+    job: models.Job,
+    found: list[int],
+    now: datetime,
+    shard: dict,
+) -> tuple[list[int], dict[int, str]]:
+    '''
+    The users a lock job may lock under its project's quota, and the
+    errors of the free users refused, the last ones in id order.
+    '''
+    if not quotas.enabled():
+        return found, {}
+    free = list(
+        await session.scalars(
+            FREE_USERS, {'ids': found, 'now': now}, bind_arguments=shard
+        )
+    )
+    admitted, reason = await quotas.admit_locks(
+        session, job.params['project_id'], len(free)
+    )
+    return free[:admitted], {id: _refused(reason) for id in free[admitted:]}
+
+
+async def _change_targets(
+    session: AsyncSession, job: models.Job, size: int, shard: dict
+) -> Chunk:
+    '''
+    Locks, releases or purges the next targets; users gone or not
+    matching the targets, locked users for lock and purge and users the
+    project's quota does not let a lock job lock are per-item errors.
+    '''
+    requested, found = await _next_targets(session, job, size, shard)
+    errors = [
+        _error(id, 'not found') for id in sorted(set(requested) - set(found))
+    ]
+    rows, refused = [], {}
+    if found:
+        now = datetime.now()
+        if job.kind == 'lock':
+            targets, refused = await _admit_lock_targets(
+                session, job, found, now, shard
+            )
+            result = await session.execute(
+                LOCK_USERS,
+                {
+                    'ids': targets,
+                    'now': now,
+                    'new_locktime': datetime.fromisoformat(
+                        job.params['locktime']
+                    ),
+                },
+                bind_arguments=shard,
+            )
+        elif job.kind == 'release':
+            result = await session.execute(
+                RELEASE_USERS, {'ids': found}, bind_arguments=shard
+            )
+        else:
+            result = await session.execute(
+                PURGE_USERS, {'ids': found, 'now': now}, bind_arguments=shard
+            )
+        rows = sorted(result, key=lambda row: row.id)
+        changed = {row.id for row in rows}
+        errors.extend(
+            _error(id, refused.get(id, 'locked'))
+            for id in found
+            if id not in changed
+        )
+    cursor = requested[-1] if requested else job.cursor or 0
+    return Chunk(cursor, len(requested), rows, errors, len(requested) < size)
+
+
+async def _targets_chunk(
+    session: AsyncSession, shards: AsyncSession, job: models.Job, size: int
+) -> Chunk:
+    '''
+    Changes the next targets (see _change_targets), or takes the
+    results the shard recorded for the chunk when it is run again.
+    '''
+    shard_id = shard_for_project(job.params['project_id'])
+    start = job.cursor or 0
+    stored = await _stored_chunk(shards, job, start, shard_id)
+    if stored is None:
+        chunk = await _change_targets(
+            shards, job, size, {'shard_id': shard_id}
+        )
+        await _store_chunk(
+            shards,
+            job,
+            start,
+            shard_id,
+            {
+                **chunk._asdict(),
+                'rows': [_dump(row) for row in chunk.rows],
+                'total': job.total,
+            },
+        )
+    else:
+        job.total = stored.pop('total')
+        stored['rows'] = [ChangedUser.load(row) for row in stored['rows']]
+        chunk = Chunk(**stored)
+    if job.kind == 'purge' and chunk.rows and get_shards():
+        # Frees the logins of the purged users.
+        await session.execute(
+            delete(login_table).where(
+                login_table.c.login.in_([row.login for row in chunk.rows])
+            ),
+            bind_arguments={'shard_id': HOME},
+        )
+    return chunk
+
+
+RunChunk = Callable[
+    [AsyncSession, AsyncSession, models.Job, int], Awaitable[Chunk]
+]
+CHUNKS: dict[str, RunChunk] = {
+    'import': _import_chunk,
+    'lock': _targets_chunk,
+    'release': _targets_chunk,
+    'purge': _targets_chunk,
+}
+
+
+class JobRunner:
+    '''
+    Runs the queued jobs of the job table with JOB_WORKERS tasks.
+
+    A job is taken with FOR UPDATE SKIP LOCKED, so workers of every
+    replica share the queue, and held with a lease renewed by every
+    chunk. Each chunk of JOB_CHUNK_SIZE items commits together with the
+    job's progress (when sharded, just after its users, see
+    models.JobChunk), so a job resumes where it stopped when its worker
+    dies (once the lease runs out) or shuts down (right away). A job
+    taken up more than JOB_MAX_ATTEMPTS times, shutdowns aside, is
+    marked failed.
+    '''
+
+    def __init__(self) -> None:
+        # Session factory of the jobs, the app's one if None.
+        self.session_factory = None
+        self._tasks = []
+        self._wakeup = None
+        self._stopping = False
+
+    def start(self, workers: int) -> None:
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._work()) for _ in range(workers)
+        ]
+
+    def wake(self) -> None:
+        '''Has an idle task of this worker look for jobs now.'''
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        '''
+        Lets the running chunks commit and puts their jobs back in the
+        queue for another worker.
+        '''
+        self._stopping = True
+        self.wake()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self) -> None:
+        while not self._stopping:
+            try:
+                ran = await self.run_once()
+            except Exception:
+                logger.exception('failed to take a job, will retry')
+                ran = False
+            if ran or self._stopping:
+                continue
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), get_settings().job_poll_seconds
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _session_factory(self):
+        return self.session_factory or get_sessionmaker()
+
+    def _shards(self, session: AsyncSession):
+        '''
+        The session of a chunk's user writes: a session of their own
+        when the user table is sharded, committed before the chunk's
+        progress (see models.JobChunk), the chunk's session otherwise.
+        '''
+        if not get_shards():
+            return contextlib.nullcontext(session)
+        return self._session_factory()()
+
+    async def run_once(self) -> bool:
+        '''
+        Takes the next job due and runs it until it ends or the runner
+        stops. Returns False when no job was due.
+        '''
+        settings = get_settings()
+        now = datetime.now()
+        async with self._session_factory()() as session:
+            job = (
+                await session.execute(
+                    CLAIM_JOB,
+                    {
+                        'now': now,
+                        'new_lease_until': now
+                        + timedelta(seconds=settings.job_lease_seconds),
+                    },
+                )
+            ).scalar_one_or_none()
+            await session.commit()
+        if job is None:
+            return False
+        if job.attempt > settings.job_max_attempts:
+            error = f'gave up after {settings.job_max_attempts} attempts'
+            if job.error:
+                error = f'{error}: {job.error}'
+            await self._set_status(job, 'failed', error=error)
+            return True
+        try:
+            await self._run(job)
+        except Exception as exc:
+            logger.exception('job %d failed, will retry', job.id)
+            retry = settings.job_poll_seconds * 2**job.attempt
+            await self._set_status(
+                job,
+                'queued',
+                error=repr(exc),
+                lease_until=datetime.now() + timedelta(seconds=retry),
+            )
+        return True
+
+    async def _set_status(
+        self,
+        job: models.Job,
+        status: str,
+        error: Union[str, None] = None,
+        lease_until: Union[datetime, None] = None,
+    ) -> None:
+        async with self._session_factory()() as session:
+            await session.execute(
+                SET_JOB_STATUS,
+                {
+                    'job_id': job.id,
+                    'held_attempt': job.attempt,
+                    'new_status': status,
+                    'new_error': error,
+                    'new_lease_until': lease_until,
+                    'new_finished_at': (
+                        datetime.now() if status in FINISHED else None
+                    ),
+                },
+            )
+            await session.commit()
+
+    async def _run(self, job: models.Job) -> None:
+        settings = get_settings()
+        run_chunk = CHUNKS[job.kind]
+        while True:
+            if self._stopping:
+                async with self._session_factory()() as session:
+                    await session.execute(
+                        RELEASE_JOB,
+                        {'job_id': job.id, 'held_attempt': job.attempt},
+                    )
+                    await session.commit()
+                return
+            async with self._session_factory()() as session:
+                async with self._shards(session) as shards:
+                    chunk = await run_chunk(
+                        session, shards, job, settings.job_chunk_size
+                    )
+                    await availability_index.notify_many(
+                        session,
+                        [(row, _is_free(job, row)) for row in chunk.rows],
+                    )
+                    room = max(0, settings.job_max_errors - job.failed)
+                    now = datetime.now()
+                    result = await session.execute(
+                        ADVANCE_JOB,
+                        {
+                            'job_id': job.id,
+                            'held_attempt': job.attempt,
+                            'new_total': job.total,
+                            'new_cursor': chunk.cursor,
+                            'new_processed': chunk.processed,
+                            'new_succeeded': len(chunk.rows),
+                            'new_failed': len(chunk.errors),
+                            'new_errors': chunk.errors[:room],
+                            'new_status': 'done' if chunk.done else 'running',
+                            'new_lease_until': now
+                            + timedelta(seconds=settings.job_lease_seconds),
+                            'new_finished_at': now if chunk.done else None,
+                        },
+                    )
+                    if result.rowcount == 0:
+                        # Cancelled, or taken over after the lease ran out.
+                        await shards.rollback()
+                        await session.rollback()
+                        return
+                    # The users first: should the progress fail to commit,
+                    # the chunk run again finds its results in job_chunk.
+                    await shards.commit()
+                    await session.commit()
+            job.cursor = chunk.cursor
+            job.failed += len(chunk.errors)
+            self._changed(job, chunk)
+            if chunk.done:
+                return
+            if settings.job_chunk_pause_seconds:
+                await asyncio.sleep(settings.job_chunk_pause_seconds)
+
+    @staticmethod
+    def _changed(job: models.Job, chunk: Chunk) -> None:
+        '''Updates this worker's index and the lock history.'''
+        event = AUDIT_EVENTS.get(job.kind)
+        for row in chunk.rows:
+            if _is_free(job, row):
+                availability_index.mark_free(bucket_of(row), row.id)
+            else:
+                availability_index.mark_locked(bucket_of(row), row.id)
+            if event is not None:
+                audit_writer.record(event, row, job.admin_login)
+        job_items.inc(job.kind, 'succeeded', amount=len(chunk.rows))
+        job_items.inc(job.kind, 'failed', amount=len(chunk.errors))
+
+
+job_runner = JobRunner()
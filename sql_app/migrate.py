@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import logging
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from config import get_settings
+
+from .database import direct_url
+
+logger = logging.getLogger(__name__)
+
+# Session-level advisory lock held on DB_MIGRATION_URL while migrating.
+MIGRATION_LOCK_ID = 0x4D16
+# lock_not_available: lock_timeout ran out.
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+def database_urls() -> list[str]:
+    '''
+    DB_MIGRATION_URL (or DB_URL) and the DB_SHARD_URLS shards, which all
+    carry the schema.
+    '''
+    shards = (get_settings().db_shard_urls or '').split(',')
+    return [direct_url()] + [url.strip() for url in shards if url.strip()]
+
+
+def _lock_not_available(error: DBAPIError) -> bool:
+    return getattr(error.orig, 'sqlstate', None) == LOCK_NOT_AVAILABLE
+
+
+async def upgrade_database(config_file: str, url: str, revision: str) -> None:
+    '''
+    Upgrades one database, retrying the revision that timed out waiting
+    for a table lock (see MIGRATION_LOCK_TIMEOUT_SECONDS) up to
+    MIGRATION_RETRIES times with a doubling pause.
+    '''
+    settings = get_settings()
+    config = Config(config_file)
+    config.set_main_option('sqlalchemy.url', url.replace('%', '%%'))
+    delay = settings.migration_retry_seconds
+    for attempt in range(settings.migration_retries + 1):
+        try:
+            # Alembic runs its own event loop: keep it off this one.
+            await asyncio.to_thread(command.upgrade, config, revision)
+            return
+        except DBAPIError as error:
+            if (
+                not _lock_not_available(error)
+                or attempt == settings.migration_retries
+            ):
+                raise
+            logger.warning(
+                'migration timed out waiting for a lock, retrying in %.1fs',
+                delay,
+            )
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+async def upgrade(
+    config_file: str = 'alembic.ini', revision: str = 'head'
+) -> None:
+    '''
+    Upgrades DB_MIGRATION_URL (or DB_URL) and every shard, one runner
+    at a time: the others wait for the advisory lock and then find
+    nothing left to do.
+    '''
+    urls = database_urls()
+    engine = create_async_engine(urls[0], poolclass=NullPool)
+    try:
+        async with engine.connect() as conn:
+            locked = await conn.scalar(
+                text('SELECT pg_try_advisory_lock(:id)'),
+                {'id': MIGRATION_LOCK_ID},
+            )
+            if not locked:
+                logger.info('waiting for another migration runner')
+                await conn.execute(
+                    text('SELECT pg_advisory_lock(:id)'),
+                    {'id': MIGRATION_LOCK_ID},
+                )
+            # Nothing else runs on this connection: do not keep a
+            # transaction open for the whole migration.
+            await conn.commit()
+            try:
+                for url in urls:
+                    await upgrade_database(config_file, url, revision)
+            finally:
+                await conn.execute(
+                    text('SELECT pg_advisory_unlock(:id)'),
+                    {'id': MIGRATION_LOCK_ID},
+                )
+                await conn.commit()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Runs the migrations of DB_MIGRATION_URL (or DB_URL) '
+        'and its shards, one runner at a time.'
+    )
+    parser.add_argument('--config', default='alembic.ini')
+    parser.add_argument('--revision', default='head')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(upgrade(args.config, args.revision))
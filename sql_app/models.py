@@ -1,6 +1,17 @@
 import datetime
 
-from sqlalchemy import TIMESTAMP, Column, Integer, LargeBinary, String
+from sqlalchemy import (
+    TIMESTAMP,
+    BigInteger,
+    Column,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    func,
+    or_,
+)
+from sqlalchemy.dialects.postgresql import JSONB
 
 from .database import Base
 
@@ -9,10 +20,19 @@ class User(Base):
     '''
     SQLAlchemy table for users.
 
-    'created_at' field is set upon creation.
+    'created_at' field is set upon creation, 'updated_at' on creation
+    and on every update (by the database clock, used by the change feed).
+    'locktime' is the end of the current lease, 'fencing_token' grows by
+    one on every acquire or claim.
     '''
 
     __tablename__ = 'user'
+    __table_args__ = (
+        Index('ix_user_updated_at_id', 'updated_at', 'id'),
+        # Active lock counts of the claim quotas (see sql_app.quotas).
+        Index('ix_user_project_id_locktime', 'project_id', 'locktime'),
+        Index('ix_user_locktime', 'locktime'),
+    )
 
     id = Column(Integer, primary_key=True)
     created_at = Column(TIMESTAMP, default=datetime.datetime.now)
@@ -22,6 +42,51 @@ class User(Base):
     env = Column(String)
     domain = Column(String)
     locktime = Column(TIMESTAMP)
+    updated_at = Column(
+        TIMESTAMP,
+        nullable=False,
+        server_default=func.clock_timestamp(),
+        onupdate=func.clock_timestamp(),
+    )
+    fencing_token = Column(BigInteger, nullable=False, server_default='0')
+
+    @classmethod
+    def is_free(cls, now: datetime.datetime):
+        '''SQL condition: never locked, released or the lease ran out.'''
+        return or_(cls.locktime.is_(None), cls.locktime <= now)
+
+
+class UserTombstone(Base):
+    '''
+    SQLAlchemy table for users purged by a job, so the change feed can
+    tell mirrors they are gone. 'deleted_at' is on the 'updated_at'
+    timeline (the database clock).
+    '''
+
+    __tablename__ = 'user_tombstone'
+    __table_args__ = (
+        Index('ix_user_tombstone_deleted_at_id', 'deleted_at', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    project_id = Column(Integer)
+    deleted_at = Column(
+        TIMESTAMP, nullable=False, server_default=func.clock_timestamp()
+    )
+
+
+class UserLogin(Base):
+    '''
+    SQLAlchemy table registering every user login, in the home database,
+    when the user table is sharded: user.login is only unique within a
+    shard, this primary key across all of them. 'project_id' names the
+    shard of the user.
+    '''
+
+    __tablename__ = 'user_login'
+
+    login = Column(String, primary_key=True)
+    project_id = Column(Integer, nullable=False)
 
 
 class Admin(Base):
@@ -34,3 +99,125 @@ class Admin(Base):
     id = Column(Integer, primary_key=True)
     login = Column(String, unique=True)
     password = Column(LargeBinary)
+
+
+class ProjectQuota(Base):
+    '''
+    SQLAlchemy table for the claim quotas of projects.
+
+    'max_locks' caps the bots of the project locked at once (null: no
+    cap), 'priority' weighs its fair share of CLAIM_CAPACITY.
+    'last_refused_at' is the last claim refused to the project, which
+    keeps its share reserved for FAIR_SHARE_WINDOW_SECONDS. Projects
+    without a row have the defaults.
+    '''
+
+    __tablename__ = 'project_quota'
+
+    project_id = Column(Integer, primary_key=True, autoincrement=False)
+    max_locks = Column(Integer)
+    priority = Column(String, nullable=False, server_default='normal')
+    last_refused_at = Column(TIMESTAMP)
+
+
+class Job(Base):
+    '''
+    SQLAlchemy table for background bulk jobs (see sql_app.jobs).
+
+    'kind' is 'import', 'lock', 'release' or 'purge', 'params' the
+    request body. 'status' goes from 'queued' to 'running' and ends as
+    'done', 'failed' or 'cancelled'. 'cursor' is how far the job got
+    (an index into the imported users, else the last user id handled),
+    'errors' the first per-item errors. 'attempt' grows every time a
+    worker takes the job, which holds it until 'lease_until'.
+    '''
+
+    __tablename__ = 'job'
+    __table_args__ = (
+        Index('ix_job_status_lease_until', 'status', 'lease_until'),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, server_default='queued')
+    params = Column(JSONB, nullable=False)
+    admin_login = Column(String)
+    total = Column(Integer)
+    cursor = Column(BigInteger)
+    processed = Column(Integer, nullable=False, server_default='0')
+    succeeded = Column(Integer, nullable=False, server_default='0')
+    failed = Column(Integer, nullable=False, server_default='0')
+    errors = Column(JSONB, nullable=False, server_default='[]')
+    error = Column(String)
+    attempt = Column(Integer, nullable=False, server_default='0')
+    lease_until = Column(TIMESTAMP)
+    created_at = Column(TIMESTAMP, default=datetime.datetime.now)
+    started_at = Column(TIMESTAMP)
+    finished_at = Column(TIMESTAMP)
+
+
+class JobChunk(Base):
+    '''
+    SQLAlchemy table for the last chunk of a job on each shard, when
+    the user table is sharded (in the shard databases, by job_id).
+
+    A chunk commits its user writes on the shards before its progress
+    on the home database; run again after a failure in between, it
+    finds them here, by 'start' (the job cursor it started from), and
+    reports 'results' instead of redoing them.
+    '''
+
+    __tablename__ = 'job_chunk'
+
+    job_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    start = Column(BigInteger, nullable=False)
+    results = Column(JSONB, nullable=False)
+
+
+class IdempotencyKey(Base):
+    '''
+    SQLAlchemy table for responses of requests sent with an
+    Idempotency-Key header.
+
+    'status' stays null while the original request is in flight, which
+    it is taken to be until 'reserved_until'.
+    '''
+
+    __tablename__ = 'idempotency_key'
+
+    key = Column(String(64), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    status = Column(Integer)
+    content_type = Column(String)
+    body = Column(LargeBinary)
+    created_at = Column(TIMESTAMP, default=datetime.datetime.now, index=True)
+    reserved_until = Column(TIMESTAMP)
+
+
+class LockEvent(Base):
+    '''
+    SQLAlchemy table for the append-only history of lock events.
+
+    'event' is one of 'acquire', 'claim' or 'release'; 'created_at' is
+    the time of the event, not of the (batched) insert.
+
+    The table is range partitioned by 'created_at' (see
+    sql_app.partitions); there is no default partition, so that expired
+    ones can be detached concurrently.
+    '''
+
+    __tablename__ = 'lock_event'
+    __table_args__ = (
+        Index('ix_lock_event_user_id_created_at', 'user_id', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    created_at = Column(
+        TIMESTAMP, primary_key=True, nullable=False, index=True
+    )
+    user_id = Column(Integer, nullable=False)
+    project_id = Column(Integer)
+    event = Column(String, nullable=False)
+    locktime = Column(TIMESTAMP)
+    admin_login = Column(String)
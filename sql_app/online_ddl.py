@@ -0,0 +1,268 @@
+'''
+Schema change helpers for migrations of large, busy tables.
+
+Conventions for revisions touching the user table (or any large one):
+
+- Build indexes with create_index_concurrently, never op.create_index.
+- Add unique constraints with add_unique_constraint, which builds the
+  index concurrently first.
+- Add foreign keys and check constraints NOT VALID, then validate them
+  with validate_constraint, which does not block writes.
+- Make columns NOT NULL with set_not_null.
+- Add columns nullable or with a constant default. Volatile defaults
+  and type changes rewrite the table.
+- Fill new columns with backfill, in small committed batches, after the
+  app already writes them for new rows.
+- Create tables and add columns with create_table and add_column, in
+  revisions that also use the helpers above.
+
+Each helper runs the slow part outside the migration's transaction, so
+it holds no lock that the lock traffic would queue behind. That commits
+the revision's earlier steps: a revision failing halfway stays half
+applied, and only alembic_version tells it is not done. DDL waits at
+most MIGRATION_LOCK_TIMEOUT_SECONDS for a table lock (see
+migrations/env.py) and the runner then runs the revision again, so
+every helper skips what is already in place.
+'''
+
+import logging
+import time
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def _quote(name: str) -> str:
+    return op.get_context().dialect.identifier_preparer.quote(name)
+
+
+def _exists(query: str, **params) -> bool:
+    return bool(op.get_bind().execute(sa.text(query), params).scalar())
+
+
+def _table_exists(table: str) -> bool:
+    return _exists(
+        'SELECT to_regclass(:table) IS NOT NULL', table=_quote(table)
+    )
+
+
+def _column_exists(table: str, column: str) -> bool:
+    return _exists(
+        'SELECT count(*) FROM pg_attribute '
+        'WHERE attrelid = to_regclass(:table) AND attname = :column '
+        'AND NOT attisdropped',
+        table=_quote(table),
+        column=column,
+    )
+
+
+def _column_not_null(table: str, column: str) -> bool:
+    return _exists(
+        'SELECT attnotnull FROM pg_attribute '
+        'WHERE attrelid = to_regclass(:table) AND attname = :column',
+        table=_quote(table),
+        column=column,
+    )
+
+
+def _constraint_exists(name: str, table: str) -> bool:
+    return _exists(
+        'SELECT count(*) FROM pg_constraint '
+        'WHERE conrelid = to_regclass(:table) AND conname = :name',
+        table=_quote(table),
+        name=name,
+    )
+
+
+def create_table(name: str, *columns, **kw) -> None:
+    '''op.create_table, skipped when the table exists.'''
+    if not _table_exists(name):
+        op.create_table(name, *columns, **kw)
+
+
+def add_column(table: str, column: sa.Column) -> None:
+    '''op.add_column, skipped when the column exists.'''
+    if not _column_exists(table, column.name):
+        op.add_column(table, column)
+
+
+def _drop_invalid_index(name: str) -> None:
+    '''
+    Drops what a failed CREATE INDEX CONCURRENTLY left behind: an
+    invalid index that is still maintained on every write.
+    '''
+    invalid = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                'SELECT NOT indisvalid FROM pg_index '
+                'WHERE indexrelid = to_regclass(:name)'
+            ),
+            {'name': _quote(name)},
+        )
+        .scalar()
+    )
+    if invalid:
+        logger.warning('dropping invalid index %s', name)
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {_quote(name)}')
+
+
+def create_index_concurrently(
+    name: str, table: str, columns: list, unique: bool = False, **kw
+) -> None:
+    '''
+    op.create_index without blocking writes to the table. Safe to run
+    again after a failure.
+    '''
+    with op.get_context().autocommit_block():
+        _drop_invalid_index(name)
+        op.create_index(
+            name,
+            table,
+            columns,
+            unique=unique,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+            **kw,
+        )
+
+
+def drop_index_concurrently(name: str, table: str) -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            name,
+            table_name=table,
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def add_unique_constraint(name: str, table: str, columns: list) -> None:
+    '''
+    op.create_unique_constraint with the index built concurrently; the
+    constraint then takes it over in a catalog-only change.
+    '''
+    if _constraint_exists(name, table):
+        return
+    create_index_concurrently(name, table, columns, unique=True)
+    op.execute(
+        f'ALTER TABLE {_quote(table)} ADD CONSTRAINT {_quote(name)} '
+        f'UNIQUE USING INDEX {_quote(name)}'
+    )
+
+
+def add_check_constraint_not_valid(
+    name: str, table: str, condition: str
+) -> None:
+    '''
+    Adds a check constraint enforced on new writes only, without scanning
+    the table; validate_constraint checks the existing rows.
+    '''
+    if _constraint_exists(name, table):
+        return
+    op.create_check_constraint(
+        name, table, sa.text(condition), postgresql_not_valid=True
+    )
+
+
+def add_foreign_key_not_valid(
+    name: str,
+    source: str,
+    referent: str,
+    local_columns: list,
+    remote_columns: list,
+    **kw,
+) -> None:
+    '''The foreign key counterpart of add_check_constraint_not_valid.'''
+    if _constraint_exists(name, source):
+        return
+    op.create_foreign_key(
+        name,
+        source,
+        referent,
+        local_columns,
+        remote_columns,
+        postgresql_not_valid=True,
+        **kw,
+    )
+
+
+def validate_constraint(name: str, table: str) -> None:
+    '''
+    Checks the existing rows against a NOT VALID constraint. Reads and
+    writes go on meanwhile, as long as the scan takes.
+    '''
+    with op.get_context().autocommit_block():
+        op.execute(
+            f'ALTER TABLE {_quote(table)} VALIDATE CONSTRAINT {_quote(name)}'
+        )
+
+
+def set_not_null(table: str, column: str) -> None:
+    '''
+    ALTER COLUMN SET NOT NULL without holding the table lock for a full
+    scan: a validated IS NOT NULL check lets Postgres skip it.
+    '''
+    check = f'{table}_{column}_not_null'
+    if not _column_not_null(table, column):
+        add_check_constraint_not_valid(
+            check, table, f'{_quote(column)} IS NOT NULL'
+        )
+        validate_constraint(check, table)
+        op.alter_column(table, column, nullable=False)
+    op.execute(
+        f'ALTER TABLE {_quote(table)} '
+        f'DROP CONSTRAINT IF EXISTS {_quote(check)}'
+    )
+
+
+def backfill(
+    table: str,
+    assignments: str,
+    where: str = 'true',
+    key: str = 'id',
+    batch_size: Union[int, None] = None,
+    pause_seconds: Union[float, None] = None,
+) -> int:
+    '''
+    UPDATE table SET assignments WHERE where, in batches of batch_size
+    rows (MIGRATION_BACKFILL_BATCH_SIZE) walked in the order of the
+    positive integer key, each committed on its own and followed by a
+    pause of MIGRATION_BACKFILL_PAUSE_SECONDS for the replicas and the
+    lock traffic to keep up.
+
+    Returns the number of rows updated.
+    '''
+    settings = get_settings()
+    if batch_size is None:
+        batch_size = settings.migration_backfill_batch_size
+    if pause_seconds is None:
+        pause_seconds = settings.migration_backfill_pause_seconds
+    table, key = _quote(table), _quote(key)
+    statement = sa.text(
+        f'UPDATE {table} SET {assignments} WHERE {key} IN ('
+        f'SELECT {key} FROM {table} WHERE {key} > :after AND ({where}) '
+        f'ORDER BY {key} LIMIT :batch_size) RETURNING {key}'
+    )
+    updated, after = 0, 0
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            keys = (
+                bind.execute(
+                    statement, {'after': after, 'batch_size': batch_size}
+                )
+                .scalars()
+                .all()
+            )
+            if not keys:
+                return updated
+            updated += len(keys)
+            after = max(keys)
+            logger.info('backfilled %d rows of %s', updated, table)
+            time.sleep(pause_seconds)
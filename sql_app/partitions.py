@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Literal
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import (
+    AsyncConnection,
+    AsyncEngine,
+    create_async_engine,
+)
+from sqlalchemy.pool import NullPool
+
+from config import get_settings
+
+from .database import direct_url, get_engine
+
+logger = logging.getLogger(__name__)
+
+Granularity = Literal['day', 'week']
+
+PARENT = 'lock_event'
+# Serializes maintenance between workers and replicas.
+MAINTENANCE_LOCK_ID = 0x10C4E7
+BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def period_start(moment: datetime, granularity: Granularity) -> datetime:
+    '''Start of the day (or of the ISO week) containing the moment.'''
+    start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def period_length(granularity: Granularity) -> timedelta:
+    return timedelta(days=7 if granularity == 'week' else 1)
+
+
+def partition_ranges(
+    since: datetime, until: datetime, granularity: Granularity
+) -> list[tuple[str, datetime, datetime]]:
+    '''
+    Partitions needed to cover [since, until].
+
+    Returns a list of (name, start, end); names are lock_event_pYYYYMMDD
+    after the first day of the period.
+    '''
+    step = period_length(granularity)
+    start = period_start(since, granularity)
+    ranges = []
+    while start <= until:
+        ranges.append((f'{PARENT}_p{start:%Y%m%d}', start, start + step))
+        start += step
+    return ranges
+
+
+def create_partition_sql(name: str, start: datetime, end: datetime) -> str:
+    return (
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF {PARENT} '
+        f"FOR VALUES FROM ('{start:%Y-%m-%d %H:%M:%S}') "
+        f"TO ('{end:%Y-%m-%d %H:%M:%S}')"
+    )
+
+
+async def existing_partitions(
+    conn: AsyncConnection,
+) -> dict[str, tuple[datetime, datetime]]:
+    '''Range partitions of lock_event with their bounds.'''
+    rows = await conn.execute(
+        text('''
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+            JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+            WHERE parent.relname = :parent
+            '''),
+        {'parent': PARENT},
+    )
+    partitions = {}
+    for name, bound in rows:
+        match = BOUND_PATTERN.search(bound)
+        if match is not None:
+            partitions[name] = (
+                datetime.fromisoformat(match.group(1)),
+                datetime.fromisoformat(match.group(2)),
+            )
+    return partitions
+
+
+async def detach_pending_partitions(conn: AsyncConnection) -> set[str]:
+    '''Partitions whose concurrent detach was interrupted.'''
+    rows = await conn.scalars(
+        text('''
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+            JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+            WHERE parent.relname = :parent AND pg_inherits.inhdetachpending
+            '''),
+        {'parent': PARENT},
+    )
+    return set(rows)
+
+
+async def _create_missing(
+    conn: AsyncConnection, ranges: list[tuple[str, datetime, datetime]]
+) -> list[str]:
+    '''Creates the ranges not yet covered by a partition.'''
+    existing = (await existing_partitions(conn)).values()
+    created = []
+    for name, start, end in ranges:
+        if any(s < end and start < e for s, e in existing):
+            continue
+        await conn.execute(text(create_partition_sql(name, start, end)))
+        created.append(name)
+    return created
+
+
+async def ensure_partitions(
+    conn: AsyncConnection,
+    now: datetime,
+    granularity: Granularity,
+    ahead: int,
+) -> list[str]:
+    '''
+    Creates the partitions from the current period up to `ahead` periods
+    in the future, skipping ranges already covered by a partition.
+
+    Returns the names of created partitions.
+    '''
+    return await _create_missing(
+        conn,
+        partition_ranges(
+            now, now + period_length(granularity) * ahead, granularity
+        ),
+    )
+
+
+async def cover(
+    conn: AsyncConnection, moments: list[datetime], granularity: Granularity
+) -> list[str]:
+    '''
+    Creates the partitions missing for the moments (e.g. of lock events
+    written while maintenance was behind).
+
+    Returns the names of created partitions.
+    '''
+    ranges = {partition_ranges(m, m, granularity)[0] for m in moments}
+    return await _create_missing(conn, sorted(ranges))
+
+
+def covered(
+    partitions: dict[str, tuple[datetime, datetime]], moment: datetime
+) -> bool:
+    '''Whether one of the partitions (of existing_partitions) has it.'''
+    return any(start <= moment < end for start, end in partitions.values())
+
+
+async def drop_expired_partitions(
+    conn: AsyncConnection, now: datetime, retention: timedelta
+) -> list[str]:
+    '''
+    Drops partitions whose whole range is older than the retention.
+
+    Each is detached with DETACH PARTITION ... CONCURRENTLY, which
+    takes no lock blocking lock event inserts, and the detached table is
+    then dropped. A detach left half done (e.g. by lock_timeout) is
+    finalized. DETACH ... CONCURRENTLY cannot run in a transaction
+    block, so the connection must be in autocommit mode.
+
+    Dropping a partition removes its rows without the dead tuples and
+    vacuum work a DELETE would leave behind.
+    '''
+    pending = await detach_pending_partitions(conn)
+    dropped = []
+    for name, (_, end) in (await existing_partitions(conn)).items():
+        if end > now - retention:
+            continue
+        mode = 'FINALIZE' if name in pending else 'CONCURRENTLY'
+        await conn.execute(
+            text(f'ALTER TABLE {PARENT} DETACH PARTITION "{name}" {mode}')
+        )
+        await conn.execute(text(f'DROP TABLE "{name}"'))
+        dropped.append(name)
+    return dropped
+
+
+async def run_maintenance(
+    now: datetime = None, engine: AsyncEngine = None
+) -> None:
+    '''
+    One maintenance pass with the settings on the engine (the app's by
+    default), in autocommit mode and with PARTITION_LOCK_TIMEOUT_SECONDS
+    as lock_timeout, under a session advisory lock.
+    '''
+    settings = get_settings()
+    now = now or datetime.now()
+    async with (engine or get_engine()).connect() as conn:
+        await conn.execution_options(isolation_level='AUTOCOMMIT')
+        locked = await conn.scalar(
+            text('SELECT pg_try_advisory_lock(:id)'),
+            {'id': MAINTENANCE_LOCK_ID},
+        )
+        if not locked:
+            return
+        try:
+            # Waiting on a long transaction's lock would queue every
+            # lock event insert behind the DDL.
+            lock_timeout = settings.partition_lock_timeout_seconds
+            if lock_timeout:
+                await conn.execute(
+                    text("SELECT set_config('lock_timeout', :timeout, false)"),
+                    {'timeout': f'{int(lock_timeout * 1000)}ms'},
+                )
+            created = await ensure_partitions(
+                conn,
+                now,
+                settings.lock_history_partition,
+                settings.lock_history_partitions_ahead,
+            )
+            dropped = await drop_expired_partitions(
+                conn,
+                now,
+                timedelta(days=settings.lock_history_retention_days),
+            )
+        finally:
+            await conn.execute(text('RESET lock_timeout'))
+            await conn.execute(
+                text('SELECT pg_advisory_unlock(:id)'),
+                {'id': MAINTENANCE_LOCK_ID},
+            )
+    if created or dropped:
+        logger.info(
+            'lock history partitions created: %s, dropped: %s',
+            created,
+            dropped,
+        )
+
+
+async def maintain_forever() -> None:
+    '''
+    Runs maintenance every PARTITION_MAINTENANCE_INTERVAL seconds, from
+    startup on. A pass needs a session of its own, so when DB_URL is
+    PgBouncer it runs on DB_MIGRATION_URL.
+    '''
+    engine = None
+    if get_settings().db_pgbouncer:
+        engine = create_async_engine(direct_url(), poolclass=NullPool)
+    try:
+        while True:
+            try:
+                await run_maintenance(engine=engine)
+            except Exception:
+                logger.exception('lock history partition maintenance failed')
+            await asyncio.sleep(
+                get_settings().partition_maintenance_interval_seconds
+            )
+    finally:
+        if engine is not None:
+            await engine.dispose()
+
+
+async def main() -> None:
+    engine = create_async_engine(direct_url(), poolclass=NullPool)
+    try:
+        await run_maintenance(engine=engine)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
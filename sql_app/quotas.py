@@ -0,0 +1,270 @@
+from datetime import datetime, timedelta
+from typing import Literal, Union
+
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from config import get_settings
+from metrics import Counter, Gauge, registry
+
+from . import models
+from .database import AsyncSession, shard_for_project
+
+Refusal = Literal['max_locks', 'capacity', 'fair_share']
+
+# Weight of a project's share of CLAIM_CAPACITY per priority class.
+PRIORITY_WEIGHTS: dict[str, int] = {'low': 1, 'normal': 2, 'high': 4}
+DEFAULT_PRIORITY = 'normal'
+# Advisory lock keys serializing the admissions of one project:
+# (namespace, project_id) pairs.
+PROJECT_LOCK_NAMESPACE = 0xC1A2
+# Advisory lock key serializing the admissions under CLAIM_CAPACITY of
+# a shard, taken after the project's.
+CAPACITY_LOCK_ID = 0xC1A3
+
+user = models.User
+quota = models.ProjectQuota
+
+LOCK_PROJECT = text('SELECT pg_advisory_xact_lock(:namespace, :project_id)')
+LOCK_CAPACITY = text('SELECT pg_advisory_xact_lock(:id)')
+_quota_columns = (
+    quota.project_id,
+    quota.max_locks,
+    quota.priority,
+    quota.last_refused_at,
+)
+GET_QUOTAS = select(*_quota_columns).execution_options(
+    statement_name='get_quotas'
+)
+GET_PROJECT_QUOTA = (
+    select(*_quota_columns)
+    .where(quota.project_id == bindparam('project_id'))
+    .execution_options(statement_name='get_project_quota')
+)
+COUNT_ACTIVE_LOCKS = (
+    select(user.project_id, func.count())
+    .where(user.locktime > bindparam('now'))
+    .group_by(user.project_id)
+    .execution_options(statement_name='count_active_locks')
+)
+COUNT_PROJECT_LOCKS = (
+    select(func.count())
+    .where(
+        user.project_id == bindparam('project_id'),
+        user.locktime > bindparam('now'),
+    )
+    .execution_options(statement_name='count_project_locks')
+)
+_refusal = insert(quota).values(
+    project_id=bindparam('project_id'), last_refused_at=bindparam('now')
+)
+RECORD_REFUSAL = _refusal.on_conflict_do_update(
+    index_elements=[quota.project_id],
+    set_={'last_refused_at': _refusal.excluded.last_refused_at},
+).execution_options(statement_name='record_refusal')
+
+claim_decisions = registry.register(
+    Counter(
+        'claim_quota_decisions',
+        'Claims admitted or refused by the project quotas.',
+        labels=('project_id', 'result'),
+    )
+)
+active_locks = registry.register(
+    Gauge(
+        'project_active_locks',
+        'Locked bots of the project at its last claim admission.',
+        labels=('project_id',),
+    )
+)
+fair_shares = registry.register(
+    Gauge(
+        'project_fair_share',
+        'Share of CLAIM_CAPACITY of the project at its last claim '
+        'admission.',
+        labels=('project_id',),
+    )
+)
+
+
+class QuotaExceeded(Exception):
+    '''The project may not claim another bot now.'''
+
+    def __init__(self, project_id: int, reason: Refusal) -> None:
+        super().__init__(f'project {project_id}: {reason}')
+        self.project_id = project_id
+        self.reason = reason
+
+
+def weight(project_quota: Union[models.ProjectQuota, None]) -> int:
+    if project_quota is None:
+        return PRIORITY_WEIGHTS[DEFAULT_PRIORITY]
+    return PRIORITY_WEIGHTS[project_quota.priority]
+
+
+def fair_shares_of(
+    capacity: int,
+    project_id: int,
+    active: dict[int, int],
+    quotas: dict[int, models.ProjectQuota],
+    waiting_since: datetime,
+) -> dict[int, float]:
+    '''
+    Splits the capacity between the competing projects in proportion to
+    their weights: the claiming project, those holding locks and those
+    refused a claim since waiting_since.
+    '''
+    competing = {project_id} | {p for p, n in active.items() if n}
+    competing |= {
+        p
+        for p, q in quotas.items()
+        if q.last_refused_at is not None and q.last_refused_at >= waiting_since
+    }
+    weights = {p: weight(quotas.get(p)) for p in competing}
+    total = sum(weights.values())
+    return {p: capacity * w / total for p, w in weights.items()}
+
+
+def refusal(
+    capacity: int,
+    project_id: int,
+    active: dict[int, int],
+    max_locks: Union[int, None],
+    shares: dict[int, float],
+) -> Union[Refusal, None]:
+    '''
+    Why the project may not lock another bot, None if it may.
+
+    Under its max_locks, a project below its fair share may claim while
+    the capacity is not used up; a project at or above it only takes
+    capacity that no other competing project below its share needs.
+    '''
+    locked = active.get(project_id, 0)
+    if max_locks is not None and locked >= max_locks:
+        return 'max_locks'
+    if not capacity:
+        return None
+    used = sum(active.values())
+    if used >= capacity:
+        return 'capacity'
+    if locked < shares[project_id]:
+        return None
+    reserved = sum(
+        max(0.0, share - active.get(p, 0))
+        for p, share in shares.items()
+        if p != project_id
+    )
+    if capacity - used - 1 < reserved:
+        return 'fair_share'
+    return None
+
+
+def enabled() -> bool:
+    return get_settings().claim_quotas
+
+
+async def admit_locks(
+    session: AsyncSession, project_id: int, count: int
+) -> tuple[int, Union[Refusal, None]]:
+    '''
+    Checks the project's quota before it locks count more bots, in the
+    locking transaction, when CLAIM_QUOTAS is on.
+
+    Admissions of the project hold an advisory lock of its own until
+    the transaction ends, so they go one at a time against its up to
+    date lock count, without holding up other projects. Under a
+    CLAIM_CAPACITY admissions also hold the shard's capacity lock and
+    count the locks of every project: the count only scans the locks
+    still held (ix_user_locktime), which the capacity bounds.
+
+    Returns how many of the locks are admitted and, if not all of
+    them, why. A refusal is recorded (uncommitted), which makes the
+    project count as competing for FAIR_SHARE_WINDOW_SECONDS.
+
+    With DB_SHARD_URLS set the admission runs on the project's shard,
+    so CLAIM_CAPACITY is shared by the projects of each shard.
+    '''
+    settings = get_settings()
+    if not settings.claim_quotas or not count:
+        return count, None
+    capacity = settings.claim_capacity
+    now = datetime.now()
+    label = str(project_id)
+    shard_id = shard_for_project(project_id)
+    shard = {'shard_id': shard_id}
+    project_quota = (
+        await session.execute(
+            GET_PROJECT_QUOTA, {'project_id': project_id}, bind_arguments=shard
+        )
+    ).one_or_none()
+    max_locks = project_quota.max_locks if project_quota else None
+    if not capacity and max_locks is None:
+        claim_decisions.inc(label, 'admitted', amount=count)
+        return count, None
+    await session.execute(
+        LOCK_PROJECT,
+        {'namespace': PROJECT_LOCK_NAMESPACE, 'project_id': project_id},
+        bind_arguments=shard,
+    )
+    shares = {}
+    if capacity:
+        await session.execute(
+            LOCK_CAPACITY, {'id': CAPACITY_LOCK_ID}, bind_arguments=shard
+        )
+        quotas = {
+            row.project_id: row
+            for row in await session.execute(GET_QUOTAS, bind_arguments=shard)
+        }
+        active = dict(
+            (
+                await session.execute(
+                    COUNT_ACTIVE_LOCKS, {'now': now}, bind_arguments=shard
+                )
+            ).all()
+        )
+        active.setdefault(project_id, 0)
+        shares = fair_shares_of(
+            capacity,
+            project_id,
+            active,
+            quotas,
+            now - timedelta(seconds=settings.fair_share_window_seconds),
+        )
+        fair_shares.set(label, value=shares[project_id])
+    else:
+        active = {
+            project_id: await session.scalar(
+                COUNT_PROJECT_LOCKS,
+                {'project_id': project_id, 'now': now},
+                bind_arguments=shard,
+            )
+        }
+    active_locks.set(label, value=active[project_id])
+    admitted, reason = 0, None
+    while admitted < count:
+        reason = refusal(capacity, project_id, active, max_locks, shares)
+        if reason is not None:
+            break
+        admitted += 1
+        active[project_id] += 1
+    if admitted:
+        claim_decisions.inc(label, 'admitted', amount=admitted)
+    if reason is not None:
+        claim_decisions.inc(label, reason, amount=count - admitted)
+        await session.execute(
+            RECORD_REFUSAL,
+            {'project_id': project_id, 'now': now},
+            bind_arguments=shard,
+        )
+    return admitted, reason
+
+
+async def admit_claim(session: AsyncSession, project_id: int) -> None:
+    '''
+    admit_locks for a single lock. Raises QuotaExceeded after
+    committing the refusal.
+    '''
+    admitted, reason = await admit_locks(session, project_id, 1)
+    if not admitted:
+        await session.commit()
+        raise QuotaExceeded(project_id, reason)
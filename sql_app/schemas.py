@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Literal, Optional
+from typing import Annotated, Literal, Optional, Union
 
-from pydantic import BaseModel, ConfigDict, FutureDatetime
+from pydantic import BaseModel, ConfigDict, Field, FutureDatetime
 
 
 class UserBase(BaseModel):
@@ -23,6 +23,22 @@ class UserLockTime(BaseModel):
     locktime: Optional[FutureDatetime] = None
 
 
+class UserLeaseRenew(BaseModel):
+    '''Pydantic model for extending a held lease.'''
+
+    fencing_token: int
+    lease_seconds: Optional[float] = Field(default=None, gt=0, le=86400)
+
+
+class UserClaim(BaseModel):
+    '''Pydantic model for claiming any free user of a bucket.'''
+
+    project_id: int
+    env: Literal['prod', 'preprod', 'stage']
+    domain: Literal['canary', 'regular']
+    locktime: FutureDatetime
+
+
 class UserCreate(UserBase):
     '''Pydantic user model for POST method.'''
 
@@ -36,6 +52,132 @@ class User(UserBase):
 
     id: int
     created_at: datetime
+    updated_at: Optional[datetime] = None
+    fencing_token: int = 0
+
+
+class UserChanges(BaseModel):
+    '''Pydantic model of a change feed page.'''
+
+    users: list[User]
+    # Ids of the users purged; apply them after the users.
+    deleted: list[int]
+    cursor: Optional[str]
+    has_more: bool
+
+
+class ProjectUtilisation(BaseModel):
+    '''Pydantic model of per-project lock statistics.'''
+
+    project_id: Optional[int]
+    bots: int
+    locked_bots: int
+    locks: int
+    releases: int
+    locked_seconds: float
+    utilisation: float
+
+
+class ProjectQuota(BaseModel):
+    '''
+    Pydantic model of a project's claim quota: at most max_locks bots
+    locked at once (no cap when null) and the priority class weighing
+    its fair share.
+    '''
+
+    model_config = ConfigDict(from_attributes=True)
+
+    max_locks: Optional[int] = Field(default=None, ge=0)
+    priority: Literal['low', 'normal', 'high'] = 'normal'
+
+
+class ProjectQuotaOut(ProjectQuota):
+    '''Pydantic model of a stored project quota.'''
+
+    project_id: int
+
+
+# Users of one import job.
+JOB_IMPORT_LIMIT = 100_000
+# Explicit user ids of one lock/release/purge job.
+JOB_IDS_LIMIT = 100_000
+
+
+class JobTargets(BaseModel):
+    '''
+    Pydantic model selecting the users of a project a lock, release or
+    purge job works on; every user of the project when nothing else is
+    given.
+    '''
+
+    project_id: int
+    env: Optional[Literal['prod', 'preprod', 'stage']] = None
+    domain: Optional[Literal['canary', 'regular']] = None
+    ids: Optional[list[int]] = Field(
+        default=None, min_length=1, max_length=JOB_IDS_LIMIT
+    )
+
+
+class ImportJob(BaseModel):
+    '''Pydantic model of a job creating users.'''
+
+    kind: Literal['import']
+    users: list[UserCreate] = Field(min_length=1, max_length=JOB_IMPORT_LIMIT)
+
+
+class LockJob(JobTargets):
+    '''Pydantic model of a job locking the free targets until locktime.'''
+
+    kind: Literal['lock']
+    locktime: FutureDatetime
+
+
+class ReleaseJob(JobTargets):
+    '''Pydantic model of a job releasing the targets.'''
+
+    kind: Literal['release']
+
+
+class PurgeJob(JobTargets):
+    '''Pydantic model of a job deleting the free targets.'''
+
+    kind: Literal['purge']
+
+
+JobCreate = Annotated[
+    Union[ImportJob, LockJob, ReleaseJob, PurgeJob],
+    Field(discriminator='kind'),
+]
+
+
+class JobItemError(BaseModel):
+    '''
+    Pydantic model of an item a job could not handle: the index of an
+    imported user, else a user id.
+    '''
+
+    item: int
+    error: str
+
+
+class Job(BaseModel):
+    '''Pydantic model of a background job and its progress.'''
+
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    kind: str
+    status: Literal['queued', 'running', 'done', 'failed', 'cancelled']
+    total: Optional[int]
+    processed: int
+    succeeded: int
+    failed: int
+    errors: list[JobItemError]
+    error: Optional[str]
+    attempt: int
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
 
 
 class AdminUser(BaseModel):
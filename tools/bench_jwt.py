@@ -0,0 +1,90 @@
+import argparse
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Union
+
+from api_security.jwt_backends import BACKENDS
+from api_security.jwt_passwords import VerifiedTokenCache
+
+BENCH_KEY = 'bench-secret-key'
+
+
+def measure(func, number: int) -> float:
+    '''Returns the mean time of one call in microseconds.'''
+    started = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - started) / number * 1e6
+
+
+def bench_backend(name: str, number: int) -> dict[str, float]:
+    '''Times encode, decode and cached decode of one backend.'''
+    backend = BACKENDS[name]()
+    claims = {
+        'sub': 'admin',
+        'exp': datetime.now(timezone.utc) + timedelta(hours=1),
+    }
+    token = backend.encode(claims, BENCH_KEY)
+    cache = VerifiedTokenCache()
+    cache.put(token, BENCH_KEY, backend.decode(token, BENCH_KEY), 1)
+    return {
+        'encode_us': measure(
+            lambda: backend.encode(claims, BENCH_KEY), number
+        ),
+        'decode_us': measure(lambda: backend.decode(token, BENCH_KEY), number),
+        'cached_us': measure(lambda: cache.get(token, BENCH_KEY), number),
+    }
+
+
+def format_report(report: dict[str, dict]) -> str:
+    lines = [
+        f'{"backend":<8} {"encode µs":>10} {"decode µs":>10} '
+        f'{"cached µs":>10}'
+    ]
+    for name, row in report.items():
+        lines.append(
+            f'{name:<8} {row["encode_us"]:>10.2f} {row["decode_us"]:>10.2f} '
+            f'{row["cached_us"]:>10.2f}'
+        )
+    return '\n'.join(lines)
+
+
+def main(argv: Union[list[str], None] = None) -> dict[str, dict]:
+    parser = argparse.ArgumentParser(
+        description='Compare JWT backends and the verified token cache.'
+    )
+    parser.add_argument(
+        '--number',
+        type=int,
+        default=20_000,
+        help='calls per measurement (default: 20000)',
+    )
+    parser.add_argument(
+        '--backend',
+        action='append',
+        choices=sorted(BACKENDS),
+        help='backend to measure, repeatable (default: all available)',
+    )
+    parser.add_argument(
+        '--json', action='store_true', help='print the report as JSON'
+    )
+    args = parser.parse_args(argv)
+
+    report = {}
+    for name in args.backend or BACKENDS:
+        try:
+            report[name] = bench_backend(name, args.number)
+        except RuntimeError as error:
+            if args.backend:
+                raise
+            print(f'skipping {name}: {error}')
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import json
+import time
+from datetime import datetime
+from typing import Callable, Union
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql
+
+from sql_app import crud, models
+
+DIALECT = postgresql.asyncpg.dialect()
+
+
+def _build_get_user_admin():
+    return select(models.User).filter(models.User.id == 1)
+
+
+def _build_get_users():
+    return select(models.User).order_by(models.User.id)
+
+
+def _build_lock_if_free():
+    return (
+        update(models.User)
+        .where(models.User.id == 1, models.User.is_free(datetime.now()))
+        .values(
+            locktime=datetime.now(),
+            fencing_token=models.User.fencing_token + 1,
+        )
+        .returning(models.User)
+    )
+
+
+def _build_claim():
+    free_id = (
+        select(models.User.id)
+        .where(
+            models.User.project_id == 1,
+            models.User.env == 'prod',
+            models.User.domain == 'canary',
+            models.User.is_free(datetime.now()),
+        )
+        .order_by(models.User.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return (
+        update(models.User)
+        .where(models.User.id == free_id)
+        .values(
+            locktime=datetime.now(),
+            fencing_token=models.User.fencing_token + 1,
+        )
+        .returning(models.User)
+    )
+
+
+# Statements as the crud functions built them per call, and the shared
+# statements that replaced them.
+STATEMENTS = {
+    'get_user_admin': (
+        _build_get_user_admin,
+        crud.GET_USER_ADMIN[(crud.QueryTypes.USER, 'id')],
+    ),
+    'get_users': (_build_get_users, crud.GET_USERS),
+    'lock_if_free': (_build_lock_if_free, crud.LOCK_IF_FREE),
+    'claim': (_build_claim, crud.CLAIM_FREE_USER),
+}
+
+
+def measure(func: Callable, number: int) -> float:
+    '''Returns the mean time of one call in microseconds.'''
+    started = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - started) / number * 1e6
+
+
+def bench_statement(build: Callable, shared, number: int) -> dict:
+    '''
+    Per request SQLAlchemy builds the statement (before only), derives
+    its cache key to look up the compiled form, and compiles it on a
+    cache miss. The cache key of a shared statement is memoized.
+    '''
+    return {
+        'before_us': measure(lambda: build()._generate_cache_key(), number),
+        'after_us': measure(lambda: shared._generate_cache_key(), number),
+        'compile_us': measure(
+            lambda: build().compile(dialect=DIALECT), number // 10 or 1
+        ),
+    }
+
+
+def format_report(report: dict[str, dict]) -> str:
+    lines = [
+        f'{"statement":<16} {"before µs":>10} {"after µs":>10} '
+        f'{"compile µs":>11}'
+    ]
+    for name, row in report.items():
+        lines.append(
+            f'{name:<16} {row["before_us"]:>10.2f} {row["after_us"]:>10.2f} '
+            f'{row["compile_us"]:>11.2f}'
+        )
+    return '\n'.join(lines)
+
+
+def main(argv: Union[list[str], None] = None) -> dict[str, dict]:
+    parser = argparse.ArgumentParser(
+        description='Compare per-call statement construction with the '
+        'shared crud statements.'
+    )
+    parser.add_argument(
+        '--number',
+        type=int,
+        default=10_000,
+        help='calls per measurement (default: 10000)',
+    )
+    parser.add_argument(
+        '--json', action='store_true', help='print the report as JSON'
+    )
+    args = parser.parse_args(argv)
+
+    report = {
+        name: bench_statement(build, shared, args.number)
+        for name, (build, shared) in STATEMENTS.items()
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return report
+
+
+if __name__ == '__main__':
+    main()
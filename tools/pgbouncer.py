@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import json
+import struct
+import time
+from typing import Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from sql_app.database import pgbouncer_kwargs
+
+SSL_REQUEST_CODE = 80877103
+GSSENC_REQUEST_CODE = 80877104
+BENCH_QUERY = text('SELECT count(*) FROM "user" WHERE project_id = :id')
+
+
+def _cstring(body: bytes, start: int = 0) -> tuple[str, int]:
+    '''Reads a null-terminated string, returns it and the next offset.'''
+    end = body.index(b'\0', start)
+    return body[start:end].decode('utf-8'), end + 1
+
+
+class _ClientState:
+    def __init__(self) -> None:
+        # Bumped at the end of every transaction: PgBouncer may hand the
+        # server connection to another client from then on.
+        self.epoch = 0
+        self.prepared: dict[str, int] = {}
+
+
+class TransactionPoolerStandIn:
+    '''
+    TCP proxy in front of Postgres checking that clients only rely on
+    what PgBouncer's transaction pooling keeps.
+
+    Every client connection is forwarded to a server connection of its
+    own, but a named prepared statement is treated as gone once the
+    transaction it was prepared in ends, and statement names must be
+    unique across all clients, as they would share server connections.
+    Anything else is recorded in `violations`.
+    '''
+
+    def __init__(self, upstream_host: str, upstream_port: int) -> None:
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.port = None
+        self.violations: list[str] = []
+        self.connections = 0
+        self._names: set[str] = set()
+        self._server = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def url(self, url: Union[str, URL]) -> URL:
+        '''The url with host and port replaced by the stand-in's.'''
+        return make_url(url).set(host='127.0.0.1', port=self.port)
+
+    async def _serve(self, client_reader, client_writer) -> None:
+        self.connections += 1
+        state = _ClientState()
+        try:
+            startup = await self._read_startup(client_reader, client_writer)
+            if startup is None:
+                return
+            server_reader, server_writer = await asyncio.open_connection(
+                self.upstream_host, self.upstream_port
+            )
+            server_writer.write(startup)
+            await asyncio.gather(
+                self._pipe(client_reader, server_writer, state, True),
+                self._pipe(server_reader, client_writer, state, False),
+            )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            client_writer.close()
+
+    async def _read_startup(self, reader, writer) -> Union[bytes, None]:
+        '''Declines SSL/GSS encryption and returns the startup message.'''
+        while True:
+            header = await reader.readexactly(4)
+            (length,) = struct.unpack('!i', header)
+            body = await reader.readexactly(length - 4)
+            (code,) = struct.unpack('!i', body[:4])
+            if code in (SSL_REQUEST_CODE, GSSENC_REQUEST_CODE):
+                writer.write(b'N')
+                await writer.drain()
+                continue
+            return header + body
+
+    async def _pipe(self, reader, writer, state, frontend: bool) -> None:
+        try:
+            while True:
+                header = await reader.readexactly(5)
+                (length,) = struct.unpack('!i', header[1:])
+                body = await reader.readexactly(length - 4)
+                if frontend:
+                    self._check_frontend(header[:1], body, state)
+                elif header[:1] == b'Z' and body == b'I':
+                    state.epoch += 1
+                writer.write(header + body)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _check_frontend(self, kind: bytes, body: bytes, state) -> None:
+        if kind == b'P':
+            name, _ = _cstring(body)
+            if not name:
+                return
+            if name in self._names:
+                self.violations.append(f'statement {name} prepared again')
+            self._names.add(name)
+            state.prepared[name] = state.epoch
+        elif kind == b'B':
+            _, offset = _cstring(body)
+            name, _ = _cstring(body, offset)
+            self._check_use(name, state)
+        elif kind == b'D' and body[:1] == b'S':
+            name, _ = _cstring(body, 1)
+            self._check_use(name, state)
+
+    def _check_use(self, name: str, state) -> None:
+        if name and state.prepared.get(name) != state.epoch:
+            self.violations.append(
+                f'statement {name} used outside its transaction'
+            )
+
+
+async def _run(engine: AsyncEngine, transactions: int) -> float:
+    '''Runs short read transactions, returns the mean time of one in ms.'''
+    started = time.perf_counter()
+    for i in range(transactions):
+        async with engine.begin() as conn:
+            await conn.execute(BENCH_QUERY, {'id': i})
+    return (time.perf_counter() - started) / transactions * 1000
+
+
+async def benchmark(
+    direct_url: Union[str, URL],
+    pgbouncer_url: Union[str, URL, None] = None,
+    transactions: int = 1000,
+    pool_size: int = 0,
+) -> dict:
+    '''
+    Compares transactions over a pooled direct connection with the
+    PgBouncer mode. Without pgbouncer_url the PgBouncer mode goes
+    through a TransactionPoolerStandIn in front of direct_url.
+    '''
+    direct_url = make_url(direct_url)
+    standin = None
+    if pgbouncer_url is None:
+        standin = TransactionPoolerStandIn(
+            direct_url.host or 'localhost', direct_url.port or 5432
+        )
+        await standin.start()
+        pgbouncer_url = standin.url(direct_url)
+    engines = {
+        'direct': create_async_engine(direct_url, pool_size=1),
+        'pgbouncer': create_async_engine(
+            pgbouncer_url, **pgbouncer_kwargs(pool_size)
+        ),
+    }
+    report = {}
+    try:
+        for name, engine in engines.items():
+            await _run(engine, 10)
+            report[f'{name}_ms'] = await _run(engine, transactions)
+    finally:
+        for engine in engines.values():
+            await engine.dispose()
+        if standin is not None:
+            await standin.stop()
+            report['violations'] = standin.violations
+    return report
+
+
+async def main(argv: Union[list[str], None] = None) -> dict:
+    parser = argparse.ArgumentParser(
+        description='Benchmark the PgBouncer mode against direct '
+        'connections.'
+    )
+    parser.add_argument('direct_url', help='Postgres url')
+    parser.add_argument(
+        '--pgbouncer-url',
+        help='PgBouncer url (default: a local stand-in proxy)',
+    )
+    parser.add_argument('--transactions', type=int, default=1000)
+    parser.add_argument(
+        '--pool-size',
+        type=int,
+        default=0,
+        help='DB_PGBOUNCER_POOL_SIZE to measure (default: 0, NullPool)',
+    )
+    args = parser.parse_args(argv)
+    report = await benchmark(
+        args.direct_url,
+        args.pgbouncer_url,
+        transactions=args.transactions,
+        pool_size=args.pool_size,
+    )
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Optional, Union
+
+from httpx import ASGITransport, AsyncClient
+
+NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+HOP_BY_HOP_HEADERS = {'host', 'content-length', 'connection'}
+
+
+@dataclass
+class RecordedRequest:
+    '''A single request read from a recorded traffic log.'''
+
+    ts: float
+    method: str
+    path: str
+    headers: dict = field(default_factory=dict)
+    body: Union[bytes, None] = None
+
+    @property
+    def endpoint(self) -> str:
+        '''Path with numeric ids collapsed, used for grouping latencies.'''
+        path = self.path.split('?', 1)[0]
+        return f'{self.method} {NUMERIC_SEGMENT.sub("/{id}", path)}'
+
+
+@dataclass
+class Sample:
+    endpoint: str
+    latency: float
+    status: Optional[int]
+
+
+def parse_record(line: str) -> RecordedRequest:
+    '''
+    Parses one JSONL line of recorded traffic.
+
+    Expected keys:
+        - ts: unix timestamp (seconds) when the request was received.
+        - method: HTTP method.
+        - path: request path, query string included.
+        - headers: optional mapping of request headers.
+        - json / body: optional JSON payload or raw string body.
+    '''
+    record = json.loads(line)
+    if 'json' in record:
+        body = json.dumps(record['json']).encode('utf-8')
+    elif record.get('body') is not None:
+        body = record['body'].encode('utf-8')
+    else:
+        body = None
+    headers = {
+        key: value
+        for key, value in (record.get('headers') or {}).items()
+        if key.lower() not in HOP_BY_HOP_HEADERS
+    }
+    return RecordedRequest(
+        ts=float(record['ts']),
+        method=record['method'].upper(),
+        path=record['path'],
+        headers=headers,
+        body=body,
+    )
+
+
+def load_records(path: str) -> list[RecordedRequest]:
+    '''Reads a JSONL traffic log, skipping blank lines, sorted by ts.'''
+    with open(path, encoding='utf-8') as log:
+        records = [parse_record(line) for line in log if line.strip()]
+    return sorted(records, key=lambda r: r.ts)
+
+
+def percentile(values: list[float], q: float) -> float:
+    '''Nearest-rank percentile of an already sorted list.'''
+    if not values:
+        return math.nan
+    rank = max(math.ceil(q / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+def summarize(samples: list[Sample]) -> dict[str, dict]:
+    '''Groups samples per endpoint and computes a latency distribution.'''
+    grouped = defaultdict(list)
+    for sample in samples:
+        grouped[sample.endpoint].append(sample)
+    report = {}
+    for endpoint, endpoint_samples in sorted(grouped.items()):
+        latencies = sorted(s.latency * 1000 for s in endpoint_samples)
+        report[endpoint] = {
+            'count': len(latencies),
+            'errors': sum(
+                1
+                for s in endpoint_samples
+                if s.status is None or s.status >= 500
+            ),
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1],
+        }
+    return report
+
+
+def format_report(report: dict[str, dict], elapsed: float) -> str:
+    lines = [
+        f'{"endpoint":<40} {"count":>7} {"errors":>6} '
+        f'{"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} {"max ms":>9}'
+    ]
+    total = 0
+    for endpoint, stats in report.items():
+        total += stats['count']
+        lines.append(
+            f'{endpoint:<40} {stats["count"]:>7} {stats["errors"]:>6} '
+            f'{stats["p50_ms"]:>9.2f} {stats["p90_ms"]:>9.2f} '
+            f'{stats["p99_ms"]:>9.2f} {stats["max_ms"]:>9.2f}'
+        )
+    rate = total / elapsed if elapsed else math.inf
+    lines.append(f'{total} requests in {elapsed:.2f}s ({rate:.1f} req/s)')
+    return '\n'.join(lines)
+
+
+async def replay(
+    client: AsyncClient,
+    records: list[RecordedRequest],
+    speed: float = 1.0,
+    concurrency: int = 64,
+    token: Union[str, None] = None,
+) -> list[Sample]:
+    '''
+    Replays recorded requests through the client.
+
+    Arguments:
+        - httpx AsyncClient bound to the target (ASGI app or URL).
+        - records sorted by ts.
+        - speed: time-scaling factor, 1 keeps the original pacing,
+          10 replays ten times faster, 0 sends as fast as possible.
+        - concurrency: maximum number of requests in flight.
+        - token: optional bearer token replacing recorded Authorization.
+
+    A list of latency samples is returned.
+    '''
+    if not records:
+        return []
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+    origin = records[0].ts
+    started = time.perf_counter()
+
+    async def send(record: RecordedRequest) -> None:
+        headers = dict(record.headers)
+        if token is not None:
+            headers['Authorization'] = 'Bearer ' + token
+        async with semaphore:
+            request_started = time.perf_counter()
+            try:
+                response = await client.request(
+                    record.method,
+                    record.path,
+                    content=record.body,
+                    headers=headers,
+                )
+                status = response.status_code
+            except Exception:
+                status = None
+            samples.append(
+                Sample(
+                    endpoint=record.endpoint,
+                    latency=time.perf_counter() - request_started,
+                    status=status,
+                )
+            )
+
+    tasks = []
+    for record in records:
+        if speed > 0:
+            delay = (record.ts - origin) / speed - (
+                time.perf_counter() - started
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(record)))
+    await asyncio.gather(*tasks)
+    return samples
+
+
+def make_client(target: str) -> AsyncClient:
+    '''
+    Builds a client for the replay target.
+
+    A target starting with http:// or https:// is treated as a URL,
+    anything else as an ASGI application import path ("module:attr").
+    '''
+    if target.startswith(('http://', 'https://')):
+        return AsyncClient(base_url=target, timeout=None)
+    module_name, _, attr = target.partition(':')
+    app = getattr(importlib.import_module(module_name), attr or 'app')
+    return AsyncClient(
+        transport=ASGITransport(app=app),
+        base_url='http://replay',
+        timeout=None,
+    )
+
+
+def parse_speed(value: str) -> float:
+    '''Accepts "1", "10x" or "max" (as fast as possible).'''
+    if value.lower() in ('max', 'asap', '0'):
+        return 0.0
+    return float(value.lower().rstrip('x'))
+
+
+async def main(argv: Union[list[str], None] = None) -> dict[str, dict]:
+    parser = argparse.ArgumentParser(
+        description='Replay recorded JSONL traffic and report latencies.'
+    )
+    parser.add_argument('log', help='path to a JSONL traffic log')
+    parser.add_argument(
+        '--target',
+        default='main:app',
+        help='ASGI app import path or base URL (default: main:app)',
+    )
+    parser.add_argument(
+        '--speed',
+        type=parse_speed,
+        default=1.0,
+        help='time-scaling: 1x, 10x, ... or "max" (default: 1x)',
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=64,
+        help='maximum requests in flight (default: 64)',
+    )
+    parser.add_argument(
+        '--token', help='bearer token replacing recorded Authorization'
+    )
+    parser.add_argument(
+        '--json', action='store_true', help='print the report as JSON'
+    )
+    args = parser.parse_args(argv)
+
+    records = load_records(args.log)
+    started = time.perf_counter()
+    async with make_client(args.target) as client:
+        samples = await replay(
+            client,
+            records,
+            speed=args.speed,
+            concurrency=args.concurrency,
+            token=args.token,
+        )
+    elapsed = time.perf_counter() - started
+    report = summarize(samples)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report, elapsed))
+    return report
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,198 @@
+import logging
+import threading
+from contextlib import nullcontext
+from typing import Any, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import get_settings
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        ConsoleSpanExporter,
+        SpanExporter,
+        SpanExportResult,
+    )
+    from opentelemetry.sdk.trace.sampling import (
+        ParentBased,
+        TraceIdRatioBased,
+    )
+    from opentelemetry.trace import SpanKind, StatusCode
+except ImportError:  # tracing is optional
+    trace = None
+    SpanExporter = object
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'botfarm'
+# Execution option naming the spans of a statement's queries.
+STATEMENT_NAME = 'statement_name'
+
+_provider = None
+
+
+def span(name: str, **attributes: Any):
+    '''
+    Context manager for a child span of the current one. A no-op when
+    opentelemetry is not installed or tracing is not configured.
+    '''
+    if _provider is None:
+        return nullcontext()
+    return _provider.get_tracer(__name__).start_as_current_span(
+        name, attributes=attributes
+    )
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    '''Appends finished spans to a file, one JSON object per line.'''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence) -> 'SpanExportResult':
+        lines = ''.join(s.to_json(indent=None) + '\n' for s in spans)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(lines)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+
+def _exporter(name: str) -> 'SpanExporter':
+    settings = get_settings()
+    if name == 'otlp':
+        # Endpoint, headers etc. come from the standard OTEL_EXPORTER_OTLP_*
+        # environment variables.
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        return OTLPSpanExporter()
+    if name == 'file':
+        return JsonLinesSpanExporter(settings.tracing_file)
+    return ConsoleSpanExporter()
+
+
+def configure_tracing() -> bool:
+    '''
+    Installs a tracer provider exporting to TRACING_EXPORTER with
+    TRACING_SAMPLE_RATIO of the traces started here sampled (incoming
+    traceparent headers decide for the requests carrying one).
+
+    Returns False when tracing is disabled.
+    '''
+    global _provider
+    settings = get_settings()
+    if settings.tracing_exporter == 'none' or _provider is not None:
+        return _provider is not None
+    if trace is None:
+        logger.warning('TRACING_EXPORTER is set but opentelemetry is missing')
+        return False
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(settings.tracing_sample_ratio)),
+    )
+    provider.add_span_processor(
+        BatchSpanProcessor(_exporter(settings.tracing_exporter))
+    )
+    _provider = provider
+    if not event.contains(
+        Engine, 'before_cursor_execute', _before_cursor_execute
+    ):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    return True
+
+
+async def shutdown_tracing() -> None:
+    '''Exports the spans still buffered.'''
+    global _provider
+    if _provider is not None:
+        _provider.shutdown()
+        _provider = None
+
+
+class TracingMiddleware:
+    '''
+    ASGI middleware wrapping every HTTP request in a server span named
+    after the matched route, continuing the caller's trace if any.
+    '''
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or _provider is None:
+            await self.app(scope, receive, send)
+            return
+        headers = {
+            key.decode('latin-1'): value.decode('latin-1')
+            for key, value in scope['headers']
+        }
+        tracer = _provider.get_tracer(__name__)
+        with tracer.start_as_current_span(
+            scope['method'],
+            context=propagate.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes={
+                'http.method': scope['method'],
+                'http.target': scope['path'],
+            },
+        ) as server_span:
+
+            async def send_with_status(message: Message) -> None:
+                if message['type'] == 'http.response.start':
+                    status = message['status']
+                    server_span.set_attribute('http.status_code', status)
+                    if status >= 500:
+                        server_span.set_status(StatusCode.ERROR)
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get('route')
+                if route is not None:
+                    server_span.set_attribute('http.route', route.path)
+                    server_span.update_name(f'{scope["method"]} {route.path}')
+
+
+def _before_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+) -> None:
+    if _provider is None:
+        return
+    name = context.execution_options.get(STATEMENT_NAME)
+    if name is None:
+        name = statement.split(None, 1)[0].upper() if statement else 'SQL'
+    context._tracing_span = _provider.get_tracer(__name__).start_span(
+        name,
+        kind=SpanKind.CLIENT,
+        attributes={'db.system': 'postgresql', 'db.statement': statement},
+    )
+
+
+def _after_cursor_execute(
+    conn, cursor, statement, parameters, context, executemany
+) -> None:
+    query_span = getattr(context, '_tracing_span', None)
+    if query_span is not None:
+        query_span.end()
+
+
+def _handle_error(exception_context) -> None:
+    context = exception_context.execution_context
+    query_span = getattr(context, '_tracing_span', None)
+    if query_span is not None:
+        query_span.record_exception(exception_context.original_exception)
+        query_span.set_status(StatusCode.ERROR)
+        query_span.end()